@@ -1,32 +1,61 @@
 import os
-import pandas as pd
-from flask import Flask, render_template, request, redirect, url_for, flash
 import sys
+import json
+import time
+import queue
+import datetime
+import threading
+from flask import (Flask, render_template, request, redirect, url_for, flash, send_from_directory, abort, g,
+                   stream_with_context)
+import metrics
+import progress
+import cache_manager
+import season
+from catalog import Catalog
+from jobs import JobQueue, QueueFull
+from render_cache import plot_cache, render_key, IMAGE_FORMATS, RENDER_VERSION
 
 # Add the directory containing the script.py to Python's path
 sys.path.append(os.getcwd())
 
-# Import the get_race_data function directly
-# Option 1: If you renamed paste.txt to script.py
-try:
-    from script import get_race_data
-except ImportError:
-    # Option 2: If your file is still paste.txt, create a function to call it
-    def get_race_data(input_data):
-        # Import the script contents at runtime
-        with open('paste.txt', 'r') as f:
-            script_code = f.read()
-        
-        # Add the function to the globals
-        script_globals = globals().copy()
-        exec(script_code, script_globals)
-        
-        # Call the get_race_data function from the script
-        return script_globals['get_race_data'](input_data)
+# script.py pulls in fastf1, matplotlib, pandas and numpy, which takes seconds, so it is
+# not imported with the app. F1_STARTUP picks when it is loaded:
+#   background - in a warm-up thread started with the app (default)
+#   lazy       - by the first request that needs it
+#   eager      - before the app finishes importing
+STARTUP_MODE = os.environ.get('F1_STARTUP', 'background')
+STARTED = time.time()
+warmup = {'state': 'pending', 'seconds': None, 'error': None}
+
+def engine():
+    import script
+    return script
+
+# Imports the analysis code and renders a throwaway figure so the first real plot
+# doesn't pay for the font cache and backend setup
+def warm_up():
+    warmup['state'] = 'warming'
+    start = time.perf_counter()
+    try:
+        engine().warm_up()
+    except Exception as e:
+        warmup['state'] = 'failed'
+        warmup['error'] = str(e)
+    else:
+        warmup['state'] = 'ready'
+    warmup['seconds'] = round(time.perf_counter() - start, 3)
 
 app = Flask(__name__)
 app.secret_key = "formula1_telemetry_app"  # For flash messages
 
+# Render jobs run in a process pool so slow analyses don't block the web worker
+# each job sends back its stage timings, which are recorded here for /metrics
+jobs = JobQueue('script.render_job',
+                workers=int(os.environ.get('F1_WORKERS', 2)),
+                timeout=int(os.environ.get('F1_JOB_TIMEOUT', 120)),
+                max_queue=int(os.environ.get('F1_MAX_QUEUE', 16)),
+                on_result=lambda result: metrics.observe(result['metrics']))
+
 # Set up paths
 CWD = os.getcwd()
 DATA_PATH = os.path.join(CWD, 'formula', 'data')
@@ -35,43 +64,72 @@ PLOT_PATH = os.path.join(CWD, 'formula', 'plot')
 # Create directories if they don't exist
 os.makedirs(DATA_PATH, exist_ok=True)
 os.makedirs(PLOT_PATH, exist_ok=True)
-os.makedirs(os.path.join(app.static_folder, 'plot'), exist_ok=True)
-
-# Load CSV data
-try:
-    events = pd.read_csv(os.path.join(DATA_PATH, 'events.csv'))
-    drivers = pd.read_csv(os.path.join(DATA_PATH, 'drivers.csv'))
-    race_laps = pd.read_csv(os.path.join(DATA_PATH, 'laps.csv'))
-except FileNotFoundError as e:
-    print(f"Error loading CSV files: {e}")
-    # Create empty DataFrames if files don't exist
-    events = pd.DataFrame()
-    drivers = pd.DataFrame()
-    race_laps = pd.DataFrame()
 
-# Prepare static options
-years = ['Select Year']
-if not events.empty:
-    years += list(events.columns[1:])
+# Events, drivers and lap counts from the CSV files, re-read whenever they change
+catalog = Catalog(DATA_PATH)
 
+# Prepare static options
 sessions = ['Race', 'Qualifying', 'FP1', 'FP2', 'FP3']
-analysis_options = ['Lap Time', 'Fastest Lap', 'Fastest Sectors', 'Full Telemetry']
+analysis_options = ['Lap Time', 'Fastest Lap', 'Fastest Sectors', 'Full Telemetry', 'Driver Comparison']
+
+# Lap to analyse: the chosen one, else lap 1 (every driver's fastest lap for a driver comparison)
+def requested_lap(values, field):
+    default = 'fastest' if values.get('analysis') == 'Driver Comparison' else "1"
+    return values.get(field) or default
 
-# Prepopulate dropdowns using a default year (if available)
-default_year = years[1] if len(years) > 1 else None
-if default_year and not events.empty:
-    grand_prix_options = events[default_year].dropna().tolist()
-    driver_options = drivers[default_year].dropna().tolist()
-else:
-    grand_prix_options = []
-    driver_options = []
+# Analysis-specific parameters, which follow the lap in the input data:
+# further drivers of a driver comparison, the minisector count of fastest sectors
+def extra_input(values):
+    if values.get('analysis') == 'Driver Comparison':
+        return [name for name in values.getlist('drivers') if name]
+    if values.get('analysis') == 'Fastest Sectors':
+        count = values.get('minisectors', type=int)
+        return [str(count)] if count else []
+    return []
+
+# Renders the form with dropdowns for the chosen year, or the latest year if none was chosen
+def render_index(selected, **context):
+    years = catalog.years()
+    year = selected.get('year') if selected.get('year') in years else (years[0] if years else None)
+    return render_template("index.html",
+                           years=['Select Year'] + years,
+                           sessions=sessions,
+                           analysis_options=analysis_options,
+                           driver_options=catalog.drivers(year),
+                           grand_prix_options=catalog.events(year),
+                           lap_options=catalog.lap_options(selected.get('grand_prix')),
+                           selected=selected,
+                           selected_year=year,
+                           **context)
+
+# Every request collects stage timings, reported in a Server-Timing header and on /metrics
+@app.before_request
+def start_metrics():
+    if request.endpoint != 'prometheus_metrics':
+        metrics.start_request(endpoint=request.endpoint or 'unknown')
+
+@app.after_request
+def finish_metrics(response):
+    summary = metrics.finish_request()
+    if summary is not None:
+        metrics.observe(summary)
+        timing = metrics.server_timing(summary)
+        # a finished job also reports the timings of the worker that rendered it
+        if 'job_metrics' in g:
+            timing = ', '.join(filter(None, [timing, metrics.server_timing(g.job_metrics)]))
+        if timing:
+            response.headers['Server-Timing'] = timing
+    return response
 
 @app.route("/", methods=['GET', 'POST'])
 def index():
     image_file = None
-    lap_options = None
+    job_id = None
     error = None
     
+    # The form (or ?year=&grand_prix= on a GET) picks the dropdown contents
+    selected = request.form if request.method == 'POST' else request.args
+    
     if request.method == 'POST':
         # Retrieve form data
         year = request.form.get('year')
@@ -80,82 +138,347 @@ def index():
         driver1 = request.form.get('driver1')
         driver2 = request.form.get('driver2')
         analysis = request.form.get('analysis')
-        lap_number = request.form.get('lap_number') or "1"  # Default to lap 1 if not provided
+        lap_number = requested_lap(request.form, 'lap_number')
         
         # Basic validation
         if year == 'Select Year' or not grand_prix or not driver1 or not driver2:
             error = "Please fill out all required fields"
-            return render_template("index.html", years=years, sessions=sessions,
-                               analysis_options=analysis_options, driver_options=driver_options,
-                               grand_prix_options=grand_prix_options, error=error,
-                               lap_options=lap_options)
-        
+            return render_index(selected, error=error)
+        # Checked before the analysis becomes a metrics label, so junk cannot add new series
+        if analysis not in analysis_options:
+            error = "Please choose one of the listed analyses"
+            return render_index(selected, error=error)
+
         # Prepare data for analysis
-        input_data = [year, grand_prix, session_type, driver1, driver2, analysis, lap_number]
+        input_data = [year, grand_prix, session_type, driver1, driver2, analysis, lap_number,
+                      *extra_input(request.form)]
         
+        # Show a cached plot straight away, otherwise queue the analysis and let the page poll for it
+        key = render_key(input_data)
+        with metrics.span('plot_cache_lookup'):
+            cached = plot_cache.get(key) is not None
+        metrics.set_labels(analysis=analysis, cache='hit' if cached else 'miss')
+        if cached:
+            image_file = plot_cache.filename(key)
+        else:
+            try:
+                with metrics.span('job_submit'):
+                    job_id = jobs.submit(input_data)
+            except QueueFull:
+                error = "The server is busy, please try again in a moment"
+    
+    return render_index(selected, image_file=image_file, job_id=job_id, error=error)
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queues an analysis and returns its job id without waiting for it"""
+    input_data = [request.form.get('year'), request.form.get('grand_prix'), request.form.get('session'),
+                  request.form.get('driver1'), request.form.get('driver2'), request.form.get('analysis'),
+                  requested_lap(request.form, 'lap_number'), *extra_input(request.form)]
+    if input_data[0] in (None, 'Select Year') or not all(input_data[1:6]):
+        return {'error': 'Please fill out all required fields'}, 400
+    if input_data[5] not in analysis_options:
+        return {'error': 'Unknown analysis type'}, 400
+    
+    try:
+        job_id = jobs.submit(input_data)
+    except QueueFull:
+        return {'error': 'Too many pending jobs'}, 503, {'Retry-After': '5'}
+    
+    return {'job_id': job_id, 'status_url': url_for('job_status', job_id=job_id)}, 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Reports whether a job is queued, running, done or failed"""
+    job = jobs.status(job_id)
+    if job is None:
+        return {'error': 'Unknown job'}, 404
+    
+    response = {'job_id': job_id, 'state': job['state']}
+    if job['state'] == 'done':
+        response['image_url'] = url_for('plot_image', filename=plot_cache.filename(job['result']['key']))
+        g.job_metrics = job['result']['metrics']
+    elif job['state'] == 'failed':
+        response['error'] = f"Error during analysis: {job['error']}"
+    return response
+
+@app.route('/plot/<path:filename>')
+def plot_image(filename):
+    """Serves a rendered plot from the plot cache"""
+    if filename.startswith('.'):
+        abort(404)
+    return send_from_directory(plot_cache.directory, filename)
+
+# Analysis parameters of a GET request, in the order get_race_data expects
+def request_input(args):
+    return [args.get('year'), args.get('grand_prix'), args.get('session', 'Race'),
+            args.get('driver1'), args.get('driver2'), args.get('analysis'), requested_lap(args, 'lap'),
+            *extra_input(args)]
+
+# ETag of a response, from its parameters and the version of the code that produced it,
+# so browsers revalidating after a RENDER_VERSION bump get the new output instead of a 304
+def response_etag(values):
+    return f"v{RENDER_VERSION}-{render_key(values)}"
+
+# Sessions never change once they are over, so the parameters identify the response.
+# Past seasons are kept for a day, the current one for an hour in case its data is corrected.
+# Neither is immutable: browsers revalidate afterwards, which costs a 304 until a
+# RENDER_VERSION bump changes the ETag and they get the new output
+def cached_response(response, etag, year):
+    response.set_etag(etag)
+    response.cache_control.public = True
+    if str(year).isdigit() and int(year) < datetime.date.today().year:
+        response.cache_control.max_age = 24 * 3600
+    else:
+        response.cache_control.max_age = 3600
+    return response
+
+@app.route('/api/data')
+def analysis_data():
+    """JSON series behind an analysis, for drawing the chart in the browser"""
+    input_data = request_input(request.args)
+    if input_data[0] in (None, 'Select Year') or not all(input_data[1:6]):
+        return {'error': 'Missing required parameters'}, 400
+    if input_data[5] not in analysis_options:
+        return {'error': 'Unknown analysis type'}, 400
+    
+    # Point budget per line, capped so a single request can't ask for everything,
+    # and at least the 3 points downsampling needs (0 or less would mean no downsampling)
+    points = min(max(request.args.get('points', 1000, type=int), 3), 20000)
+    
+    etag = response_etag(input_data + [points])
+    if etag in request.if_none_match:
+        return cached_response(app.response_class(status=304), etag, input_data[0])
+    
+    try:
+        data = engine().get_analysis_data(input_data, points)
+    except Exception as e:
+        return {'error': f"Error during analysis: {str(e)}"}, 500
+    
+    return cached_response(app.json.response(data), etag, input_data[0])
+
+@app.route('/image')
+def image():
+    """Renders a plot straight into the response, as format=png (default), webp or svg"""
+    input_data = request_input(request.args)
+    fmt = request.args.get('format', 'png')
+    if input_data[0] in (None, 'Select Year') or not all(input_data[1:6]):
+        return {'error': 'Missing required parameters'}, 400
+    if input_data[5] not in analysis_options:
+        return {'error': 'Unknown analysis type'}, 400
+    if fmt not in IMAGE_FORMATS:
+        return {'error': f"Unsupported format, use one of {', '.join(IMAGE_FORMATS)}"}, 400
+    
+    # Answered before any session is touched when the browser already has the image
+    etag = response_etag(input_data + [fmt])
+    if etag in request.if_none_match:
+        return cached_response(app.response_class(status=304), etag, input_data[0])
+    
+    try:
+        data = engine().get_image(input_data, fmt)
+    except Exception as e:
+        return {'error': f"Error during analysis: {str(e)}"}, 500
+    
+    return cached_response(app.response_class(data, mimetype=IMAGE_FORMATS[fmt]), etag, input_data[0])
+
+# Seconds between keep-alive comments on an idle progress stream; a write to a
+# client that has gone away is how the server notices the disconnect
+PROGRESS_HEARTBEAT = 1.0
+
+# Data loads for /progress run on a thread of this process, where /api/data then finds what
+# they loaded; like the job queue, only so many can be in flight at once
+data_loads = threading.BoundedSemaphore(jobs.max_queue)
+
+# Loads what /api/data reads from on a progress thread, sending ('progress' | 'finished', body)
+# to events, the same messages a job listener gets
+def load_with_progress(tracker, events, input_data):
+    try:
+        with progress.listen(tracker):
+            engine().load_source(input_data)
+        events.put(('finished', {'state': 'done'}))
+    except progress.Cancelled:
+        pass
+    except Exception as e:
+        events.put(('finished', {'state': 'failed', 'error': str(e)}))
+    finally:
+        data_loads.release()
+
+@app.route('/progress')
+def progress_events():
+    """Runs an analysis while streaming its stages as Server-Sent Events, ending with the result URL"""
+    input_data = request_input(request.args)
+    kind = request.args.get('kind', 'image')
+    if input_data[0] in (None, 'Select Year') or not all(input_data[1:6]):
+        return {'error': 'Missing required parameters'}, 400
+    if input_data[5] not in analysis_options:
+        return {'error': 'Unknown analysis type'}, 400
+    if kind not in ('image', 'data'):
+        return {'error': "Unsupported kind, use image or data"}, 400
+    
+    events = queue.Queue()
+    if kind == 'image':
+        # Rendered in the job pool, whose workers send their stages back to the listener
         try:
-            # Call the analysis function (this will generate a plot)
-            get_race_data(input_data)
-            
-            # Determine image filename
-            image_file = f"{analysis}.png"
-            
-            # Copy the plot image to the static folder for serving
-            src_img = os.path.join(PLOT_PATH, image_file)
-            dst_img = os.path.join(app.static_folder, 'plot', image_file)
-            
-            if os.path.exists(src_img):
-                from shutil import copyfile
-                copyfile(src_img, dst_img)
-            else:
-                error = f"Plot generation failed. Image file not found: {src_img}"
-                image_file = None
-                
-        except Exception as e:
-            error = f"Error during analysis: {str(e)}"
-            image_file = None
-        
-        # Update lap options based on the grand prix selection
-        if grand_prix and grand_prix != "" and not race_laps.empty:
-            total_laps = race_laps.loc[race_laps['event'] == grand_prix, 'laps'].values
-            if total_laps.size:
-                lap_options = ['Select Lap'] + list(map(str, range(1, int(total_laps[0]) + 1)))
-    
-    # For GET requests, pre-populate lap options if possible
-    elif request.args.get('grand_prix') and not race_laps.empty:
-        grand_prix = request.args.get('grand_prix')
-        total_laps = race_laps.loc[race_laps['event'] == grand_prix, 'laps'].values
-        if total_laps.size:
-            lap_options = ['Select Lap'] + list(map(str, range(1, int(total_laps[0]) + 1)))
-    
-    return render_template("index.html", 
-                           years=years, 
-                           sessions=sessions,
-                           analysis_options=analysis_options, 
-                           driver_options=driver_options,
-                           grand_prix_options=grand_prix_options, 
-                           image_file=image_file,
-                           lap_options=lap_options,
-                           error=error)
-
-@app.route('/update_options', methods=['POST'])
+            job_id = jobs.submit(input_data, listener=lambda name, body: events.put((name, body)))
+        except QueueFull:
+            return {'error': 'Too many pending jobs'}, 503, {'Retry-After': '5'}
+        stop = lambda: jobs.cancel(job_id)
+    else:
+        if not data_loads.acquire(blocking=False):
+            return {'error': 'Too many pending jobs'}, 503, {'Retry-After': '5'}
+        tracker = progress.Tracker(lambda **event: events.put(('progress', event)))
+        threading.Thread(target=load_with_progress, args=(tracker, events, input_data),
+                         name='progress', daemon=True).start()
+        stop = tracker.cancel
+    
+    def stream():
+        try:
+            while True:
+                try:
+                    name, body = events.get(timeout=PROGRESS_HEARTBEAT)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if name == 'progress':
+                    yield f"event: progress\ndata: {json.dumps(body)}\n\n"
+                    continue
+                if body['state'] != 'done':
+                    name, body = 'error', {'error': f"Error during analysis: {body['error']}"}
+                elif kind == 'image':
+                    name, body = 'done', {'percent': 100, 'image_url': url_for(
+                        'plot_image', filename=plot_cache.filename(body['result']['key']))}
+                else:
+                    args = request.args.to_dict(flat=False)
+                    args.pop('kind', None)
+                    name, body = 'done', {'percent': 100, 'data_url': url_for('analysis_data', **args)}
+                yield f"event: {name}\ndata: {json.dumps(body)}\n\n"
+                return
+        finally:
+            # Ended or abandoned by the client: stop work nobody is waiting for
+            stop()
+    
+    return app.response_class(stream_with_context(stream()), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/live')
+def live_delta():
+    """What changed in the live session after sequence number ?since= (0 for everything)"""
+    if live_session is None:
+        return {'error': 'No live session running'}, 404
+    since = request.args.get('since', 0, type=int)
+    telemetry = request.args.get('telemetry', '1') != '0'
+    response = app.json.response(live_session.delta(since, telemetry))
+    response.cache_control.no_store = True
+    return response
+
+@app.route('/live/events')
+def live_events():
+    """Pushes live session deltas as Server-Sent Events, each one only what the client has not seen"""
+    if live_session is None:
+        return {'error': 'No live session running'}, 404
+    # A reconnecting EventSource sends the id of the last event it got
+    since = int(request.headers.get('Last-Event-ID') or request.args.get('since', 0, type=int) or 0)
+    telemetry = request.args.get('telemetry', '1') != '0'
+    
+    def stream():
+        seen = since
+        while True:
+            seq = live_session.wait(seen, timeout=PROGRESS_HEARTBEAT)
+            if seq <= seen:
+                if live_session.finished:
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            delta = live_session.delta(seen, telemetry)
+            seen = delta['seq']
+            yield f"id: {seen}\nevent: delta\ndata: {json.dumps(delta)}\n\n"
+    
+    return app.response_class(stream(), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/season')
+def season_query():
+    """Season-wide pace or minisector wins, answered from the per-session summaries"""
+    year = request.args.get('year')
+    session_type = request.args.get('session', 'Race')
+    name = request.args.get('query', 'pace')
+    if year not in catalog.years():
+        return {'error': 'Invalid year selection'}, 400
+    if name not in season.QUERIES:
+        return {'error': f"Unknown query, use one of {', '.join(season.QUERIES)}"}, 400
+    
+    # Summaries are rebuilt offline with `python season.py update`, so only a short cache
+    response = app.json.response(season.query(name, year, catalog.events(year), session_type))
+    response.cache_control.max_age = 60
+    return response
+
+@app.route('/health')
+def health():
+    """Liveness check; with ?ready=1 it answers 503 until the analysis code is loaded"""
+    ready = warmup['state'] == 'ready' or STARTUP_MODE == 'lazy'
+    body = {'status': 'ok', 'ready': ready, 'startup': STARTUP_MODE, 'warmup': warmup['state'],
+            'warmup_seconds': warmup['seconds'], 'uptime': round(time.time() - STARTED, 3)}
+    if warmup['error']:
+        body['error'] = warmup['error']
+    if request.args.get('ready') and not ready:
+        return body, 503
+    return body
+
+@app.route('/admin/cache')
+def cache_admin():
+    """Disk usage of the fastf1 cache, per session"""
+    # F1_ADMIN_TOKEN opens the endpoint to other hosts, otherwise it is local only
+    token = os.environ.get('F1_ADMIN_TOKEN')
+    if token:
+        if request.headers.get('X-Admin-Token', request.args.get('token')) != token:
+            abort(403)
+    elif request.remote_addr not in ('127.0.0.1', '::1'):
+        abort(403)
+    return cache_manager.stats()
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Stage timing and memory histograms in the Prometheus text format"""
+    return metrics.render_prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/update_options', methods=['GET', 'POST'])
 def update_options():
     """AJAX endpoint to update dropdowns based on selections"""
-    selected_year = request.form.get('year')
+    selected_year = request.values.get('year')
     
-    if selected_year and selected_year != 'Select Year' and not events.empty:
-        # Get grand prix options for the selected year
-        grand_prix_options = events[selected_year].dropna().tolist()
-        
-        # Get driver options for the selected year
-        driver_options = drivers[selected_year].dropna().tolist()
-        
-        return {
-            'grand_prix_options': grand_prix_options,
-            'driver_options': driver_options
-        }
+    if selected_year not in catalog.years():
+        return {'error': 'Invalid year selection'}, 400
     
-    return {'error': 'Invalid year selection'}
+    # The options only change when the CSV files do, so clients can revalidate cheaply
+    etag = catalog.etag(selected_year)
+    if etag in request.if_none_match:
+        return '', 304, {'ETag': f'"{etag}"'}
+    
+    response = app.json.response(catalog.options(selected_year))
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+# Replays a recorded live timing feed into memory, standing in for the live service
+# F1_LIVE_FEED is the recording, F1_LIVE_SPEED how many times faster than real time it plays
+def start_live_replay(path, speed):
+    import live
+    session = live.LiveSession()
+    threading.Thread(target=live.replay, args=(session, path, speed), name='live-replay', daemon=True).start()
+    return session
+
+# Job pool workers are spawned, and import this module again as __mp_main__ when the app
+# is run as a script; they render jobs only, so they skip the live replay and warm-up
+IN_WORKER = __name__ == '__mp_main__'
+
+live_session = None
+if os.environ.get('F1_LIVE_FEED') and not IN_WORKER:
+    live_session = start_live_replay(os.environ['F1_LIVE_FEED'], float(os.environ.get('F1_LIVE_SPEED', 1.0)))
+
+if STARTUP_MODE == 'eager' and not IN_WORKER:
+    warm_up()
+elif STARTUP_MODE == 'background' and not IN_WORKER:
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,285 @@
+# offline benchmarks for the analysis pipeline
+#
+#   python benchmark.py --output before.json
+#   python benchmark.py --baseline before.json --threshold 0.2
+#
+# only sessions that are already in the local fastf1 caches are used, nothing is
+# downloaded. every benchmark records wall time, the tracemalloc peak and the number
+# of memory blocks it left allocated; with --baseline the run fails when a benchmark
+# got slower or hungrier than the threshold allows
+#
+# app startup is measured in a fresh interpreter and checked against --startup-budget
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+
+# jobs run inline so the index() benchmark measures the whole render
+os.environ['F1_WORKERS'] = '0'
+# the benchmarks import the analysis code themselves
+os.environ['F1_STARTUP'] = 'lazy'
+
+# (year, grand prix, session, fastf1 cache directory) of the sessions kept for benchmarking
+CASES = [
+    ('2023', 'Australian Grand Prix', 'Race', os.path.join('formula', 'cache')),
+    ('2024', 'Bahrain Grand Prix', 'Race', os.path.join('formula', 'cache')),
+    ('2024', 'Australian Grand Prix', 'Race', os.path.join('formula', 'cache')),
+    ('2024', 'Miami Grand Prix', 'Race', os.path.join('formula', 'cache')),
+]
+
+DRIVERS = ('1 Max Verstappen', '11 Sergio Perez')
+LAP = '5'
+
+PLOTS = {
+    'Lap Time': 'plot_laptime',
+    'Fastest Lap': 'plot_fastest_lap',
+    'Fastest Sectors': 'plot_fastest_sectors',
+    'Full Telemetry': 'plot_full_telemetry',
+}
+
+# differences smaller than this are treated as noise, whatever the threshold
+MIN_SECONDS = 0.01
+MIN_BYTES = 1024 * 1024
+
+STARTUP_STAGES = ('import', 'first_response', 'ready')
+
+# seconds a fresh app may take to answer its first request, also checked by the tests
+STARTUP_BUDGET = 1.0
+
+# run in a fresh interpreter: time to import the app, to answer /health and until warm-up is done
+STARTUP_CODE = '''
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+client.get('/health')
+responded = time.perf_counter()
+while client.get('/health?ready=1').status_code == 503 and time.perf_counter() - start < 120:
+    time.sleep(0.01)
+print(json.dumps({'import': imported - start, 'first_response': responded - start,
+                  'ready': time.perf_counter() - start, 'warmup': app.warmup}))
+'''
+
+
+# runs fn once under tracemalloc (which doubles as a warm-up) and then `repeat`
+# times untraced for the timings; setup runs untimed before every call
+def measure(fn, setup=None, repeat=3):
+    if setup:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        # only allocations made since start() are traced, so these are the blocks fn kept
+        blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    finally:
+        tracemalloc.stop()
+
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {'seconds': statistics.median(times), 'min_seconds': min(times),
+            'peak_bytes': peak, 'retained_blocks': blocks}
+
+
+# points fastf1 at the cache directory of a case, without network access
+def use_cache(script, cache_dir):
+    script.ff1.Cache.enable_cache(cache_dir)
+    script.ff1.Cache.offline_mode(True)
+
+
+# cold start of the app in background warm-up mode, median of `repeat` fresh processes
+def measure_startup(repeat=3):
+    env = dict(os.environ, F1_STARTUP='background')
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', STARTUP_CODE], env=env, capture_output=True, text=True,
+                                check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    if any(run['warmup']['state'] != 'ready' for run in runs):
+        raise RuntimeError(f"warm-up failed: {runs[-1]['warmup']['error']}")
+    return {name: {'seconds': statistics.median(run[name] for run in runs),
+                   'min_seconds': min(run[name] for run in runs), 'peak_bytes': 0, 'retained_blocks': 0}
+            for name in STARTUP_STAGES}
+
+
+def clear_directory(path):
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+# (name, fn, setup) for every benchmark of one cached session
+def session_benchmarks(script, client, case, store_path):
+    year, grand_prix, session_type, cache_dir = case
+    key = (int(year), grand_prix, session_type)
+    prefix = f"{year} {grand_prix} {session_type}"
+
+    def cold_session():
+        use_cache(script, cache_dir)
+        script.session_cache.invalidate(key)
+
+    def cold_store():
+        use_cache(script, cache_dir)
+        shutil.rmtree(script.telemetry_store.session_path(store_path, *key), ignore_errors=True)
+
+    benchmarks = [
+        (f"{prefix} / session load",
+         lambda: script.load_session(year, grand_prix, session_type, script.STORE_PARTS), cold_session),
+        (f"{prefix} / store ingest",
+         lambda: script.load_store(year, grand_prix, session_type), cold_store),
+    ]
+
+    # the source is opened untimed, so only the plot function itself is measured
+    def plot_benchmark(plot, input_data):
+        loaded = {}
+        def setup():
+            use_cache(script, cache_dir)
+            loaded['source'] = script.load_source(input_data)
+        return lambda: plot(loaded['source'], input_data), setup
+
+    for analysis, function in PLOTS.items():
+        input_data = [year, grand_prix, session_type, *DRIVERS, analysis, LAP]
+        benchmarks.append((f"{prefix} / {function}", *plot_benchmark(getattr(script, function), input_data)))
+
+    def clear_plots():
+        use_cache(script, cache_dir)
+        clear_directory(script.plot_cache.directory)
+
+    for analysis in PLOTS:
+        form = {'year': year, 'grand_prix': grand_prix, 'session': session_type, 'driver1': DRIVERS[0],
+                'driver2': DRIVERS[1], 'analysis': analysis, 'lap_number': LAP}
+        benchmarks.append((f"{prefix} / index POST {analysis}",
+                           lambda form=form: check_response(client.post('/', data=form)), clear_plots))
+    return benchmarks
+
+
+def check_response(response):
+    if response.status_code != 200 or b'Error during analysis' in response.data:
+        raise RuntimeError(f"index() failed with status {response.status_code}")
+
+
+# names of benchmarks that regressed past the threshold, with a short reason
+def compare(results, baseline, threshold):
+    regressions = []
+    # a benchmark that no longer runs (e.g. its session was skipped) is not a pass
+    for name, before in baseline.items():
+        if name not in results and 'seconds' in before:
+            regressions.append(f"{name}: missing from the results")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None or 'seconds' not in result or 'seconds' not in before:
+            continue
+        for field, floor in (('seconds', MIN_SECONDS), ('peak_bytes', MIN_BYTES)):
+            if result[field] - before[field] > max(before[field] * threshold, floor):
+                regressions.append(f"{name}: {field} {before[field]:g} -> {result[field]:g}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline on locally cached sessions")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per benchmark, the median is reported")
+    parser.add_argument('--filter', default='', help="only run benchmarks whose name contains this text")
+    parser.add_argument('--output', default='benchmark.json', help="where to write the results")
+    parser.add_argument('--baseline', help="results of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="allowed slowdown or memory growth over the baseline, as a fraction")
+    parser.add_argument('--startup-budget', type=float, default=STARTUP_BUDGET,
+                        help="seconds a fresh app may take to answer its first request")
+    args = parser.parse_args(argv)
+
+    results = {}
+    failures = []
+    if any(args.filter in f"startup / {stage}" for stage in STARTUP_STAGES):
+        for stage, result in measure_startup(args.repeat).items():
+            results[f"startup / {stage}"] = result
+            print(f"{result['seconds']:8.3f}s {'':20}  startup / {stage}")
+        first_response = results['startup / first_response']['seconds']
+        if first_response > args.startup_budget:
+            failures.append(f"startup / first_response: {first_response:.3f}s is over the "
+                            f"{args.startup_budget:.3f}s budget")
+
+    import script
+    import app
+    import render_cache
+    import track_geometry
+
+    # keep the benchmark away from the real store, track geometry and plot cache
+    workdir = tempfile.mkdtemp(prefix='f1-benchmark-')
+    script.STORE_PATH = os.path.join(workdir, 'store')
+    track_geometry.GEOMETRY_PATH = os.path.join(workdir, 'geometry')
+    script.plot_cache = app.plot_cache = render_cache.RenderCache(os.path.join(workdir, 'plots'),
+                                                                  script.plot_cache.max_bytes)
+    client = app.app.test_client()
+
+    # session benchmarks selected by the filter, and those that ran
+    selected = ran = 0
+    try:
+        for case in CASES:
+            benchmarks = [benchmark for benchmark in session_benchmarks(script, client, case, script.STORE_PATH)
+                          if args.filter in benchmark[0]]
+            if not benchmarks:
+                continue
+            selected += len(benchmarks)
+            # sessions that are not in the local cache are skipped rather than downloaded
+            try:
+                use_cache(script, case[3])
+                script.load_session(*case[:3], {'laps'})
+            except Exception as e:
+                print(f"skipped  {' '.join(case[:3])}: {str(e) or type(e).__name__}")
+                continue
+            for name, fn, setup in benchmarks:
+                ran += 1
+                try:
+                    results[name] = measure(fn, setup, args.repeat)
+                except Exception as e:
+                    results[name] = {'error': str(e) or type(e).__name__}
+                    print(f"failed   {name}: {results[name]['error']}")
+                    # a benchmark that broke fails the run, rather than dropping out of the comparison
+                    failures.append(f"{name}: failed with {results[name]['error']}")
+                    continue
+                result = results[name]
+                print(f"{result['seconds']:8.3f}s {result['peak_bytes'] / 2**20:8.1f} MB "
+                      f"{result['retained_blocks']:9d} blocks  {name}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    # a run that measured nothing would otherwise pass, e.g. with no session in the local cache
+    if not results:
+        failures.append("no benchmark ran")
+    elif selected and not ran:
+        failures.append(f"none of the {selected} session benchmarks ran, every session was skipped")
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+              'fastf1': script.ff1.__version__, 'repeat': args.repeat, 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {name: result for name, result in json.load(f)['results'].items() if args.filter in name}
+        regressions = compare(results, baseline, args.threshold)
+        if not regressions:
+            print(f"No regressions beyond {args.threshold:.0%} of {args.baseline}")
+        failures += regressions
+    for line in failures:
+        print(f"FAILED {line}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,484 @@
+# keeps the fastf1 disk cache in one tree and within a size budget
+#
+#   python cache_manager.py stats
+#   python cache_manager.py merge fastf1_cache
+#   python cache_manager.py enforce --quota-mb 2048
+#   python cache_manager.py compress --cold-days 14
+#   python cache_manager.py verify
+#
+# fastf1 keeps every session as a directory of pickles,
+#   <root>/<year>/<date>_<event>/<date>_<session>/*.ff1pkl
+# and that directory is the unit of eviction. The telemetry stores and track geometry
+# built from those sessions count against the same quota and are evicted alongside. The app records when it last used
+# a session in a marker file; cold sessions can be gzipped in place and are
+# decompressed again right before fastf1 reads them.
+import os
+import sys
+import gzip
+import json
+import hashlib
+import time
+import shutil
+import pickle
+import filecmp
+import argparse
+import threading
+from singleflight import FileLock
+
+CACHE_PATH = os.path.join('formula', 'cache')
+
+# cache trees left behind by older setups, merged into CACHE_PATH on startup
+LEGACY_PATHS = ('fastf1_cache',)
+
+PICKLE_SUFFIX = '.ff1pkl'
+GZIP_SUFFIX = '.ff1pkl.gz'
+USED_MARKER = '.last_used'
+
+# data built from cached sessions, rebuilt on demand once evicted: telemetry stores
+# (a directory per session, holding meta.json) and track geometry (an .npz per circuit)
+DERIVED_PATHS = (os.path.join('formula', 'store'), os.path.join('formula', 'geometry'))
+
+# session names as they appear in the app and in fastf1's directory names
+SESSION_DIRS = {'FP1': 'Practice_1', 'FP2': 'Practice_2', 'FP3': 'Practice_3'}
+
+# 0 disables the quota or compression
+QUOTA_BYTES = int(os.environ.get('F1_CACHE_QUOTA_MB', 10240)) * 1024 * 1024
+COMPRESS_AFTER_DAYS = float(os.environ.get('F1_CACHE_COMPRESS_DAYS', 0))
+
+
+def _is_cache_file(name):
+    return name.endswith(PICKLE_SUFFIX) or name.endswith(GZIP_SUFFIX)
+
+
+# every directory holding session pickles
+def session_dirs(root):
+    for path, dirs, files in os.walk(root):
+        dirs[:] = [name for name in dirs if not name.startswith('.') and name != 'locks']
+        if any(_is_cache_file(name) for name in files):
+            yield path
+
+
+# directory of a session from its fastf1 api path ('/static/2024/<event>/<session>/')
+def session_path(api_path, root=CACHE_PATH):
+    return os.path.join(root, api_path.split('/static/', 1)[-1])
+
+
+# name of a fastf1 cache folder without its '<date>_' prefix
+def _undated(folder):
+    return folder.split('_', 1)[-1]
+
+
+# cached directory of a session, found by name without fetching the event schedule
+# names are matched in full, so e.g. Sprint_Qualifying is never taken for Qualifying
+# returns None if the session has not been cached yet
+def find_session(year, grand_prix, session_type, root=CACHE_PATH):
+    event = grand_prix.replace(' ', '_')
+    session = SESSION_DIRS.get(session_type, session_type.replace(' ', '_'))
+    season = os.path.join(root, str(year))
+    try:
+        events = sorted(name for name in os.listdir(season) if _undated(name) == event)
+    except FileNotFoundError:
+        return None
+    for name in events:
+        for folder in sorted(os.listdir(os.path.join(season, name))):
+            path = os.path.join(season, name, folder)
+            if _undated(folder) == session and os.path.isdir(path):
+                return path
+    return None
+
+
+# changes whenever fastf1 adds or rewrites a file of the session
+# compressing or decompressing a session keeps it, as the timestamps are preserved
+def fingerprint(path):
+    files = []
+    for name in sorted(_cache_files(path)):
+        base = name[:-len('.gz')] if name.endswith(GZIP_SUFFIX) else name
+        files.append(f"{os.path.basename(base)}:{int(os.stat(name).st_mtime)}")
+    return hashlib.sha256('|'.join(sorted(files)).encode('utf-8')).hexdigest()[:32]
+
+
+def _cache_files(path):
+    return [os.path.join(path, name) for name in os.listdir(path) if _is_cache_file(name)]
+
+
+def dir_size(path):
+    total = 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(folder, name))
+            except FileNotFoundError:
+                pass
+    return total
+
+
+# when the app last used a session (or store), else when it was last written to
+def last_used(path):
+    if os.path.isfile(path):
+        return os.path.getmtime(path)
+    try:
+        return os.path.getmtime(os.path.join(path, USED_MARKER))
+    except FileNotFoundError:
+        return max((os.path.getmtime(os.path.join(path, name)) for name in os.listdir(path)), default=0)
+
+
+# when the app last marked a session used, None if it never did
+def _marked(path):
+    try:
+        return os.path.getmtime(os.path.join(path, USED_MARKER))
+    except FileNotFoundError:
+        return None
+
+
+def mark_used(path):
+    try:
+        with open(os.path.join(path, USED_MARKER), 'a'):
+            pass
+        os.utime(os.path.join(path, USED_MARKER))
+    except FileNotFoundError:
+        # evicted meanwhile
+        pass
+
+
+# everything the quota can evict, as (path, tree it belongs to): cached session
+# directories, telemetry store directories and track geometry files
+def _evictable(root, derived):
+    entries = [(path, root) for path in session_dirs(root)]
+    for tree in derived:
+        for folder, dirs, files in os.walk(tree):
+            dirs[:] = [name for name in dirs if not name.startswith('.')]
+            if 'meta.json' in files:
+                entries.append((folder, tree))
+                dirs[:] = []
+            else:
+                entries.extend((os.path.join(folder, name), tree) for name in files if name.endswith('.npz'))
+    return entries
+
+
+def _lock(root):
+    os.makedirs(os.path.join(root, 'locks'), exist_ok=True)
+    return FileLock(os.path.join(root, 'locks', 'cache_manager.lock'))
+
+
+def read_pickle(path):
+    opener = gzip.open if path.endswith(GZIP_SUFFIX) else open
+    with opener(path, 'rb') as f:
+        return pickle.load(f)
+
+
+# a cache file is usable if it unpickles completely into fastf1's {'version', 'data'} dict
+def verify_file(path):
+    try:
+        cached = read_pickle(path)
+    except Exception:
+        return False
+    return isinstance(cached, dict) and 'data' in cached
+
+
+# deletes unreadable (e.g. truncated) cache files so fastf1 fetches them again
+# checks one session directory, or the whole tree, and with since only the files
+# modified after that time; returns the removed paths
+def verify(root=CACHE_PATH, path=None, since=None):
+    removed = []
+    for folder in [path] if path else list(session_dirs(root)):
+        for name in _cache_files(folder):
+            if since is not None and os.path.getmtime(name) <= since:
+                continue
+            if not verify_file(name):
+                os.remove(name)
+                removed.append(name)
+    return removed
+
+
+# writes data next to path and moves it into place, keeping the original timestamps
+def _replace_with(path, target, write):
+    stat = os.stat(path)
+    tmp = f"{target}.tmp"
+    try:
+        write(tmp)
+        os.utime(tmp, (stat.st_atime, stat.st_mtime))
+        os.replace(tmp, target)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.remove(path)
+
+
+def _gzip(source, target):
+    with open(source, 'rb') as f, gzip.open(target, 'wb', compresslevel=6) as out:
+        shutil.copyfileobj(f, out)
+
+
+def _gunzip(source, target):
+    with gzip.open(source, 'rb') as f, open(target, 'wb') as out:
+        shutil.copyfileobj(f, out)
+
+
+# restores the plain pickles of a session; a corrupt archive is dropped and fetched again
+def decompress(path):
+    restored = 0
+    for name in _cache_files(path):
+        if not name.endswith(GZIP_SUFFIX):
+            continue
+        target = name[:-len('.gz')]
+        try:
+            _replace_with(name, target, lambda tmp: _gunzip(name, tmp))
+        except (OSError, EOFError, gzip.BadGzipFile):
+            os.remove(name)
+            continue
+        restored += 1
+    return restored
+
+
+# gzips the pickles of sessions not used for cold_days; returns the bytes saved
+def compress(root=CACHE_PATH, cold_days=COMPRESS_AFTER_DAYS, now=None):
+    cutoff = (now or time.time()) - cold_days * 24 * 3600
+    saved = 0
+    with _lock(root):
+        for path in list(session_dirs(root)):
+            if last_used(path) > cutoff:
+                continue
+            for name in _cache_files(path):
+                if not name.endswith(PICKLE_SUFFIX):
+                    continue
+                before = os.path.getsize(name)
+                target = name + '.gz'
+                _replace_with(name, target, lambda tmp: _gzip(name, tmp))
+                saved += before - os.path.getsize(target)
+    return saved
+
+
+def _remove_session(path, root):
+    if os.path.isfile(path):
+        os.remove(path)
+    else:
+        # moved aside first, so readers never find a half-deleted directory
+        hidden = os.path.join(os.path.dirname(path), f".evict-{os.path.basename(path)}")
+        os.rename(path, hidden)
+        shutil.rmtree(hidden, ignore_errors=True)
+    # drop the event and year directories once they are empty
+    parent = os.path.dirname(path)
+    while os.path.abspath(parent) != os.path.abspath(root):
+        try:
+            os.rmdir(parent)
+        except OSError:
+            break
+        parent = os.path.dirname(parent)
+
+
+def _size(path):
+    return os.path.getsize(path) if os.path.isfile(path) else dir_size(path)
+
+
+# deletes least recently used sessions, stores and geometry until the cache tree and the
+# derived trees together fit in max_bytes
+# sessions in keep (e.g. the one being loaded) are never evicted; returns the evicted paths
+def enforce_quota(root=CACHE_PATH, max_bytes=QUOTA_BYTES, keep=(), derived=DERIVED_PATHS):
+    if not max_bytes:
+        return []
+    keep = {os.path.abspath(path) for path in keep}
+    evicted = []
+    with _lock(root):
+        used = dir_size(root) + sum(dir_size(tree) for tree in derived)
+        for path, tree in sorted(_evictable(root, derived), key=lambda entry: last_used(entry[0])):
+            if used <= max_bytes:
+                break
+            if os.path.abspath(path) in keep:
+                continue
+            size = _size(path)
+            _remove_session(path, tree)
+            used -= size
+            evicted.append(path)
+    return evicted
+
+
+# the copy to keep when both trees have the same file: a readable one, then the newest
+def _better(source, target):
+    source_ok, target_ok = verify_file(source), verify_file(target)
+    if source_ok != target_ok:
+        return source_ok
+    return os.path.getmtime(source) > os.path.getmtime(target)
+
+
+# moves every file of source into target, keeping one copy of each duplicate,
+# and removes source afterwards; returns counts of what happened
+def merge(source, target=CACHE_PATH):
+    counts = {'moved': 0, 'duplicates': 0, 'replaced': 0}
+    with _lock(target):
+        for folder, _, files in os.walk(source):
+            for name in files:
+                path = os.path.join(folder, name)
+                destination = os.path.join(target, os.path.relpath(path, source))
+                # a pickle may already be in the target tree in compressed form, or the other way round
+                candidates = [destination]
+                if name.endswith(GZIP_SUFFIX):
+                    candidates.append(destination[:-len('.gz')])
+                elif name.endswith(PICKLE_SUFFIX):
+                    candidates.append(destination + '.gz')
+                existing = [candidate for candidate in candidates if os.path.exists(candidate)]
+
+                if not existing:
+                    os.makedirs(os.path.dirname(destination), exist_ok=True)
+                    shutil.move(path, destination)
+                    counts['moved'] += 1
+                elif (_is_cache_file(name) and not filecmp.cmp(path, existing[0], shallow=False)
+                      and _better(path, existing[0])):
+                    os.remove(existing[0])
+                    shutil.move(path, destination)
+                    counts['replaced'] += 1
+                else:
+                    os.remove(path)
+                    counts['duplicates'] += 1
+        shutil.rmtree(source, ignore_errors=True)
+    return counts
+
+
+def merge_legacy(target=CACHE_PATH):
+    for source in LEGACY_PATHS:
+        if os.path.isdir(source) and os.path.abspath(source) != os.path.abspath(target):
+            merge(source, target)
+
+
+# called before fastf1 loads a session: restores compressed pickles, drops unreadable
+# ones and records the use; returns the dropped paths
+# fastf1 silently fetches a pickle it cannot read, which fails offline (prewarm, the
+# benchmarks), so they are checked here. a load marks the session used once its files
+# are written, so only files written since, e.g. by a load cut short, need checking
+def prepare(api_path, root=CACHE_PATH):
+    path = session_path(api_path, root)
+    if not os.path.isdir(path):
+        return []
+    with _lock(root):
+        decompress(path)
+        removed = verify(root, path, since=_marked(path))
+        mark_used(path)
+    return removed
+
+
+# one quota and compression pass; the CLIs run it after warming many sessions
+def maintain(root=CACHE_PATH, keep=()):
+    evicted = enforce_quota(root, QUOTA_BYTES, keep=keep)
+    saved = compress(root, COMPRESS_AFTER_DAYS) if COMPRESS_AFTER_DAYS else 0
+    return evicted, saved
+
+
+# sessions loaded since the last maintenance pass, per root, while a pass is due or running
+_maintenance = {}
+_maintenance_lock = threading.Lock()
+
+
+# called after a session was loaded: records the use and keeps the tree within its budget
+# eviction and compression walk the whole tree, so they run on a background thread
+# instead of holding up the request; loads during a pass ask for one more pass
+def after_load(api_path, root=CACHE_PATH):
+    path = session_path(api_path, root)
+    if os.path.isdir(path):
+        mark_used(path)
+    if not QUOTA_BYTES and not COMPRESS_AFTER_DAYS:
+        return
+    with _maintenance_lock:
+        running = root in _maintenance
+        _maintenance.setdefault(root, set()).add(path)
+    if not running:
+        threading.Thread(target=_maintain, args=(root,), name='cache-maintenance', daemon=True).start()
+
+
+def _maintain(root):
+    while True:
+        with _maintenance_lock:
+            keep = _maintenance[root]
+            if not keep:
+                del _maintenance[root]
+                return
+            _maintenance[root] = set()
+        try:
+            maintain(root, keep)
+        except OSError:
+            # e.g. a session removed by the CLI meanwhile; the next load runs another pass
+            pass
+
+
+def stats(root=CACHE_PATH):
+    sessions = []
+    for path in session_dirs(root):
+        files = _cache_files(path)
+        sessions.append({
+            'session': os.path.relpath(path, root),
+            'bytes': dir_size(path),
+            'files': len(files),
+            'compressed': sum(1 for name in files if name.endswith(GZIP_SUFFIX)),
+            'last_used': last_used(path),
+        })
+    sessions.sort(key=lambda session: session['last_used'], reverse=True)
+    return {
+        'root': root,
+        'bytes': dir_size(root) if os.path.isdir(root) else 0,
+        'derived_bytes': {tree: dir_size(tree) for tree in DERIVED_PATHS},
+        'quota_bytes': QUOTA_BYTES,
+        'compress_after_days': COMPRESS_AFTER_DAYS,
+        'session_count': len(sessions),
+        'compressed_files': sum(session['compressed'] for session in sessions),
+        'legacy_trees': [path for path in LEGACY_PATHS if os.path.isdir(path)],
+        'sessions': sessions,
+    }
+
+
+def print_stats(report):
+    derived = sum(report['derived_bytes'].values())
+    print(f"{report['root']}: {report['session_count']} sessions, {report['bytes'] / 2**20:.1f} MB "
+          f"+ {derived / 2**20:.1f} MB stores and geometry, {report['quota_bytes'] / 2**20:.0f} MB quota, "
+          f"{report['compressed_files']} compressed files")
+    for session in report['sessions']:
+        used = time.strftime('%Y-%m-%d %H:%M', time.localtime(session['last_used']))
+        print(f"  {session['bytes'] / 2**20:8.2f} MB  {session['files']:3d} files "
+              f"({session['compressed']} gz)  {used}  {session['session']}")
+    if report['legacy_trees']:
+        print(f"Unmerged cache trees: {', '.join(report['legacy_trees'])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and maintain the fastf1 disk cache")
+    parser.add_argument('--root', default=CACHE_PATH, help="cache directory used by the app")
+    commands = parser.add_subparsers(dest='command', required=True)
+    stats_parser = commands.add_parser('stats', help="size and last use of every cached session")
+    stats_parser.add_argument('--json', action='store_true', help="print the raw report")
+    merge_parser = commands.add_parser('merge', help="move other cache trees into the main one")
+    merge_parser.add_argument('sources', nargs='*', default=list(LEGACY_PATHS))
+    enforce_parser = commands.add_parser('enforce', help="evict least recently used sessions over the quota")
+    enforce_parser.add_argument('--quota-mb', type=int, default=QUOTA_BYTES // 2**20)
+    compress_parser = commands.add_parser('compress', help="gzip the pickles of cold sessions")
+    compress_parser.add_argument('--cold-days', type=float, default=COMPRESS_AFTER_DAYS or 14)
+    commands.add_parser('verify', help="delete unreadable pickles so they are fetched again")
+    args = parser.parse_args(argv)
+
+    if args.command == 'stats':
+        report = stats(args.root)
+        if args.json:
+            print(json.dumps(report, indent=1))
+        else:
+            print_stats(report)
+    elif args.command == 'merge':
+        for source in args.sources:
+            if os.path.isdir(source):
+                print(f"{source}: {merge(source, args.root)}")
+            else:
+                print(f"{source}: not found")
+    elif args.command == 'enforce':
+        evicted = enforce_quota(args.root, args.quota_mb * 2**20)
+        for path in evicted:
+            print(f"evicted {path}")
+        print(f"{len(evicted)} sessions evicted")
+    elif args.command == 'compress':
+        saved = compress(args.root, args.cold_days)
+        print(f"{saved / 2**20:.1f} MB saved")
+    elif args.command == 'verify':
+        removed = verify(args.root)
+        for path in removed:
+            print(f"removed {path}")
+        print(f"{len(removed)} unreadable files removed")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
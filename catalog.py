@@ -0,0 +1,143 @@
+# metadata behind the dropdowns: seasons, events, drivers and race lengths
+#
+# the csv files are parsed once into plain dicts and lists and parsed again only
+# when one of them changes on disk, so serving a dropdown is a dictionary lookup
+import os
+import re
+import csv
+import hashlib
+import functools
+import threading
+
+FILES = ('events.csv', 'drivers.csv', 'laps.csv')
+
+
+# {column: [non-empty values in row order]} of a csv whose first column is a row index
+def _read_columns(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        columns = {name: [] for name in header[1:]}
+        for row in reader:
+            for name, value in zip(header[1:], row[1:]):
+                if value.strip():
+                    columns[name].append(value.strip())
+    # some events are listed twice in a season, keep the first
+    return {name: list(dict.fromkeys(values)) for name, values in columns.items()}
+
+
+def _read_laps(path):
+    laps = {}
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            try:
+                laps[row['event'].strip()] = int(float(row['laps']))
+            except (KeyError, ValueError):
+                continue
+    return laps
+
+
+# '1 Max Verstappen' -> '1', the identifier the telemetry store and fastf1 accept
+def driver_code(name):
+    return str(name).split()[0]
+
+
+# 'Emilia Romagna Grand Prix' -> 'Emilia_Romagna_Grand_Prix', for file and directory names
+# of the telemetry store, track geometry and season summaries
+def slug(value):
+    return re.sub(r'[\W_]+', '_', str(value)).strip('_')
+
+
+# plot colour of a driver, looked up in fastf1 once per name
+@functools.lru_cache(maxsize=None)
+def driver_color(name):
+    from fastf1 import plotting
+    return plotting.driver_color(name)
+
+
+class Catalog:
+    """
+    Events, drivers and lap counts read from the csv files in data_path.
+
+    Every lookup first checks the files' modification times and re-reads
+    them if anything changed; `version` changes with them and is used to
+    build ETags. Missing files leave the catalog empty instead of failing.
+    """
+
+    def __init__(self, data_path):
+        self.data_path = data_path
+        self.version = None
+        self._stamp = None
+        self._years = []
+        self._events = {}
+        self._drivers = {}
+        self._laps = {}
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def _file_stamp(self):
+        stamp = []
+        for name in FILES:
+            try:
+                stat = os.stat(os.path.join(self.data_path, name))
+                stamp.append((name, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                stamp.append((name, None, None))
+        return tuple(stamp)
+
+    # re-reads the csv files if they changed since the last load
+    def refresh(self):
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return
+        with self._lock:
+            if stamp == self._stamp:
+                return
+            try:
+                events = _read_columns(os.path.join(self.data_path, 'events.csv'))
+                drivers = _read_columns(os.path.join(self.data_path, 'drivers.csv'))
+                laps = _read_laps(os.path.join(self.data_path, 'laps.csv'))
+            except FileNotFoundError as e:
+                print(f"Error loading CSV files: {e}")
+                events, drivers, laps = {}, {}, {}
+            self._years = list(events)
+            self._events = events
+            self._drivers = drivers
+            self._laps = laps
+            self._stamp = stamp
+            self.version = hashlib.sha256(repr(stamp).encode('utf-8')).hexdigest()[:16]
+
+    def years(self):
+        self.refresh()
+        return list(self._years)
+
+    def events(self, year):
+        self.refresh()
+        return list(self._events.get(str(year), []))
+
+    def drivers(self, year):
+        self.refresh()
+        return list(self._drivers.get(str(year), []))
+
+    # race distance in laps, or None for an event missing from laps.csv
+    def lap_count(self, grand_prix):
+        self.refresh()
+        return self._laps.get(grand_prix)
+
+    def lap_options(self, grand_prix):
+        total = self.lap_count(grand_prix)
+        return [str(lap) for lap in range(1, total + 1)] if total else []
+
+    # dropdown contents for one season
+    def options(self, year):
+        self.refresh()
+        return {
+            'grand_prix_options': self.events(year),
+            'driver_options': self.drivers(year),
+            'lap_counts': {event: self._laps[event] for event in self.events(year) if event in self._laps},
+        }
+
+    # ETag of options(year), changes whenever the csv files do
+    def etag(self, year):
+        self.refresh()
+        return hashlib.sha256(f"{self.version}|{year}".encode('utf-8')).hexdigest()[:32]
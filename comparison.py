@@ -0,0 +1,78 @@
+# vectorized multi-driver lap comparison
+# every lap is resampled onto one shared distance grid, so any number of drivers
+# can be compared point by point and deltas are a single array subtraction
+import numpy as np
+
+# spacing of the shared distance grid, in metres
+GRID_STEP = 2.0
+
+# channels that hold states rather than measurements, taken from the nearest sample
+DISCRETE_CHANNELS = ('Brake', 'nGear')
+
+
+# distances 0 .. length in steps of `step`, length included
+def distance_grid(length, step=GRID_STEP):
+    if not length > 0:
+        return np.zeros(1)
+    return np.append(np.arange(0.0, length, step), length)
+
+
+# resamples several laps onto grid in one interpolation pass
+#
+# laps is a list of dicts of equally long arrays, each with a sorted 'Distance' array;
+# returns {channel: array of shape (len(laps), len(grid))} for every name in channels.
+# points outside the distance a lap covered are NaN instead of extrapolated
+def resample(laps, grid, channels):
+    grid = np.asarray(grid, dtype=float)
+    n_laps, n_grid = len(laps), len(grid)
+    if not n_laps:
+        return {name: np.zeros((0, n_grid)) for name in channels}
+
+    distances = [np.asarray(lap['Distance'], dtype=float) for lap in laps]
+    sizes = np.array([len(distance) for distance in distances])
+    if not sizes.any():
+        return {name: np.full((n_laps, n_grid), np.nan) for name in channels}
+
+    # each lap is shifted onto its own stretch of one long axis, far enough apart that
+    # their distances never overlap; a single searchsorted then finds the neighbours of
+    # every grid point of every lap at once
+    span = max([grid[-1]] + [distance.max() for distance in distances if len(distance)]) + 1.0
+    offsets = np.arange(n_laps) * span
+    xp = np.concatenate([distance + offset for distance, offset in zip(distances, offsets)])
+    x = (grid[None, :] + offsets[:, None]).ravel()
+
+    # first and last sample of the lap each grid point belongs to
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    first = np.repeat(np.minimum(starts, len(xp) - 1), n_grid)
+    last = np.repeat(np.maximum(starts + sizes - 1, 0), n_grid)
+    inside = np.repeat(sizes > 0, n_grid) & (x >= xp[first]) & (x <= xp[last])
+
+    # neighbours are clamped to the lap's own samples, so nothing leaks between laps
+    right = np.clip(np.searchsorted(xp, x, side='right'), first, last)
+    left = np.clip(right - 1, first, last)
+    gap = xp[right] - xp[left]
+    weight = np.divide(x - xp[left], gap, out=np.zeros(len(x)), where=gap > 0).clip(0.0, 1.0)
+    nearest = np.where(weight >= 0.5, right, left)
+
+    result = {}
+    for name in channels:
+        fp = np.concatenate([np.asarray(lap[name], dtype=float) for lap in laps])
+        if name in DISCRETE_CHANNELS:
+            values = fp[nearest]
+        else:
+            values = fp[left] * (1.0 - weight) + fp[right] * weight
+        result[name] = np.where(inside, values, np.nan).reshape(n_laps, n_grid)
+    return result
+
+
+# seconds since the first sample of a lap
+def elapsed(session_time):
+    session_time = np.asarray(session_time, dtype=float)
+    return session_time - session_time[0] if len(session_time) else session_time
+
+
+# time lost by every lap to the reference lap at each grid point, shape (laps, grid)
+# the reference row is all zeros where the reference has data
+def deltas(elapsed_time, reference=0):
+    elapsed_time = np.asarray(elapsed_time, dtype=float)
+    return elapsed_time - elapsed_time[reference]
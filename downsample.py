@@ -0,0 +1,44 @@
+# shape-preserving downsampling for chart series
+import numpy as np
+
+
+# largest-triangle-three-buckets: picks `threshold` points out of (x, y) that
+# keep peaks and troughs, returns their indices (always including both ends)
+# thresholds below 3 are raised to 3, the fewest points the triangles need
+def lttb(x, y, threshold):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    threshold = max(int(threshold), 3)
+    if threshold >= n:
+        return np.arange(n)
+
+    # bucket edges for the n - 2 inner points
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    previous = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        # the next bucket's centroid is the third corner of the triangle
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        centroid_x = np.nanmean(x[stop:next_stop]) if next_stop > stop else x[-1]
+        centroid_y = np.nanmean(y[stop:next_stop]) if next_stop > stop else y[-1]
+
+        area = np.abs((x[previous] - centroid_x) * (y[start:stop] - y[previous])
+                      - (x[previous] - x[start:stop]) * (centroid_y - y[previous]))
+        area = np.nan_to_num(area, nan=-1.0)
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+
+# evenly spaced indices, for data such as a track outline where x is not monotonic
+# always keeps both ends, so thresholds below 2 are raised to 2
+def stride(n, threshold):
+    threshold = max(int(threshold), 2)
+    if threshold >= n:
+        return np.arange(n)
+    return np.unique(np.linspace(0, n - 1, threshold).round().astype(int))
@@ -0,0 +1,302 @@
+# asynchronous render jobs backed by a process pool
+# workers are long-lived, so each keeps its own warm session cache between jobs
+import os
+import time
+import uuid
+import signal
+import importlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import progress
+
+# seconds between two timeout checks of the monitor thread, and between two looks
+# for events from the workers
+CHECK_INTERVAL = 1.0
+EVENT_INTERVAL = 0.1
+
+# times a running job is run again after the worker pool broke under it (e.g. another
+# job's worker was killed for running too long, or a worker ran out of memory)
+RETRIES = 1
+
+# times a job still waiting for a worker is moved on to a new pool after the old one broke;
+# bounded as well, in case workers die before they run anything
+REQUEUES = 3
+
+
+class QueueFull(Exception):
+    """Raised when too many jobs are already waiting or running"""
+
+
+# calls a 'module.function' target, importing the module in whichever process runs it
+def _call(target, *args):
+    module, name = target.rsplit('.', 1)
+    return getattr(importlib.import_module(module), name)(*args)
+
+
+# workers are spawned rather than forked: the app forks while its warm-up thread may hold
+# import or logging locks, which would stay locked forever in a forked child
+_context = multiprocessing.get_context('spawn')
+
+# queue a worker reports back on, handed over when the worker process starts
+_events = None
+
+
+# a spawned worker starts from scratch, so it imports the target module up front
+# rather than in its first job
+def _init_worker(events, module=None):
+    global _events
+    _events = events
+    if module is not None:
+        importlib.import_module(module)
+
+
+# runs one job in a worker, announcing when it actually starts so that the time it spent
+# waiting for a free worker does not count towards its timeout; the stages it reports
+# are sent back too, for the listener the job was submitted with
+def _run(job_id, target, *args):
+    _events.put(('started', job_id, os.getpid()))
+    tracker = progress.Tracker(lambda **event: _events.put(('progress', job_id, event)))
+    with progress.listen(tracker):
+        return target(*args)
+
+
+class JobQueue:
+    """
+    Submit/poll wrapper around a process pool.
+
+    submit() returns a job id straight away; status() reports the job as
+    queued, running, done or failed. A job still running timeout seconds
+    after it started is failed and its worker process is killed; the pool
+    is then started again and the other jobs it was running are run once
+    more. No more than max_queue unfinished jobs are accepted at once.
+    With workers=0 jobs run inline in submit(), which is handy for
+    debugging and benchmarks, but cannot time out.
+    target can also be a 'module.function' string, so the submitting
+    process never has to import the (heavy) module itself.
+    on_result, if given, is called in this process with every successful
+    result, e.g. to record metrics gathered inside the worker. A job can
+    also be submitted with a listener, which is called in this process as
+    listener('progress', event) for every stage the job reports (see
+    progress.report) and as listener('finished', status) once it is done.
+    """
+
+    def __init__(self, target, workers=2, timeout=120, max_queue=16, keep=600, on_result=None):
+        self.target = target
+        self.on_result = on_result
+        self.workers = workers
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self.keep = keep
+        self._jobs = {}
+        # re-entrant: a future that is already done runs _on_done right away
+        self._lock = threading.RLock()
+        self._executor = None
+        self._events = None
+        self._monitor_thread = None
+
+    # the pool is started on first use so importing the app stays cheap, and again
+    # after it broke; each pool gets a fresh event queue, as a killed worker may
+    # have left the previous one locked. The queue is a SimpleQueue, which writes
+    # right away, so a job that crashes its worker has still been seen starting
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._events = _context.SimpleQueue()
+                module = self.target.rsplit('.', 1)[0] if isinstance(self.target, str) else None
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_context,
+                                                     initializer=_init_worker, initargs=(self._events, module))
+            if self._monitor_thread is None:
+                self._monitor_thread = threading.Thread(target=self._monitor, name='job-monitor', daemon=True)
+                self._monitor_thread.start()
+            return self._executor
+
+    def submit(self, *args, listener=None):
+        with self._lock:
+            self._prune()
+            pending = sum(1 for job in self._jobs.values() if job['state'] in ('queued', 'running'))
+            if pending >= self.max_queue:
+                raise QueueFull(f"{pending} jobs already pending")
+
+            job_id = uuid.uuid4().hex
+            job = {'id': job_id, 'state': 'queued', 'submitted': time.time(), 'started': None,
+                   'finished': None, 'result': None, 'error': None, '_task': self._target(args),
+                   '_retries': 0, '_requeues': 0, '_future': None, '_pool': None, '_pid': None,
+                   '_listener': listener}
+            self._jobs[job_id] = job
+
+        if self.workers == 0:
+            target, args = job['_task']
+            job['state'] = 'running'
+            job['started'] = time.time()
+            try:
+                with progress.listen(progress.Tracker(lambda **event: self._notify(job, 'progress', event))):
+                    result = target(*args)
+            except Exception as e:
+                self._finish(job, error=str(e))
+            else:
+                self._finish(job, result=result)
+            return job_id
+
+        self._start(job)
+        return job_id
+
+    # returns a snapshot of the job, or None if the id is unknown or expired
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {key: value for key, value in job.items() if not key.startswith('_')}
+
+    # cancels a job that has not started yet; a running job is left to finish, as its
+    # result is cached for the next request, but its listener hears no more from it
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job['_listener'] = None
+            if job['state'] == 'queued' and job['_future'] is not None:
+                job['_future'].cancel()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _target(self, args):
+        if isinstance(self.target, str):
+            return _call, (self.target,) + args
+        return self.target, args
+
+    # hands a job to the pool, as queued
+    def _start(self, job):
+        target, args = job['_task']
+        with self._lock:
+            try:
+                future = self._pool().submit(_run, job['id'], target, *args)
+            except BrokenProcessPool:
+                # a worker died while the pool was idle
+                self._replace_pool()
+                future = self._pool().submit(_run, job['id'], target, *args)
+            job.update(state='queued', started=None, _future=future, _pool=self._executor, _pid=None)
+        future.add_done_callback(lambda f: self._on_done(job, f))
+
+    def _on_done(self, job, future):
+        with self._lock:
+            if job['state'] in ('done', 'failed') or future is not job['_future']:
+                return
+            if job['_pool'] is self._executor:
+                # the worker sent its events before its result, which may still be queued
+                self._drain(self._events)
+            if future.cancelled() and job['_pool'] is not self._executor:
+                # queued on a pool that was replaced, it never ran
+                self._start(job)
+            elif future.cancelled():
+                self._finish(job, error='Cancelled')
+            elif isinstance(future.exception(), BrokenProcessPool):
+                self._recover(job)
+            elif future.exception() is not None:
+                self._finish(job, error=str(future.exception()))
+            else:
+                self._finish(job, result=future.result())
+
+    # a worker died, which breaks the whole pool and fails every job it held:
+    # start a new pool and run the job there, unless it already had its retries
+    def _recover(self, job):
+        if job['_pool'] is self._executor:
+            self._replace_pool()
+        counter, limit = ('_retries', RETRIES) if job['state'] == 'running' else ('_requeues', REQUEUES)
+        if job[counter] >= limit:
+            self._finish(job, error='The worker process running the job crashed')
+            return
+        job[counter] += 1
+        self._start(job)
+
+    # drops a broken pool, the next submit starts a new one; jobs still queued on it are
+    # cancelled, which moves them to the new pool
+    def _replace_pool(self):
+        # events still in the queue tell which jobs had started, see _recover
+        self._drain(self._events)
+        executor, self._executor = self._executor, None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _finish(self, job, result=None, error=None):
+        job['state'] = 'failed' if error is not None else 'done'
+        job['result'] = result
+        job['error'] = error
+        job['finished'] = time.time()
+        job['_task'] = None
+        if error is None and self.on_result is not None:
+            self.on_result(result)
+        self._notify(job, 'finished', self.status(job['id']))
+
+    def _notify(self, job, kind, body):
+        listener = job['_listener']
+        if listener is not None:
+            listener(kind, body)
+
+    # receives the events the workers send and enforces timeouts, for as long as the app runs
+    def _monitor(self):
+        checked = time.monotonic()
+        while True:
+            self._drain(self._events)
+            if time.monotonic() - checked >= CHECK_INTERVAL:
+                self._check_timeouts()
+                checked = time.monotonic()
+            time.sleep(EVENT_INTERVAL)
+
+    # under the lock, as events are read both by the monitor and when a job is done
+    def _drain(self, events):
+        with self._lock:
+            try:
+                while not events.empty():
+                    kind, job_id, *body = events.get()
+                    self._on_event(kind, job_id, body)
+            except (OSError, EOFError, ValueError):
+                # the queue of a pool that was replaced meanwhile
+                pass
+
+    def _on_event(self, kind, job_id, body):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            if kind == 'started' and job['state'] == 'queued':
+                job['state'] = 'running'
+                job['started'] = time.time()
+                job['_pid'] = body[0]
+            elif kind == 'progress' and job['state'] == 'running':
+                self._notify(job, 'progress', body[0])
+
+    # fails jobs that ran for longer than timeout and kills their worker, as a running
+    # task cannot be cancelled; that breaks the pool, so it is replaced right away and
+    # the other jobs it held run again on the new one, see _recover
+    def _check_timeouts(self):
+        now = time.time()
+        with self._lock:
+            for job in list(self._jobs.values()):
+                if job['state'] == 'running' and now - job['started'] > self.timeout:
+                    self._finish(job, error=f"Timed out after {self.timeout} seconds")
+                    _kill(job['_pid'])
+                    if job['_pool'] is self._executor:
+                        self._replace_pool()
+
+    # forget finished jobs once nobody has polled them for a while
+    def _prune(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['finished'] is not None and now - job['finished'] > self.keep]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+def _kill(pid):
+    try:
+        os.kill(pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+    except (OSError, TypeError):
+        # already gone
+        pass
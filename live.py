@@ -0,0 +1,386 @@
+# live timing: incremental ingestion of a SignalR-style timing feed
+#
+#   python live.py recording.txt --speed 10
+#
+# a recording is the text file fastf1's live timing client writes, one message per
+# line as [topic, message, utc timestamp]; CarData.z and Position.z messages are
+# base64 encoded, deflated json. replaying it at a chosen speed stands in for the
+# live service. every message is appended to per-driver buffers and folded into the
+# lap time and minisector aggregates, so the work per message only depends on the
+# size of that message. every change gets a sequence number and clients ask for
+# what changed since the last number they saw
+import ast
+import sys
+import json
+import time
+import zlib
+import base64
+import bisect
+import logging
+import argparse
+import datetime
+import threading
+import numpy as np
+from serialize import to_json
+
+logger = logging.getLogger(__name__)
+
+# car data channels by their number in the feed
+CAR_CHANNELS = {'0': 'RPM', '2': 'Speed', '3': 'nGear', '4': 'Throttle', '5': 'Brake'}
+CAR_COLUMNS = ('SessionTime', 'Lap', 'Speed', 'Throttle', 'Brake', 'RPM', 'nGear')
+POSITION_COLUMNS = ('SessionTime', 'X', 'Y')
+
+# minisectors per lap, split evenly by distance along the lap; unlike the fastest sectors
+# analysis, which places them on the stored track geometry, a live session has no
+# outline to go on, so their boundaries are not the same as in that analysis
+MINISECTORS = 25
+
+
+# feed lines are python literals (quotes, True, None), like fastf1's recordings
+# lines that cannot be read are logged and skipped
+def parse_line(line):
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        topic, message, timestamp = ast.literal_eval(line)
+        return topic, message, parse_timestamp(timestamp)
+    except (ValueError, TypeError, SyntaxError, AttributeError) as e:
+        logger.warning("Skipping unreadable feed line %.80r: %s", line, e)
+        return None
+
+
+# '2024-03-02T15:03:12.3456789Z' -> unix seconds; the feed uses up to 7 decimals
+def parse_timestamp(text):
+    text = text.rstrip('Z')
+    base, _, fraction = text.partition('.')
+    moment = datetime.datetime.fromisoformat(base).replace(tzinfo=datetime.timezone.utc)
+    return moment.timestamp() + (float(f"0.{fraction}") if fraction else 0.0)
+
+
+# CarData.z and Position.z payloads: base64 of raw deflate compressed json
+def decode(message):
+    if isinstance(message, dict):
+        return message
+    return json.loads(zlib.decompress(base64.b64decode(message), -zlib.MAX_WBITS).decode('utf-8-sig'))
+
+
+# '1:32.456' or '32.456' -> seconds, None for an empty value
+def lap_seconds(text):
+    if not text:
+        return None
+    minutes, _, seconds = text.rpartition(':')
+    try:
+        return int(minutes or 0) * 60 + float(seconds)
+    except ValueError:
+        return None
+
+
+class Columns:
+    """Growable numeric columns; appends are amortised O(new rows)"""
+
+    def __init__(self, names, capacity=1024):
+        self.names = names
+        self.length = 0
+        self._data = {name: np.empty(capacity) for name in names}
+
+    def append(self, rows):
+        count = len(rows[self.names[0]])
+        needed = self.length + count
+        capacity = len(self._data[self.names[0]])
+        if needed > capacity:
+            while capacity < needed:
+                capacity *= 2
+            for name in self.names:
+                grown = np.empty(capacity)
+                grown[:self.length] = self._data[name][:self.length]
+                self._data[name] = grown
+        for name in self.names:
+            self._data[name][self.length:needed] = rows[name]
+        self.length = needed
+
+    # rows start .. stop of every column, as views
+    def slice(self, start, stop=None):
+        stop = self.length if stop is None else stop
+        return {name: self._data[name][start:stop] for name in self.names}
+
+
+class LiveDriver:
+    """Buffers and running aggregates of one driver"""
+
+    def __init__(self, number, minisectors=MINISECTORS):
+        self.number = number
+        self.car = Columns(CAR_COLUMNS)
+        self.position = Columns(POSITION_COLUMNS)
+        # buffer lengths after each change, for slicing out what a client has not seen
+        self.checkpoints = [(0, 0, 0)]
+
+        self.completed = 0
+        self.laps = []
+        self.best = None
+        self.total = 0.0
+
+        # distance into the current lap, integrated from speed; unknown until the first lap line
+        self.distance = None
+        self.last_time = None
+        self.minisector_sums = np.zeros(minisectors)
+        self.minisector_counts = np.zeros(minisectors)
+        self.minisector_changed = np.zeros(minisectors, dtype=int)
+
+    def lap_stats(self):
+        return {'laps': len(self.laps), 'best': self.best, 'last': self.laps[-1]['time'] if self.laps else None,
+                'mean': self.total / len(self.laps) if self.laps else None}
+
+    def minisector_speeds(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.minisector_sums / self.minisector_counts
+
+
+class LiveSession:
+    """
+    In-memory state of a session fed message by message.
+
+    ingest() takes one feed message and bumps `seq` when anything changed.
+    delta(since) returns what changed after sequence number `since`: new
+    laps, new car and position samples, the lap statistics of drivers who
+    completed a lap and the minisector cells that changed. wait() blocks
+    until there is something newer than a given sequence number.
+    """
+
+    def __init__(self, minisectors=MINISECTORS):
+        self.minisectors = minisectors
+        self.drivers = {}
+        self.start = None
+        self.seq = 0
+        self.finished = False
+        self.laps = []
+        self.lap_seqs = []
+        self.minisector_seq = 0
+        # lap length used to split laps into minisectors, from the first full lap seen
+        self.lap_length = None
+        self._condition = threading.Condition()
+
+    def _driver(self, number):
+        if number not in self.drivers:
+            self.drivers[number] = LiveDriver(number, self.minisectors)
+        return self.drivers[number]
+
+    def ingest(self, topic, message, timestamp):
+        with self._condition:
+            if self.start is None:
+                self.start = timestamp
+            changed = set()
+            if topic == 'CarData.z':
+                changed = self._car_data(decode(message))
+            elif topic == 'Position.z':
+                changed = self._positions(decode(message))
+            elif topic == 'TimingData':
+                changed = self._timing(message)
+            if changed:
+                self.seq += 1
+                for number in changed:
+                    driver = self.drivers[number]
+                    driver.checkpoints.append((self.seq, driver.car.length, driver.position.length))
+                self._condition.notify_all()
+
+    def finish(self):
+        with self._condition:
+            self.finished = True
+            self.seq += 1
+            self._condition.notify_all()
+
+    def _session_time(self, utc):
+        return parse_timestamp(utc) - self.start
+
+    # new laps: NumberOfLaps counts completed laps, LastLapTime carries the lap that just ended
+    def _timing(self, message):
+        changed = set()
+        for number, line in message.get('Lines', {}).items():
+            if not isinstance(line, dict):
+                continue
+            driver = self._driver(number)
+            if (line.get('NumberOfLaps') or 0) > driver.completed:
+                driver.completed = line['NumberOfLaps']
+                self._new_lap(driver)
+                changed.add(number)
+            seconds = lap_seconds((line.get('LastLapTime') or {}).get('Value'))
+            if seconds is not None and driver.completed and (not driver.laps or driver.laps[-1]['lap'] != driver.completed):
+                lap = {'driver': number, 'lap': driver.completed, 'time': seconds}
+                driver.laps.append(lap)
+                driver.total += seconds
+                driver.best = seconds if driver.best is None else min(driver.best, seconds)
+                self.laps.append(lap)
+                self.lap_seqs.append(self.seq + 1)
+                changed.add(number)
+        return changed
+
+    # the lap line: the distance of a full lap teaches the minisector length, then starts again
+    def _new_lap(self, driver):
+        if driver.distance is not None and self.lap_length is None and driver.distance > 0:
+            self.lap_length = driver.distance
+        driver.distance = 0.0
+
+    def _car_data(self, data):
+        samples = {}
+        for entry in data.get('Entries', []):
+            session_time = self._session_time(entry['Utc'])
+            for number, car in entry.get('Cars', {}).items():
+                channels = car.get('Channels', {})
+                if not all(key in channels for key in CAR_CHANNELS):
+                    continue
+                rows = samples.setdefault(number, {name: [] for name in CAR_COLUMNS})
+                rows['SessionTime'].append(session_time)
+                for key, name in CAR_CHANNELS.items():
+                    rows[name].append(channels[key])
+
+        for number, rows in samples.items():
+            driver = self._driver(number)
+            rows = {name: np.asarray(values, dtype=float) for name, values in rows.items()}
+            rows['Lap'] = np.full(len(rows['SessionTime']), driver.completed + 1.0)
+            rows['Brake'] = (rows['Brake'] > 0).astype(float)
+            self._add_minisectors(driver, rows)
+            driver.car.append(rows)
+        return set(samples)
+
+    # folds new samples into the running per-minisector speed sums of the driver
+    def _add_minisectors(self, driver, rows):
+        session_time = rows['SessionTime']
+        previous = session_time[0] if driver.last_time is None else driver.last_time
+        dt = np.diff(session_time, prepend=previous)
+        driver.last_time = session_time[-1]
+        if driver.distance is None:
+            return
+        distance = driver.distance + np.cumsum(rows['Speed'] / 3.6 * dt)
+        driver.distance = float(distance[-1])
+        if self.lap_length is None:
+            return
+
+        index = np.clip(np.floor(distance / self.lap_length * self.minisectors).astype(int), 0, self.minisectors - 1)
+        np.add.at(driver.minisector_sums, index, rows['Speed'])
+        np.add.at(driver.minisector_counts, index, 1)
+        driver.minisector_changed[index] = self.seq + 1
+        self.minisector_seq = self.seq + 1
+
+    def _positions(self, data):
+        samples = {}
+        for sample in data.get('Position', []):
+            session_time = self._session_time(sample['Timestamp'])
+            for number, entry in sample.get('Entries', {}).items():
+                rows = samples.setdefault(number, {name: [] for name in POSITION_COLUMNS})
+                rows['SessionTime'].append(session_time)
+                rows['X'].append(entry.get('X', np.nan))
+                rows['Y'].append(entry.get('Y', np.nan))
+        for number, rows in samples.items():
+            self._driver(number).position.append({name: np.asarray(values, dtype=float) for name, values in rows.items()})
+        return set(samples)
+
+    # index of the fastest driver in every minisector, -1 where nobody has data
+    def fastest_minisectors(self):
+        numbers = list(self.drivers)
+        if not numbers:
+            return numbers, np.full(self.minisectors, -1)
+        speeds = np.vstack([self.drivers[number].minisector_speeds() for number in numbers])
+        filled = np.where(np.isnan(speeds), -np.inf, speeds)
+        winner = np.argmax(filled, axis=0)
+        winner[np.isnan(speeds).all(axis=0)] = -1
+        return numbers, winner
+
+    # everything that changed after sequence number since; since=0 gives the full state
+    def delta(self, since=0, telemetry=True):
+        with self._condition:
+            result = {'seq': self.seq, 'since': since, 'finished': self.finished,
+                      'laps': self.laps[bisect.bisect_right(self.lap_seqs, since):]}
+            result['lap_stats'] = {number: self.drivers[number].lap_stats()
+                                   for number in {lap['driver'] for lap in result['laps']}}
+
+            if telemetry:
+                result['car'], result['position'] = {}, {}
+                for number, driver in self.drivers.items():
+                    _, car_start, position_start = driver.checkpoints[
+                        bisect.bisect_right(driver.checkpoints, (since, np.inf, np.inf)) - 1]
+                    if driver.car.length > car_start:
+                        result['car'][number] = driver.car.slice(car_start)
+                    if driver.position.length > position_start:
+                        result['position'][number] = driver.position.slice(position_start)
+
+            if self.minisector_seq > since:
+                numbers, winner = self.fastest_minisectors()
+                result['minisectors'] = {
+                    'count': self.minisectors, 'lap_length': self.lap_length,
+                    'fastest': [numbers[index] if index >= 0 else None for index in winner],
+                    'speed': {number: driver.minisector_speeds() for number, driver in self.drivers.items()
+                              if (driver.minisector_changed > since).any()}}
+            return to_json(result)
+
+    # blocks until seq passes since, the session finishes or timeout runs out; returns seq
+    def wait(self, since, timeout=None):
+        with self._condition:
+            self._condition.wait_for(lambda: self.seq > since or self.finished, timeout)
+            return self.seq
+
+
+# (seconds since the first message, topic, message) for every line of a recording
+def read_feed(path):
+    start = None
+    with open(path, encoding='utf-8-sig') as f:
+        for line in f:
+            parsed = parse_line(line)
+            if parsed is None:
+                continue
+            topic, message, timestamp = parsed
+            start = timestamp if start is None else start
+            yield timestamp - start, topic, message, timestamp
+
+
+# feeds a recording into session, keeping the original gaps divided by speed
+# speed 0 replays as fast as possible; stop (a threading.Event) ends the replay early
+def replay(session, path, speed=1.0, stop=None):
+    started = time.monotonic()
+    try:
+        for offset, topic, message, timestamp in read_feed(path):
+            if stop is not None and stop.is_set():
+                break
+            if speed > 0:
+                delay = offset / speed - (time.monotonic() - started)
+                if delay > 0:
+                    if stop is not None:
+                        if stop.wait(delay):
+                            break
+                    else:
+                        time.sleep(delay)
+            try:
+                session.ingest(topic, message, timestamp)
+            except (KeyError, ValueError, TypeError, zlib.error) as e:
+                logger.warning("Skipping bad %s message: %s", topic, e)
+    finally:
+        session.finish()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded live timing feed")
+    parser.add_argument('feed', help="recording written by fastf1's live timing client")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay speed, 0 for as fast as possible")
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(message)s')
+
+    session = LiveSession()
+    thread = threading.Thread(target=replay, args=(session, args.feed, args.speed), daemon=True)
+    thread.start()
+    seen = 0
+    try:
+        while not (session.finished and session.seq <= seen):
+            seen_before, seen = seen, session.wait(seen, timeout=1.0)
+            for lap in session.delta(seen_before, telemetry=False)['laps']:
+                print(f"lap {lap['lap']:3} driver {lap['driver']:>3} {lap['time']:9.3f}s")
+    except KeyboardInterrupt:
+        return 1
+
+    print()
+    stats = sorted((driver.lap_stats()['best'] or float('inf'), number) for number, driver in session.drivers.items())
+    for position, (best, number) in enumerate(stats, 1):
+        print(f"{position:3}. driver {number:>3} best {best:9.3f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
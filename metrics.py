@@ -0,0 +1,158 @@
+# per-stage timing spans, Server-Timing headers and Prometheus histograms
+#
+# a request (or render job) collects its spans in a context variable, so
+# concurrent requests on different threads never mix their timings; the
+# spans are turned into histogram observations when the request finishes
+import time
+import threading
+import contextvars
+import multiprocessing
+from contextlib import contextmanager
+import progress
+
+# not available on Windows, where the peak memory is reported as 0
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# seconds, from a cache hit up to a cold telemetry load
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# bytes, 64 MB up to 8 GB
+MEMORY_BUCKETS = tuple(2 ** power * 1024 * 1024 for power in range(6, 14))
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram with labels"""
+
+    def __init__(self, name, description, labelnames, buckets=TIME_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            counts, total, count = self._values.get(key, ((0,) * len(self.buckets), 0.0, 0))
+            counts = tuple(seen + (value <= bound) for seen, bound in zip(counts, self.buckets))
+            self._values[key] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, (counts, total, count) in values:
+            labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key))
+            prefix = f"{labels}," if labels else ''
+            for seen, bound in zip(counts, self.buckets):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound:g}"}} {seen}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total:g}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+STAGE_SECONDS = Histogram('f1_stage_duration_seconds', "Time spent in each stage of a request",
+                          ('stage', 'analysis', 'cache'))
+REQUEST_SECONDS = Histogram('f1_request_duration_seconds', "Total time per request or render job",
+                            ('endpoint', 'analysis', 'cache'))
+PEAK_MEMORY = Histogram('f1_request_peak_rss_bytes', "Peak resident memory of the process that served a request",
+                        ('endpoint', 'analysis', 'cache'), buckets=MEMORY_BUCKETS)
+HISTOGRAMS = (STAGE_SECONDS, REQUEST_SECONDS, PEAK_MEMORY)
+
+_current = contextvars.ContextVar('f1_request_metrics', default=None)
+
+
+# Peak RSS is per process, not per request. Linux lets a process reset its own peak, which
+# only means something in a job pool worker, where one job runs at a time; in the web process
+# concurrent requests would reset each other's peaks, so there (and on other platforms) the
+# figure is the process lifetime peak
+def _reset_peak_memory():
+    if multiprocessing.parent_process() is None:
+        return
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_memory():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return 0
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# starts collecting spans for the current request or job
+def start_request(**labels):
+    _reset_peak_memory()
+    state = {'spans': [], 'labels': dict(labels), 'start': time.perf_counter()}
+    _current.set(state)
+    return state
+
+
+# adds labels (analysis, cache) to the current request, once they are known
+def set_labels(**labels):
+    state = _current.get()
+    if state is not None:
+        state['labels'].update(labels)
+
+
+# every span also marks a stage for progress listeners
+@contextmanager
+def span(name):
+    progress.report(name)
+    state = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if state is not None:
+            state['spans'].append((name, time.perf_counter() - start))
+
+
+# stops collecting and returns a picklable summary of the request
+def finish_request():
+    state = _current.get()
+    if state is None:
+        return None
+    _current.set(None)
+    return {'spans': state['spans'], 'labels': state['labels'],
+            'seconds': time.perf_counter() - state['start'], 'peak_rss': _peak_memory()}
+
+
+# feeds a finished request (from this process or a pool worker) into the histograms
+def observe(summary):
+    labels = {name: summary['labels'].get(name, '') for name in ('endpoint', 'analysis', 'cache')}
+    for stage, seconds in summary['spans']:
+        STAGE_SECONDS.observe(seconds, stage=stage, analysis=labels['analysis'], cache=labels['cache'])
+    REQUEST_SECONDS.observe(summary['seconds'], **labels)
+    PEAK_MEMORY.observe(summary['peak_rss'], **labels)
+
+
+# Server-Timing header value; repeated stages are summed
+def server_timing(summary):
+    totals = {}
+    for stage, seconds in summary['spans']:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ', '.join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
+
+
+def render_prometheus():
+    return '\n'.join(histogram.render() for histogram in HISTOGRAMS) + '\n'
@@ -0,0 +1,80 @@
+# vectorized minisector engine
+# works on whole-session telemetry arrays instead of per-lap dataframes
+import numpy as np
+
+
+# lap number for every telemetry sample, given when each lap started and ended
+# samples that fall outside every lap get NaN
+def assign_laps(session_time, lap_start, lap_end, lap_numbers):
+    session_time = np.asarray(session_time, dtype=float)
+    lap_start = np.asarray(lap_start, dtype=float)
+    lap_end = np.asarray(lap_end, dtype=float)
+    lap_numbers = np.asarray(lap_numbers, dtype=float)
+
+    # laps without timing (NaT start or end) cannot own any samples
+    known = ~(np.isnan(lap_start) | np.isnan(lap_end))
+    order = np.argsort(lap_start[known])
+    lap_start = lap_start[known][order]
+    lap_end = lap_end[known][order]
+    lap_numbers = lap_numbers[known][order]
+
+    idx = np.searchsorted(lap_start, session_time, side='right') - 1
+    inside = idx >= 0
+    inside[inside] &= session_time[inside] <= lap_end[idx[inside]]
+
+    laps = np.full(len(session_time), np.nan)
+    laps[inside] = lap_numbers[idx[inside]]
+    return laps
+
+
+# distance travelled since the start of each lap, integrated from speed (km/h)
+# expects samples sorted by session time (seconds)
+def lap_distance(session_time, speed, laps):
+    session_time = np.asarray(session_time, dtype=float)
+    speed = np.asarray(speed, dtype=float)
+    laps = np.asarray(laps, dtype=float)
+    if not len(session_time):
+        return np.zeros(0)
+
+    dt = np.diff(session_time, prepend=session_time[0])
+    distance = np.cumsum(speed / 3.6 * dt)
+
+    # index of the first sample of the current lap, carried forward
+    new_lap = np.ones(len(laps), dtype=bool)
+    new_lap[1:] = laps[1:] != laps[:-1]
+    lap_first = np.maximum.accumulate(np.where(new_lap, np.arange(len(laps)), 0))
+    return distance - distance[lap_first]
+
+
+# average speed per minisector for one driver
+# speed is averaged within each lap first, then across laps, so long laps
+# with more samples do not outweigh short ones
+def minisector_speeds(speed, laps, minisector, total):
+    valid = ~np.isnan(laps)
+    if not valid.any():
+        return np.full(total, np.nan)
+
+    _, lap_idx = np.unique(laps[valid], return_inverse=True)
+    n_laps = lap_idx.max() + 1
+    code = lap_idx * total + minisector[valid]
+
+    sums = np.bincount(code, weights=speed[valid], minlength=n_laps * total)
+    counts = np.bincount(code, minlength=n_laps * total)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        per_lap = (sums / counts).reshape(n_laps, total)
+
+    seen = counts.reshape(n_laps, total).sum(axis=0) > 0
+    result = np.full(total, np.nan)
+    result[seen] = np.nanmean(per_lap[:, seen], axis=0)
+    return result
+
+
+# index of the fastest driver in every minisector, given a
+# (drivers x minisectors) matrix of average speeds
+# minisectors where nobody has data get -1
+def fastest_driver(speeds):
+    speeds = np.asarray(speeds, dtype=float)
+    filled = np.where(np.isnan(speeds), -np.inf, speeds)
+    winner = np.argmax(filled, axis=0)
+    winner[np.isnan(speeds).all(axis=0)] = -1
+    return winner
@@ -0,0 +1,127 @@
+# pre-warms the fastf1 cache and the telemetry store ahead of user traffic
+#
+#   python prewarm.py 2024 2023 --workers 4
+#   python prewarm.py 2024 --offline        (only use what is already cached)
+#
+# progress is recorded in a state file after every session, so an interrupted
+# run picks up where it left off
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# the workers import the analysis code themselves, the parent only needs the catalog
+os.environ.setdefault('F1_STARTUP', 'lazy')
+import cache_manager
+from app import sessions, catalog
+
+STATE_FILE = os.path.join('formula', 'cache', 'prewarm_state.json')
+
+
+def state_key(year, grand_prix, session_type):
+    return f"{year}|{grand_prix}|{session_type}"
+
+
+# every (year, grand prix, session) combination for the chosen seasons
+def session_list(seasons, session_types):
+    combinations = []
+    for year in seasons:
+        if year not in catalog.years():
+            print(f"Skipping {year}: not listed in events.csv")
+            continue
+        for grand_prix in catalog.events(year):
+            for session_type in session_types:
+                combinations.append((year, grand_prix, session_type))
+    return combinations
+
+
+def load_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_state(path, state):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, path)
+
+
+# runs in a pool worker: loads one session in full and builds its telemetry store
+# returns (status, seconds, message); sessions that cannot be found are skipped
+def warm_session(year, grand_prix, session_type, offline):
+    import script
+
+    script.ff1.Cache.offline_mode(offline)
+    start = time.perf_counter()
+    try:
+        race = script.load_session(year, grand_prix, session_type)
+        if race.laps.empty:
+            raise ValueError("no lap data")
+        script.load_store(year, grand_prix, session_type)
+    except Exception as e:
+        return 'skipped', time.perf_counter() - start, str(e) or type(e).__name__
+    finally:
+        # the worker only warms disk artifacts, keep its memory flat
+        script.session_cache.invalidate((int(year), grand_prix, session_type))
+    return 'done', time.perf_counter() - start, ''
+
+
+def print_table(rows):
+    header = ('Year', 'Grand Prix', 'Session', 'Status', 'Seconds')
+    widths = [max(len(str(row[i])) for row in rows + [header]) for i in range(len(header))]
+    for row in [header] + rows:
+        print('  '.join(str(value).ljust(width) for value, width in zip(row, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-load F1 sessions into the local caches")
+    parser.add_argument('seasons', nargs='+', help="seasons to warm, as listed in events.csv")
+    parser.add_argument('--sessions', nargs='+', default=sessions, help="session types to warm")
+    parser.add_argument('--workers', type=int, default=2, help="number of worker processes")
+    parser.add_argument('--offline', action='store_true', help="never hit the network, only use cached data")
+    parser.add_argument('--state', default=STATE_FILE, help="progress file used to resume interrupted runs")
+    parser.add_argument('--restart', action='store_true', help="ignore previous progress")
+    args = parser.parse_args(argv)
+
+    state = {} if args.restart else load_state(args.state)
+    todo = [combo for combo in session_list(args.seasons, args.sessions)
+            if state.get(state_key(*combo), {}).get('status') != 'done']
+    print(f"{len(todo)} sessions to warm with {args.workers} workers")
+
+    rows = []
+    pool = ProcessPoolExecutor(max_workers=args.workers)
+    try:
+        futures = {pool.submit(warm_session, *combo, args.offline): combo for combo in todo}
+        for future in as_completed(futures):
+            combo = futures[future]
+            status, seconds, message = future.result()
+            state[state_key(*combo)] = {'status': status, 'seconds': round(seconds, 2), 'message': message}
+            save_state(args.state, state)
+            rows.append((*combo, status, f"{seconds:.2f}"))
+            print(f"{status:8} {seconds:7.2f}s  {' '.join(combo)}  {message}".rstrip())
+    except KeyboardInterrupt:
+        # drop the queued sessions rather than waiting for every one of them to run
+        pool.shutdown(wait=False, cancel_futures=True)
+        print("Interrupted, progress saved; rerun the same command to resume")
+        return 1
+    pool.shutdown()
+
+    # the workers may exit before their background quota pass is done, so run one here
+    evicted, saved = cache_manager.maintain()
+    if evicted or saved:
+        print(f"Cache maintenance: {len(evicted)} sessions evicted, {saved / 2**20:.1f} MB saved by compression")
+
+    if rows:
+        print()
+        print_table(sorted(rows))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
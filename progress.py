@@ -0,0 +1,81 @@
+# progress of a long-running analysis, reported to whoever listens in the current context
+#
+# stages are announced by the metrics spans the analysis code already opens, so the
+# pipeline does not need to know who is watching. a listener can also cancel: the
+# next report then raises Cancelled, which unwinds the work at a stage boundary
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# percentage at the start and end of every reported stage, in pipeline order, and its label
+STAGES = {
+    'plot_cache_lookup': (2, 2, 'Checking for a cached plot'),
+    'store_open': (5, 5, 'Opening stored telemetry'),
+    'session_lookup': (8, 8, 'Looking up the session'),
+    'session_load': (12, 12, 'Loading session data'),
+    'store_ingest': (40, 65, 'Storing driver telemetry'),
+    'render': (68, 68, 'Preparing the plot'),
+    'compute': (70, 70, 'Computing the analysis'),
+    'minisectors': (75, 75, 'Mapping minisectors'),
+    'savefig': (85, 85, 'Rendering the image'),
+    'plot_cache_write': (95, 95, 'Saving the plot'),
+}
+
+_current = contextvars.ContextVar('f1_progress', default=None)
+
+
+class Cancelled(BaseException):
+    """
+    The listener gave up on the work, e.g. its client disconnected.
+
+    A BaseException like KeyboardInterrupt, so it is not reported as an
+    analysis error and a SingleFlight leader that is cancelled hands the
+    work to one of its waiters instead of failing them.
+    """
+
+
+class Tracker:
+    """Receives progress events through callback(stage=, percent=, label=, detail=)"""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.percent = 0
+        self.last = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+
+# reports progress to tracker for everything run inside the block, including
+# work in contexts copied from this one
+@contextmanager
+def listen(tracker):
+    token = _current.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _current.reset(token)
+
+
+# announces that a stage started, or got fraction of the way through
+# raises Cancelled if the listener has cancelled; a no-op when nobody listens
+def report(stage, fraction=0.0, detail=None):
+    tracker = _current.get()
+    if tracker is None:
+        return
+    if tracker.cancelled:
+        raise Cancelled()
+    if stage not in STAGES:
+        return
+    start, end, label = STAGES[stage]
+    # stages can repeat or be skipped, but the bar never moves backwards
+    tracker.percent = max(tracker.percent, round(start + (end - start) * fraction))
+    event = (stage, tracker.percent, detail)
+    if event != tracker.last:
+        tracker.last = event
+        tracker.callback(stage=stage, percent=tracker.percent, label=label, detail=detail)
@@ -0,0 +1,121 @@
+# content-addressed cache of rendered plots
+# every distinct request gets its own file, so concurrent renders never clash
+import os
+import json
+import hashlib
+import tempfile
+import threading
+
+# bump when plots or analysis data change for the same request (styling, analysis
+# code, data format), so images and responses made by older code are not served again
+RENDER_VERSION = 1
+
+
+# stable key for a request, hashed from the full input tuple and RENDER_VERSION
+# [year, grand prix, session, driver1, driver2, analysis, lap]
+def render_key(input_data):
+    raw = json.dumps([RENDER_VERSION] + [str(value) for value in input_data])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+class RenderCache:
+    """
+    Directory of rendered images, one file per key, capped at max_bytes.
+
+    Files are written to a temporary name first and moved into place, so
+    readers never see a half-written image. When the directory grows past
+    max_bytes the least recently used files are deleted; a hit refreshes
+    the file's modification time.
+    """
+
+    def __init__(self, directory, max_bytes, suffix='.png'):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def filename(self, key):
+        return key + self.suffix
+
+    def path(self, key):
+        return os.path.join(self.directory, self.filename(key))
+
+    # returns the image path for key, or None on a miss
+    def get(self, key):
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    # stores rendered image bytes under key and returns the file path
+    def put(self, key, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-', suffix=self.suffix)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            path = self.path(key)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._evict()
+        return path
+
+    def stats(self):
+        files = self._files()
+        return {
+            'entries': len(files),
+            'bytes': sum(size for _, size, _ in files),
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    # (path, size, mtime) of every cached image, skipping in-progress temp files
+    def _files(self):
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or not entry.name.endswith(self.suffix):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((entry.path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _evict(self):
+        with self._lock:
+            files = sorted(self._files(), key=lambda item: item[2])
+            used = sum(size for _, size, _ in files)
+            # never drop the newest file, it is the one being returned
+            for path, size, _ in files[:-1]:
+                if used <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                used -= size
+                self.evictions += 1
+
+
+# content type of every image format the plots can be rendered in
+IMAGE_FORMATS = {'png': 'image/png', 'webp': 'image/webp', 'svg': 'image/svg+xml'}
+
+# rendered plots, one file per distinct request, capped by F1_PLOT_CACHE_MB
+# created here rather than in script.py so the web process can serve cached plots
+# without importing fastf1 and matplotlib
+plot_cache = RenderCache(os.path.join(os.getcwd(), 'formula', 'plot', 'cache'),
+                         int(os.environ.get('F1_PLOT_CACHE_MB', 256)) * 1024 * 1024)
@@ -1,7 +1,9 @@
 # imports
 import matplotlib
 matplotlib.use('Agg')
+import io
 import os
+import contextvars
 import numpy as np
 import pandas as pd
 import fastf1 as ff1
@@ -9,365 +11,534 @@ from fastf1 import api
 from fastf1 import utils
 from fastf1 import plotting
 from matplotlib.lines import Line2D
-from matplotlib import pyplot as plt
+from matplotlib.figure import Figure
 from matplotlib.collections import LineCollection
+import cache_manager
+import comparison
+import downsample
+import metrics
+import minisectors
+import telemetry_store
+import track_geometry
+from catalog import driver_code, driver_color
+from render_cache import render_key, plot_cache, IMAGE_FORMATS
+from serialize import to_json
+from session_cache import SessionCache
+from singleflight import SingleFlight
 
 # enables cache, allows storage of race data locally
-ff1.Cache.enable_cache('formula/cache')
+# any older cache tree (fastf1_cache/) is folded into it first
+cache_manager.merge_legacy()
+ff1.Cache.enable_cache(cache_manager.CACHE_PATH)
+
+# keeps recently loaded sessions in memory so repeat requests skip race.load()
+# budget is in megabytes and can be overridden with F1_SESSION_CACHE_MB
+session_cache = SessionCache(int(os.environ.get('F1_SESSION_CACHE_MB', 1024)) * 1024 * 1024)
+
+# per-driver columnar telemetry, built from a session the first time it is needed
+STORE_PATH = os.path.join(os.getcwd(), 'formula', 'store')
+
+# identical concurrent loads and renders are done once, across threads and processes
+# each kind of work has its own lock files, as a render can hold its lock while loading a session
+LOCK_PATH = os.path.join(os.getcwd(), 'formula', 'cache', 'locks')
+session_flight = SingleFlight(os.path.join(LOCK_PATH, 'session'))
+store_flight = SingleFlight(os.path.join(LOCK_PATH, 'store'))
+render_flight = SingleFlight(os.path.join(LOCK_PATH, 'render'), stripes=256)
 
 # patches matplotlib for time delta support
 ff1.plotting.setup_mpl(mpl_timedelta_support = True, color_scheme = 'fastf1')
 
-def plot_function(race, input_data):
-    # Clear any existing plots
-    plt.close('all')
-    
-    # Create a new figure explicitly
-    fig, ax = plt.subplots()  # or whatever subplot configuration you need
-    
-    # Your plotting code...
-    
-    # Save and close
-    plt.savefig(img_path, dpi=200)
-    plt.close(fig)
-    
+# parts of a session that race.load() can fetch independently
+SESSION_PARTS = ('laps', 'telemetry', 'weather', 'messages')
+
+# attribute fastf1 fills in once a part has loaded; a part that fails to load only logs
+# a warning, leaving the attribute unset or empty
+PART_ATTRIBUTES = {'laps': '_laps', 'telemetry': '_car_data', 'weather': '_weather_data',
+                   'messages': '_race_control_messages'}
+
+# session data a telemetry store is built from: telemetry is sliced by lap so it needs laps,
+# and fastf1 only flags laps deleted for track limits once race control messages are loaded
+STORE_PARTS = {'laps', 'telemetry', 'messages'}
+
+# session data each analysis needs
+ANALYSIS_PARTS = {
+    'Lap Time': {'laps'},
+    'Fastest Lap': STORE_PARTS,
+    'Fastest Sectors': STORE_PARTS,
+    'Full Telemetry': STORE_PARTS,
+    'Driver Comparison': STORE_PARTS,
+}
+
+# returns a session with at least the requested parts loaded
+# reuses the in-memory copy when one exists and only loads what it is missing
+def load_session(year, grand_prix, session_type, parts=SESSION_PARTS):
+    key = (int(year), grand_prix, session_type)
+    while True:
+        race = session_cache.get(key)
+        if race is not None and set(parts) <= session_cache.parts(key):
+            return race
+        # a concurrent load of the same session may have fetched fewer parts, then go again
+        race, loaded = session_flight.do(key, _load_session_parts, key, parts)
+        if set(parts) <= loaded:
+            return race
+
+# the loading half of load_session, run by one caller at a time per session
+# load_session already counted the lookup, so the cache is only peeked at here.
+# only parts that actually loaded are cached, so a failed part is tried again next time
+def _load_session_parts(key, parts):
+    race = session_cache.peek(key)
+    loaded = session_cache.parts(key) if race is not None else frozenset()
+    missing = set(parts) - loaded
+    if race is None:
+        with metrics.span('session_lookup'):
+            race = ff1.get_session(*key)
+    if missing:
+        cache_manager.prepare(race.api_path)
+        with metrics.span('session_load'):
+            race.load(**{part: part in missing for part in SESSION_PARTS})
+        cache_manager.after_load(race.api_path)
+        loaded = loaded | _loaded_parts(race, missing)
+        if loaded:
+            session_cache.put(key, race, loaded)
+        failed = missing - loaded
+        if failed:
+            raise ff1.exceptions.DataNotLoadedError(
+                f"Failed to load {', '.join(sorted(failed))} data for {key[0]} {key[1]} {key[2]}")
+    return race, loaded
+
+# the parts fastf1 really loaded, out of those it was asked for
+def _loaded_parts(race, parts):
+    return {part for part in parts if len(getattr(race, PART_ATTRIBUTES[part], ())) > 0}
+
+# returns the memory-mapped telemetry store of a session
+# the session is only loaded (and ingested) if the store does not exist yet, or, when
+# fingerprint is given, if the store was built from other fastf1 cache files than those
+def load_store(year, grand_prix, session_type, fingerprint=None):
+    with metrics.span('store_open'):
+        stored = telemetry_store.open_session(STORE_PATH, year, grand_prix, session_type)
+    if stored is None or _store_outdated(stored, fingerprint):
+        stored = store_flight.do((int(year), grand_prix, session_type), _ingest_store,
+                                 year, grand_prix, session_type, fingerprint)
+    # stores share the cache quota, which evicts the least recently used first
+    cache_manager.mark_used(stored.path)
+    return stored
+
+def _store_outdated(stored, fingerprint):
+    return fingerprint is not None and stored.fingerprint != fingerprint
+
+# builds the store unless another thread or process finished it while we waited
+def _ingest_store(year, grand_prix, session_type, fingerprint=None):
+    stored = telemetry_store.open_session(STORE_PATH, year, grand_prix, session_type)
+    if stored is None or _store_outdated(stored, fingerprint):
+        key = (int(year), grand_prix, session_type)
+        if stored is not None:
+            # the cache files changed under the session, so load them again
+            session_cache.invalidate(key)
+        race = load_session(year, grand_prix, session_type, STORE_PARTS)
+        # taken after the load, which may have fetched files the store is then built from
+        cached = cache_manager.session_path(race.api_path)
+        source = cache_manager.fingerprint(cached) if os.path.isdir(cached) else None
+        with metrics.span('store_ingest'):
+            telemetry_store.write_session(race, STORE_PATH, year, grand_prix, session_type, source)
+        stored = telemetry_store.open_session(STORE_PATH, year, grand_prix, session_type)
+    return stored
+
+# loads whatever an analysis reads from:
+# the telemetry store for telemetry analyses, the session itself for lap times
+def load_source(input_data):
+    if input_data[5] not in ANALYSIS_PARTS:
+        raise ValueError(f"Unknown analysis type: {input_data[5]}")
+
+    parts = ANALYSIS_PARTS[input_data[5]]
+    if 'telemetry' in parts:
+        return load_store(input_data[0], input_data[1], input_data[2])
+    return load_session(input_data[0], input_data[1], input_data[2], parts)
+
 # gets race data from fastf1 based on input data parameter
 # runs appropriate plot function based on user input
+# returns the plot cache key of the rendered image
 def get_race_data(input_data):
     #['2022', 'Austria', 'FP1', 'VER', 'VER', 'Lap Time']
-    race = ff1.get_session(int(input_data[0]), input_data[1], input_data[2])
-    race.load()
-
-    if input_data[5] == 'Lap Time':
-        plot_laptime(race, input_data)
-    elif input_data[5] == 'Fastest Lap':
-        plot_fastest_lap(race, input_data)
-    elif input_data[5] == 'Fastest Sectors':
-        plot_fastest_sectors(race, input_data)
-    elif input_data[5] == 'Full Telemetry':
-        plot_full_telemetry(race, input_data)
-
-# takes in speed/distance data for both drivers and determines which is faster
-# returns dataframe of which driver was the fastest in each sector
-def get_sectors(average_speed, input_data):
-    sectors_combined = average_speed.groupby(['Driver', 'Minisector'])['Speed'].mean().reset_index()
-    final = pd.DataFrame({
-        'Driver': [],
-        'Minisector': [],
-        'Speed': []
-    })
-
-    d1 = sectors_combined.loc[sectors_combined['Driver'] == input_data[3].split()[0]]
-    d2 = sectors_combined.loc[sectors_combined['Driver'] == input_data[4].split()[0]]
-
-    for i in range(0, len(d1)): #issue, sometimes length of d1 is not 25
-        d1_sector = d1.iloc[[i]].values.tolist()
-        d1_speed = d1_sector[0][2]
-        d2_sector = d2.iloc[[i]].values.tolist()
-        d2_speed = d2_sector[0][2]
-        if d1_speed > d2_speed:
-            final.loc[len(final)] = d1_sector[0]
-        else:
-            final.loc[len(final)] = d2_sector[0]
-
-    return final
+    if input_data[5] not in ANALYSIS_PARTS:
+        raise ValueError(f"Unknown analysis type: {input_data[5]}")
+
+    key = render_key(input_data)
+    with metrics.span('plot_cache_lookup'):
+        cached = plot_cache.get(key) is not None
+    metrics.set_labels(analysis=input_data[5], cache='hit' if cached else 'miss')
+    if cached:
+        return key
+    render_flight.do(key, _render_cached, key, input_data)
+    return key
+
+# returns the encoded plot image without going through a file
+# PNGs are shared with the plot cache; WebP and SVG are rendered on demand and left to HTTP caching
+def get_image(input_data, fmt='png'):
+    if input_data[5] not in ANALYSIS_PARTS:
+        raise ValueError(f"Unknown analysis type: {input_data[5]}")
+    if fmt not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format: {fmt}")
+    metrics.set_labels(analysis=input_data[5])
+
+    if fmt == 'png':
+        key = render_key(input_data)
+        return render_flight.do(key, _render_cached, key, input_data)
+    return render_flight.do(render_key(input_data + [fmt]), render_image, input_data, fmt)
+
+# the cached PNG for key, rendered and stored first unless another thread or process already did
+def _render_cached(key, input_data):
+    with metrics.span('plot_cache_lookup'):
+        path = plot_cache.get(key)
+    metrics.set_labels(cache='hit' if path is not None else 'miss')
+    if path is not None:
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            # evicted between the lookup and the read
+            pass
+
+    image = render_image(input_data)
+    with metrics.span('plot_cache_write'):
+        plot_cache.put(key, image)
+    return image
+
+# loads the analysis source and runs the matching plot function
+def render_image(input_data, fmt='png'):
+    source = load_source(input_data)
+    with metrics.span('render'):
+        if input_data[5] == 'Lap Time':
+            return plot_laptime(source, input_data, fmt)
+        elif input_data[5] == 'Fastest Lap':
+            return plot_fastest_lap(source, input_data, fmt)
+        elif input_data[5] == 'Fastest Sectors':
+            return plot_fastest_sectors(source, input_data, fmt)
+        elif input_data[5] in ('Full Telemetry', 'Driver Comparison'):
+            return plot_full_telemetry(source, input_data, fmt)
+
+# entry point for the job pool: renders like get_race_data and also returns the
+# timing summary, since spans recorded in a worker process can't reach /metrics directly
+# runs in a copied context so an inline job doesn't clobber the calling request's spans
+def render_job(input_data):
+    return contextvars.copy_context().run(_render_job, input_data)
+
+def _render_job(input_data):
+    metrics.start_request(endpoint='job', analysis=input_data[5])
+    try:
+        key = get_race_data(input_data)
+    finally:
+        summary = metrics.finish_request()
+    return {'key': key, 'metrics': summary}
+
+# returns the series an analysis plots, as JSON-ready lists
+# with points set, every line is downsampled to at most that many points
+def get_analysis_data(input_data, points=None):
+    metrics.set_labels(analysis=input_data[5])
+    data = analysis_data(load_source(input_data), input_data)
+    if points:
+        with metrics.span('downsample'):
+            data = downsample_data(data, points)
+    return to_json(data)
+
+# runs the data function that backs the requested analysis
+def analysis_data(source, input_data):
+    with metrics.span('compute'):
+        if input_data[5] == 'Lap Time':
+            return laptime_data(source, input_data)
+        elif input_data[5] == 'Fastest Lap':
+            return fastest_lap_data(source, input_data)
+        elif input_data[5] == 'Fastest Sectors':
+            return fastest_sectors_data(source, input_data)
+        elif input_data[5] == 'Full Telemetry':
+            return full_telemetry_data(source, input_data)
+        elif input_data[5] == 'Driver Comparison':
+            return driver_comparison_data(source, input_data)
+
+# LTTB for x/y lines, even striding for the track outline
+def downsample_data(data, points):
+    lines = list(data.get('series', []))
+    for channel in data.get('channels', {}).values():
+        lines += channel
+    for line in lines:
+        keep = downsample.lttb(line['x'], line['y'], points)
+        line['x'], line['y'] = line['x'][keep], line['y'][keep]
+
+    if 'track' in data:
+        keep = downsample.stride(len(data['track']['x']), points)
+        data['track'] = {name: values[keep] for name, values in data['track'].items()}
+    return data
+
+# draws the figure into an in-memory buffer and returns the encoded image
+# the figure is never registered with pyplot, so nothing is left behind once it goes out of scope
+def render_figure(fig, dpi=200, fmt='png'):
+    buffer = io.BytesIO()
+    with metrics.span('savefig'):
+        fig.savefig(buffer, format=fmt, dpi=dpi)
+    fig.clear()
+    return buffer.getvalue()
+
+# renders a tiny figure once, so the backend and font cache are ready before the first request
+def warm_up():
+    fig = Figure(figsize=(1, 1))
+    fig.subplots().plot([0, 1], [0, 1], label='warm-up')
+    render_figure(fig, dpi=10)
+
+# lap times (seconds) by lap number for both specified drivers
+def laptime_data(race, input_data):
+    series = []
+    for name in (input_data[3], input_data[4]):
+        laps = race.laps.pick_driver(driver_code(name))
+        series.append({'name': name, 'color': driver_color(name),
+                       'x': laps['LapNumber'].to_numpy(dtype=float),
+                       'y': laps['LapTime'].dt.total_seconds().to_numpy()})
+
+    return {'title': f"Lap Time Comparison \n" f"{race.event.year} {race.event['EventName']} {input_data[2]}",
+            'series': series}
 
 # plots a laptime/distance comparison for both specified drivers
-# returns a saved version of the generated plot
-def plot_laptime(race, input_data):
-    plt.clf()
-    d1 = input_data[3].split()[0]
-    d2 = input_data[4].split()[0]
-
-    laps_d1 = race.laps.pick_driver(d1)
-    laps_d2 = race.laps.pick_driver(d2)
-
-    color1 = ff1.plotting.driver_color(input_data[3])
-    color2 = ff1.plotting.driver_color(input_data[4])
-
-    fig, ax = plt.subplots()
-    ax.plot(laps_d1['LapNumber'], laps_d1['LapTime'], color = color1, label = input_data[3])
-    ax.plot(laps_d2['LapNumber'], laps_d2['LapTime'], color = color2, label = input_data[4])
-    ax.set_xlabel('Lap Number')
-    ax.set_ylabel('Lap Time')
-    ax.legend()
-    plt.suptitle(f"Lap Time Comparison \n" f"{race.event.year} {race.event['EventName']} {input_data[2]}")
-
-    img_path = os.getcwd() + (f'/formula/plot/{input_data[5]}.png')
-    plt.savefig(img_path, dpi = 200)
+# returns the rendered plot
+def plot_laptime(race, input_data, fmt='png'):
+    data = analysis_data(race, input_data)
+
+    fig = Figure()
+    ax = fig.subplots()
+
+    # Check if we have valid laps data
+    if any(len(line['x']) == 0 for line in data['series']):
+        d1 = driver_code(input_data[3])
+        d2 = driver_code(input_data[4])
+        ax.text(0.5, 0.5, f"No lap data available for {d1} or {d2}",
+                horizontalalignment='center', verticalalignment='center')
+        ax.axis('off')
+    else:
+        for line in data['series']:
+            ax.plot(line['x'], pd.to_timedelta(line['y'], unit='s'), color = line['color'], label = line['name'])
+        ax.set_xlabel('Lap Number')
+        ax.set_ylabel('Lap Time')
+        ax.legend()
+        fig.suptitle(data['title'])
+
+    return render_figure(fig, dpi = 200, fmt = fmt)
+
+# speed by distance on the fastest lap of both drivers
+def fastest_lap_data(stored, input_data):
+    series = []
+    for name in (input_data[3], input_data[4]):
+        driver = stored.driver(driver_code(name))
+        lap = driver.lap(driver.fastest_lap(), ['Distance', 'Speed'])
+        series.append({'name': name, 'color': driver_color(name),
+                       'x': lap['Distance'], 'y': lap['Speed']})
+
+    return {'title': f"Fastest Lap Comparison \n" f"{stored.year} {stored.event_name} {input_data[2]}",
+            'series': series}
 
 # speed comaprison by distance for the fastest lap of both drivers
-# returns a saved version of the generated plot
-def plot_fastest_lap(race, input_data):
-    plt.clf()
-    d1 = input_data[3].split()[0]
-    d2 = input_data[4].split()[0]
-
-    fastest_d1 = race.laps.pick_driver(d1).pick_fastest()
-    fastest_d2 = race.laps.pick_driver(d2).pick_fastest()
-
-    tel_d1 = fastest_d1.get_car_data().add_distance()
-    tel_d2 = fastest_d2.get_car_data().add_distance()
-
-    color1 = ff1.plotting.driver_color(input_data[3])
-    color2 = ff1.plotting.driver_color(input_data[4])
-
-    fig, ax = plt.subplots()
-    ax.plot(tel_d1['Distance'], tel_d1['Speed'], color = color1, label = input_data[3])
-    ax.plot(tel_d2['Distance'], tel_d2['Speed'], color = color2, label = input_data[4])
+# returns the rendered plot
+def plot_fastest_lap(stored, input_data, fmt='png'):
+    data = analysis_data(stored, input_data)
+
+    fig = Figure()
+    ax = fig.subplots()
+    for line in data['series']:
+        ax.plot(line['x'], line['y'], color = line['color'], label = line['name'])
     ax.set_xlabel('Distance (m)')
     ax.set_ylabel('Speed (km/h)')
     ax.legend()
-    plt.suptitle(f"Fastest Lap Comparison \n" f"{race.event.year} {race.event['EventName']} {input_data[2]}")
+    fig.suptitle(data['title'])
 
-    img_path = os.getcwd() + (f'/formula/plot/{input_data[5]}.png')
-    plt.savefig(img_path, dpi = 700)
+    return render_figure(fig, dpi = 700, fmt = fmt)
 
+# number of minisectors asked for by a fastest sectors request, which follows the lap in input_data
+def minisector_count(input_data):
+    try:
+        count = int(input_data[7])
+    except (IndexError, ValueError, TypeError):
+        return track_geometry.DEFAULT_MINISECTORS
+    return min(max(count, 2), track_geometry.MAX_MINISECTORS)
+
+# average speed per minisector for both drivers and the fastest driver in each one
+# minisectors are fixed parts of the circuit's reference outline, which is also the track drawn,
+# with the fastest driver index for every outline point (-1 if none)
+def fastest_sectors_data(stored, input_data):
+    names = [input_data[3], input_data[4]]
+    total_minisectors = minisector_count(input_data)
+
+    # Whole-session telemetry for each driver, memory-mapped from the store
+    telemetry = [stored.driver(driver_code(name)).columns(['Lap', 'Speed', 'X', 'Y']) for name in names]
+
+    with metrics.span('minisectors'):
+        geometry = track_geometry.for_session(stored)
+
+        # Samples off the outline (pit lane) are left out of every minisector
+        average_speed = []
+        for t in telemetry:
+            minisector = geometry.minisectors(t['X'], t['Y'], total_minisectors)
+            laps = np.where(minisector >= 0, t['Lap'], np.nan)
+            average_speed.append(minisectors.minisector_speeds(t['Speed'], laps, np.maximum(minisector, 0),
+                                                               total_minisectors))
+
+        # Get fastest driver in each sector, -1 where neither driver has data
+        average_speed = np.vstack(average_speed)
+        best_sectors = minisectors.fastest_driver(average_speed)
+
+    return {'title': f"Average Fastest Sectors ({total_minisectors} minisectors)\n" f"{stored.year} {stored.event_name} {input_data[2]}",
+            'drivers': [{'name': name, 'color': driver_color(name)} for name in names],
+            'minisectors': {'speed': average_speed, 'fastest': best_sectors},
+            'track': {'x': geometry.x, 'y': geometry.y, 'fastest': best_sectors[geometry.segments(total_minisectors)]}}
 
 # compares the sector speeds for each driver, and generates a map of the circuit, with color coded sectors for the fastest driver.
-# returns a saved version of the generated plot
-def plot_fastest_sectors(race, input_data):
-    plt.clf()
-    laps = race.laps
-    drivers = [input_data[3].split()[0], input_data[4].split()[0]]
-    telemetry_list = []
-    
-    # Make sure we have a valid lap number (modify this part)
-    try:
-        # Try to get the lap number from input_data[6]
-        lap_number = int(input_data[6])
-    except (IndexError, ValueError):
-        # If there's an issue, use the first lap as default
-        lap_number = 1
-        
-    # List of each driver's telemetry data across laps
-    for driver in drivers:
-        driver_laps = laps.pick_driver(driver)
-        for lap in driver_laps.iterlaps():
-            driver_telemtry = lap[1].get_telemetry().add_distance()
-            driver_telemtry['Driver'] = driver
-            driver_telemtry['Lap'] = lap[1]['LapNumber']
-            telemetry_list.append(driver_telemtry)
-    
-    # Concatenate all telemetry dataframes
-    telemetry = pd.concat(telemetry_list, ignore_index=True)
-    
-    # Keep only important columns
-    telemetry = telemetry[['Lap', 'Distance', 'Driver', 'Speed', 'X', 'Y']]
-    
-    # Create minisectors
-    total_minisectors = 25
-    telemetry['Minisector'] = pd.cut(telemetry['Distance'], total_minisectors, labels=False) + 1
-    
-    average_speed = telemetry.groupby(['Lap', 'Minisector', 'Driver'])['Speed'].mean().reset_index()
-    
-    # Get fastest driver in each sector
-    best_sectors = get_sectors(average_speed, input_data)
-    best_sectors = best_sectors[['Driver', 'Minisector']].rename(columns={'Driver': 'fastest_driver'})
-    
-    # Merge telemetry with fastest sector info and sort by distance
-    telemetry = telemetry.merge(best_sectors, on=['Minisector'])
-    telemetry = telemetry.sort_values(by=['Distance'])
-    
-    telemetry.loc[telemetry['fastest_driver'] == input_data[3].split()[0], 'fastest_driver_int'] = 1
-    telemetry.loc[telemetry['fastest_driver'] == input_data[4].split()[0], 'fastest_driver_int'] = 2
-    
-    # Extract X, Y data for a single lap
-    single_lap = telemetry.loc[telemetry['Lap'] == lap_number]
-    lap_x = single_lap['X'].values
-    lap_y = single_lap['Y'].values
+# returns the rendered plot
+def plot_fastest_sectors(stored, input_data, fmt='png'):
+    data = analysis_data(stored, input_data)
+    track = data['track']
 
-    points = np.array([lap_x, lap_y]).T.reshape(-1, 1, 2)
+    points = np.array([track['x'], track['y']]).T.reshape(-1, 1, 2)
     segments = np.concatenate([points[:-1], points[1:]], axis=1)
 
-    which_driver = single_lap['fastest_driver_int'].to_numpy().astype(float)
+    # one colour per segment, taken from the minisector of its first point
+    which_driver = track['fastest'][:-1].astype(float) + 1
+    which_driver[which_driver == 0] = np.nan
 
-    color1 = ff1.plotting.driver_color(input_data[3])
-    color2 = ff1.plotting.driver_color(input_data[4])
-    color1 = matplotlib.colors.to_rgb(color1)
-    color2 = matplotlib.colors.to_rgb(color2)
-    colors = [color1, color2]
+    colors = [matplotlib.colors.to_rgb(driver['color']) for driver in data['drivers']]
     cmap = matplotlib.colors.ListedColormap(colors)
 
-    lc_comp = LineCollection(segments, norm=plt.Normalize(1, cmap.N), cmap=cmap)
+    lc_comp = LineCollection(segments, norm=matplotlib.colors.Normalize(1, cmap.N), cmap=cmap)
     lc_comp.set_array(which_driver)
     lc_comp.set_linewidth(2)
 
-    plt.rcParams['figure.figsize'] = [6.25, 4.70]
-    plt.suptitle(f"Average Fastest Sectors Lap {input_data[6]}\n"
-                 f"{race.event.year} {race.event['EventName']} {input_data[2]}")
-    plt.gca().add_collection(lc_comp)
-    plt.axis('equal')
-    plt.tick_params(labelleft=False, left=False, labelbottom=False, bottom=False)
-
-    legend_lines = [Line2D([0], [0], color=color1, lw=1),
-                    Line2D([0], [0], color=color2, lw=1)]
-    plt.legend(legend_lines, [input_data[3], input_data[4]])
-
-    img_path = os.getcwd() + (f'/formula/plot/{input_data[5]}.png')
-    plt.savefig(img_path, dpi=200)
-
-# plots a speed, throttle, brake, rpm, gear, and drs comparison for both drivers
-# returns a saved version of the generated plot
-def plot_laptime(race, input_data):
-    try:
-        plt.clf()
-        d1 = input_data[3].split()[0]
-        d2 = input_data[4].split()[0]
-
-        laps_d1 = race.laps.pick_driver(d1)
-        laps_d2 = race.laps.pick_driver(d2)
-
-        # Check if we have valid laps data
-        if laps_d1.empty or laps_d2.empty:
-            plt.figure()
-            plt.text(0.5, 0.5, f"No lap data available for {d1} or {d2}", 
-                     horizontalalignment='center', verticalalignment='center')
-            plt.axis('off')
-        else:
-            color1 = ff1.plotting.driver_color(input_data[3])
-            color2 = ff1.plotting.driver_color(input_data[4])
-
-            fig, ax = plt.subplots()
-            ax.plot(laps_d1['LapNumber'], laps_d1['LapTime'], color=color1, label=input_data[3])
-            ax.plot(laps_d2['LapNumber'], laps_d2['LapTime'], color=color2, label=input_data[4])
-            ax.set_xlabel('Lap Number')
-            ax.set_ylabel('Lap Time')
-            ax.legend()
-            plt.suptitle(f"Lap Time Comparison \n" f"{race.event.year} {race.event['EventName']} {input_data[2]}")
-
-        # Create directory if it doesn't exist
-        import os
-        os.makedirs(os.path.dirname(os.getcwd() + '/formula/plot/'), exist_ok=True)
-        
-        img_path = os.getcwd() + (f'/formula/plot/{input_data[5]}.png')
-        plt.savefig(img_path, dpi=200)
-        
-        return True
-    except Exception as e:
-        print(f"Error in plot_laptime: {str(e)}")
-        plt.figure()
-        plt.text(0.5, 0.5, f"Error generating plot: {str(e)}", 
-                 horizontalalignment='center', verticalalignment='center')
-        plt.axis('off')
-        
-        img_path = os.getcwd() + (f'/formula/plot/{input_data[5]}.png')
-        plt.savefig(img_path, dpi=200)
-        
-        return False
-def plot_full_telemetry(race, input_data):
+    fig = Figure(figsize=(6.25, 4.70))
+    ax = fig.subplots()
+    fig.suptitle(data['title'])
+    ax.add_collection(lc_comp)
+    ax.axis('equal')
+    ax.tick_params(labelleft=False, left=False, labelbottom=False, bottom=False)
+
+    legend_lines = [Line2D([0], [0], color=color, lw=1) for color in colors]
+    ax.legend(legend_lines, [driver['name'] for driver in data['drivers']])
+
+    return render_figure(fig, dpi=200, fmt=fmt)
+
+# axis label of every full telemetry channel, top to bottom
+TELEMETRY_CHANNELS = {
+    'Delta': 'Delta (s)',
+    'Speed': 'Speed (km/h)',
+    'Throttle': 'Throttle (%)',
+    'Brake': 'Brake',
+    'RPM': 'RPM',
+    'Gear': 'Gear',
+}
+
+# telemetry columns a lap comparison reads from the store
+COMPARISON_COLUMNS = ['SessionTime', 'Distance', 'Speed', 'Throttle', 'Brake', 'RPM', 'nGear']
+
+# every driver named in input_data, in order: driver1, driver2, then any extra drivers after the lap
+def comparison_drivers(input_data):
+    names = [input_data[3], input_data[4], *input_data[7:]]
+    return list(dict.fromkeys(name for name in names if name))
+
+# one lap per driver (their fastest, or lap_number for everyone) resampled onto a shared
+# distance grid along the first driver's lap; returns the grid, the drivers and
+# {column: array of shape (drivers, grid)} including 'Delta' to the first driver
+def lap_comparison(stored, names, lap_number=None):
+    laps, drivers, used_colors = [], [], set()
+    for name in names:
+        driver = stored.driver(driver_code(name))
+        number = driver.fastest_lap() if lap_number is None else int(lap_number)
+        lap = driver.lap(number, COMPARISON_COLUMNS)
+        lap['Time'] = comparison.elapsed(lap['SessionTime'])
+        laps.append(lap)
+
+        # team mates share a colour, the second one is drawn dashed
+        color = driver_color(name)
+        drivers.append({'name': name, 'color': color, 'style': '--' if color in used_colors else '-',
+                        'lap': number, 'lap_time': driver.lap_time(number)})
+        used_colors.add(color)
+
+    lengths = [lap['Distance'][-1] for lap in laps if len(lap['Distance'])]
+    if not lengths:
+        raise ValueError(f"No telemetry for lap {lap_number} of {', '.join(names)}")
+    reference = laps[0]['Distance']
+    grid = comparison.distance_grid(reference[-1] if len(reference) else max(lengths))
+
+    resampled = comparison.resample(laps, grid, ['Time'] + COMPARISON_COLUMNS[2:])
+    resampled['Delta'] = comparison.deltas(resampled['Time'])
+    return grid, drivers, resampled
+
+# per channel, one line for every driver; the delta channel leaves out the reference driver
+def comparison_channels(grid, drivers, resampled):
+    channels = {'Delta': [{'name': f"{driver['name']} to {drivers[0]['name']}", 'color': driver['color'],
+                           'style': driver['style'], 'x': grid, 'y': resampled['Delta'][i]}
+                          for i, driver in enumerate(drivers) if i > 0]}
+    for channel, column in (('Speed', 'Speed'), ('Throttle', 'Throttle'), ('Brake', 'Brake'),
+                            ('RPM', 'RPM'), ('Gear', 'nGear')):
+        channels[channel] = [{'name': driver['name'], 'color': driver['color'], 'style': driver['style'],
+                              'x': grid, 'y': resampled[column][i]}
+                             for i, driver in enumerate(drivers)]
+    return channels
+
+# speed, throttle, brake (0/1), rpm and gear by distance on the fastest lap of both drivers,
+# plus the delta of driver 2 to driver 1 along driver 1's lap
+def full_telemetry_data(stored, input_data):
+    names = [input_data[3], input_data[4]]
+    grid, drivers, resampled = lap_comparison(stored, names)
+
+    return {'title': f"Fastest Lap Telemetry - {names[0]} vs {names[1]}\n{stored.year} {stored.event_name} {input_data[2]}",
+            'drivers': drivers, 'channels': comparison_channels(grid, drivers, resampled)}
+
+# full telemetry for any number of drivers, with deltas to the first one
+# input_data[6] is 'fastest' for every driver's fastest lap, or a lap number shared by all
+def driver_comparison_data(stored, input_data):
+    names = comparison_drivers(input_data)
+    lap_number = None if str(input_data[6]).lower() in ('', 'fastest') else input_data[6]
+    grid, drivers, resampled = lap_comparison(stored, names, lap_number)
+
+    laps = 'Fastest Laps' if lap_number is None else f"Lap {lap_number}"
+    return {'title': f"Driver Comparison - {laps}, delta to {names[0]}\n{stored.year} {stored.event_name} {input_data[2]}",
+            'drivers': drivers, 'channels': comparison_channels(grid, drivers, resampled)}
+
+# plots a speed, throttle, brake, rpm, gear, and delta comparison for two or more drivers
+def plot_full_telemetry(stored, input_data, fmt='png'):
     """
-    Plots comprehensive telemetry data comparing two drivers' fastest laps.
+    Plots comprehensive telemetry data comparing drivers' laps.
     Displays speed, throttle, brake, RPM, gear, and delta time.
     
     Parameters:
-    race (FastF1 Session): The loaded race session
-    input_data (list): List containing input parameters [year, location, session, driver1, driver2, analysis_type, lap]
+    stored (StoredSession): Telemetry store of the session
+    input_data (list): List containing input parameters [year, location, session, driver1, driver2, analysis_type, lap, *more_drivers]
     
     Returns:
-    None: Saves the plot to the specified location
+    bytes: The rendered plot
     """
-    import os
-    import matplotlib.pyplot as plt
-    from matplotlib.lines import Line2D
-    from fastf1 import utils
-    import fastf1 as ff1
+    data = analysis_data(stored, input_data)
     
-    plt.clf()
-    d1 = input_data[3].split()[0]
-    d2 = input_data[4].split()[0]
-
-    try:
-        # Get fastest laps for both drivers
-        fastest_d1 = race.laps.pick_driver(d1).pick_fastest()
-        fastest_d2 = race.laps.pick_driver(d2).pick_fastest()
-        
-        # Get telemetry data with distance
-        tel_d1 = fastest_d1.get_car_data().add_distance()
-        tel_d2 = fastest_d2.get_car_data().add_distance()
-        
-        # Ensure brake data is properly formatted (convert to binary integers)
-        tel_d1['Brake'] = tel_d1['Brake'].astype(int)
-        tel_d2['Brake'] = tel_d2['Brake'].astype(int)
-        
-        # Calculate delta time between the two drivers
-        delta_time, ref_tel, compare_tel = utils.delta_time(fastest_d1, fastest_d2)
-        
-        # Combine telemetry data for plotting
-        telem_data_combined = [tel_d1, tel_d2]
-        
-        # Get driver colors
-        colors = [ff1.plotting.driver_color(input_data[3]), ff1.plotting.driver_color(input_data[4])]
-        
-        # Create figure with 6 subplots
-        fig, ax = plt.subplots(6, 1, figsize=(12, 10), sharex=True)
-        plt.subplots_adjust(hspace=0.3)
-        
-        # Plot data for both drivers
-        for telem, color in zip(telem_data_combined, colors):
-            # Delta time plot
-            ax[0].axhline(0, color='White', linewidth=0.5)
-            ax[0].plot(ref_tel['Distance'], delta_time, color=color, linewidth=1.5)
-            
-            # Speed plot 
-            ax[1].plot(telem['Distance'], telem['Speed'], color=color, linewidth=1)
-            
-            # Throttle plot
-            ax[2].plot(telem['Distance'], telem['Throttle'], color=color, linewidth=1)
-            
-            # Brake plot
-            ax[3].plot(telem['Distance'], telem['Brake'] * 100, color=color, linewidth=1)  # *100 to make it visible
-            
-            # RPM plot
-            ax[4].plot(telem['Distance'], telem['RPM'], color=color, linewidth=1)
-            
-            # Gear plot
-            ax[5].plot(telem['Distance'], telem['nGear'], color=color, linewidth=1)
-        
-        # Add labels to each subplot
-        ax[0].set_ylabel('Delta (s)')
-        ax[1].set_ylabel('Speed (km/h)')
-        ax[2].set_ylabel('Throttle (%)')
-        ax[3].set_ylabel('Brake')
-        ax[4].set_ylabel('RPM')
-        ax[5].set_ylabel('Gear')
-        ax[5].set_xlabel('Distance (m)')
-        
-        # Set y-axis limits for percentage plots
-        ax[2].set_ylim(0, 100)
-        ax[3].set_ylim(0, 100)
-        
-        # Set title
-        plt.suptitle(f"Fastest Lap Telemetry - {input_data[3]} vs {input_data[4]}\n{race.event.year} {race.event['EventName']} {input_data[2]}", fontsize=16)
-        
-        # Add legend
-        legend_lines = [Line2D([0], [0], color=colors[0], lw=2),
-                        Line2D([0], [0], color=colors[1], lw=2)]
-        
-        ax[0].legend(legend_lines, [input_data[3], input_data[4]], loc='upper right')
-        
-        # Create directory if it doesn't exist
-        plot_dir = os.path.join(os.getcwd(), 'formula', 'plot')
-        os.makedirs(plot_dir, exist_ok=True)
-        
-        # Save the figure
-        img_path = os.path.join(plot_dir, f"{input_data[5]}.png")
-        plt.tight_layout(rect=[0, 0, 1, 0.95])  # Adjust layout with room for title
-        plt.savefig(img_path, dpi=200)
-        plt.close()
-        
-    except Exception as e:
-        print(f"Error in plot_full_telemetry: {str(e)}")
-        
-        # Create a simple error plot
-        plt.figure(figsize=(10, 6))
-        plt.text(0.5, 0.5, f"Error generating telemetry plot:\n{str(e)}",
-                 horizontalalignment='center', verticalalignment='center', fontsize=12)
-        plt.axis('off')
-        
-        # Save the error figure
-        plot_dir = os.path.join(os.getcwd(), 'formula', 'plot')
-        os.makedirs(plot_dir, exist_ok=True)
-        img_path = os.path.join(plot_dir, f"{input_data[5]}.png")
-        plt.savefig(img_path, dpi=200)
-        plt.close()
\ No newline at end of file
+    # Create figure with 6 subplots
+    fig = Figure(figsize=(12, 10))
+    ax = fig.subplots(len(TELEMETRY_CHANNELS), 1, sharex=True)
+    fig.subplots_adjust(hspace=0.3)
+    
+    # Delta time plot
+    ax[0].axhline(0, color='White', linewidth=0.5)
+    
+    # Plot every channel for all drivers, one subplot each
+    for axis, (channel, label) in zip(ax, TELEMETRY_CHANNELS.items()):
+        for line in data['channels'][channel]:
+            y = line['y'] * 100 if channel == 'Brake' else line['y']  # *100 to make it visible
+            axis.plot(line['x'], y, color=line['color'], linestyle=line['style'],
+                      linewidth=1.5 if channel == 'Delta' else 1)
+        axis.set_ylabel(label)
+    ax[-1].set_xlabel('Distance (m)')
+    
+    # Set y-axis limits for percentage plots
+    ax[2].set_ylim(0, 100)
+    ax[3].set_ylim(0, 100)
+    
+    # Set title
+    fig.suptitle(data['title'], fontsize=16)
+    
+    # Add legend
+    legend_lines = [Line2D([0], [0], color=driver['color'], linestyle=driver['style'], lw=2) for driver in data['drivers']]
+    
+    ax[0].legend(legend_lines, [driver['name'] for driver in data['drivers']], loc='upper right')
+    
+    fig.tight_layout(rect=[0, 0, 1, 0.95])  # Adjust layout with room for title
+    return render_figure(fig, dpi=200, fmt=fmt)
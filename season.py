@@ -0,0 +1,288 @@
+# season-wide analytics from small per-session summaries
+#
+#   python season.py update 2024 --sessions Race Qualifying --workers 4
+#   python season.py pace 2024
+#   python season.py minisectors 2024 --session Qualifying
+#
+# every cached session is reduced once, in a process pool, to a json summary of
+# per-driver lap pace and minisector wins. a summary remembers the fingerprint of
+# the fastf1 cache files it was built from, so an update only recomputes sessions
+# whose data changed or newly arrived. season queries read the summaries alone and
+# never load raw telemetry
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cache_manager
+from catalog import Catalog, slug
+
+SUMMARY_PATH = os.path.join('formula', 'summaries')
+
+# bump when the summary contents change, so old summaries are rebuilt
+SUMMARY_VERSION = 2
+
+# minisectors of the circuit outline used for the win counts, as in the fastest sectors analysis
+MINISECTORS = 25
+
+# laps slower than this fraction of a driver's fastest lap (pit stops, safety car)
+# are left out of their typical pace
+CLEAN_LAP_FACTOR = 1.07
+
+QUERIES = ('pace', 'minisectors')
+
+# parsed summaries by path, reused while the file is unchanged
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def summary_path(year, grand_prix, session_type, root=SUMMARY_PATH):
+    return os.path.join(root, str(year), slug(session_type), f"{slug(grand_prix)}.json")
+
+
+def read_summary(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _loaded_lock:
+        cached = _loaded.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    try:
+        with open(path) as f:
+            summary = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    with _loaded_lock:
+        _loaded[path] = (stamp, summary)
+    return summary
+
+
+def write_summary(path, summary):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(summary, f)
+    os.replace(tmp, path)
+
+
+# the summary of a session if it was built from the data now in the cache
+def current_summary(year, grand_prix, session_type, root=SUMMARY_PATH, cache_root=cache_manager.CACHE_PATH):
+    summary = read_summary(summary_path(year, grand_prix, session_type, root))
+    if summary is None or summary.get('version') != SUMMARY_VERSION:
+        return None
+    cached = cache_manager.find_session(year, grand_prix, session_type, cache_root)
+    if cached is None or cache_manager.fingerprint(cached) != summary.get('fingerprint'):
+        return None
+    return summary
+
+
+# per-driver pace and minisector wins of one session, from its telemetry store
+# runs in a pool worker, which imports the analysis code itself
+def summarize_session(year, grand_prix, session_type, offline=True):
+    import numpy as np
+    import minisectors
+    import script
+    import track_geometry
+
+    script.ff1.Cache.offline_mode(offline)
+    try:
+        # a store built before the session's cache files changed is ingested again
+        cached = cache_manager.find_session(year, grand_prix, session_type)
+        stored = script.load_store(year, grand_prix, session_type,
+                                   cache_manager.fingerprint(cached) if cached else None)
+        numbers = sorted(stored.drivers, key=int)
+
+        drivers = {}
+        telemetry = []
+        for number in numbers:
+            driver = stored.driver(number)
+            lap_times = driver.laps['LapTime'][~np.isnan(driver.laps['LapTime'])]
+            fastest = float(lap_times.min()) if len(lap_times) else None
+            clean = lap_times[lap_times <= fastest * CLEAN_LAP_FACTOR] if fastest else lap_times
+            drivers[number] = {'abbreviation': stored.drivers[number], 'laps': int(len(lap_times)),
+                               'fastest': fastest, 'median': float(np.median(clean)) if len(clean) else None,
+                               'minisector_wins': 0}
+            telemetry.append(driver.columns(['Lap', 'Speed', 'X', 'Y']))
+
+        # same minisectors as the fastest sectors analysis, with every driver competing
+        geometry = track_geometry.for_session(stored)
+        speeds = []
+        for t in telemetry:
+            minisector = geometry.minisectors(t['X'], t['Y'], MINISECTORS)
+            laps = np.where(minisector >= 0, t['Lap'], np.nan)
+            speeds.append(minisectors.minisector_speeds(t['Speed'], laps, np.maximum(minisector, 0), MINISECTORS))
+        if speeds:
+            winners = minisectors.fastest_driver(np.vstack(speeds))
+            for index, wins in enumerate(np.bincount(winners[winners >= 0], minlength=len(numbers))):
+                drivers[numbers[index]]['minisector_wins'] = int(wins)
+    finally:
+        # the worker only writes summaries, keep its memory flat
+        script.session_cache.invalidate((int(year), grand_prix, session_type))
+
+    return {'version': SUMMARY_VERSION, 'year': str(year), 'grand_prix': grand_prix, 'session': session_type,
+            'minisectors': MINISECTORS, 'drivers': drivers}
+
+
+# rebuilds the summaries of every cached session whose data changed since its summary was written
+# sessions that are not in the fastf1 cache are skipped; yields (grand prix, session, status, message)
+def update(year, events, session_types, workers=2, offline=True, root=SUMMARY_PATH,
+           cache_root=cache_manager.CACHE_PATH):
+    todo = []
+    for grand_prix in events:
+        for session_type in session_types:
+            if cache_manager.find_session(year, grand_prix, session_type, cache_root) is None:
+                yield grand_prix, session_type, 'not cached', ''
+            elif current_summary(year, grand_prix, session_type, root, cache_root) is not None:
+                yield grand_prix, session_type, 'current', ''
+            else:
+                todo.append((grand_prix, session_type))
+    if not todo:
+        return
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = {pool.submit(summarize_session, year, grand_prix, session_type, offline): (grand_prix, session_type)
+                   for grand_prix, session_type in todo}
+        for future in as_completed(futures):
+            grand_prix, session_type = futures[future]
+            try:
+                summary = future.result()
+            except Exception as e:
+                yield grand_prix, session_type, 'failed', str(e) or type(e).__name__
+                continue
+            # taken after the load, so files fastf1 fetched meanwhile count as summarized
+            cached = cache_manager.find_session(year, grand_prix, session_type, cache_root)
+            summary['fingerprint'] = cache_manager.fingerprint(cached) if cached else None
+            write_summary(summary_path(year, grand_prix, session_type, root), summary)
+            yield grand_prix, session_type, 'updated', ''
+    except BaseException:
+        # interrupted, or the caller stopped iterating: drop the queued sessions
+        # rather than waiting for every one of them to run
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
+
+
+# summaries of a season in calendar order, and the events that have none yet
+def season_summaries(year, events, session_type, root=SUMMARY_PATH):
+    summaries, missing = [], []
+    for grand_prix in events:
+        summary = read_summary(summary_path(year, grand_prix, session_type, root))
+        if summary is None or summary.get('version') != SUMMARY_VERSION:
+            missing.append(grand_prix)
+        else:
+            summaries.append(summary)
+    return summaries, missing
+
+
+# typical lap of every driver at every event, as a gap in percent to the quickest driver there
+def pace(year, events, session_type='Race', root=SUMMARY_PATH):
+    summaries, missing = season_summaries(year, events, session_type, root)
+    drivers = {}
+    for index, summary in enumerate(summaries):
+        medians = {entry['abbreviation']: entry['median'] for entry in summary['drivers'].values()
+                   if entry['median'] is not None}
+        if not medians:
+            continue
+        best = min(medians.values())
+        for abbreviation, median in medians.items():
+            gaps = drivers.setdefault(abbreviation, [None] * len(summaries))
+            gaps[index] = round((median / best - 1) * 100, 3)
+
+    average = {abbreviation: round(statistics.mean(gap for gap in gaps if gap is not None), 3)
+               for abbreviation, gaps in drivers.items()}
+    return {'year': str(year), 'session': session_type, 'query': 'pace',
+            'events': [summary['grand_prix'] for summary in summaries], 'missing': missing,
+            'gap_percent': dict(sorted(drivers.items(), key=lambda item: average[item[0]])),
+            'average_gap_percent': dict(sorted(average.items(), key=lambda item: item[1]))}
+
+
+# minisectors each driver was fastest in, per event and over the season
+def minisector_wins(year, events, session_type='Race', root=SUMMARY_PATH):
+    summaries, missing = season_summaries(year, events, session_type, root)
+    wins = {}
+    for index, summary in enumerate(summaries):
+        for entry in summary['drivers'].values():
+            per_event = wins.setdefault(entry['abbreviation'], [0] * len(summaries))
+            per_event[index] = entry['minisector_wins']
+
+    totals = {abbreviation: sum(per_event) for abbreviation, per_event in wins.items()}
+    return {'year': str(year), 'session': session_type, 'query': 'minisectors', 'minisectors': MINISECTORS,
+            'events': [summary['grand_prix'] for summary in summaries], 'missing': missing,
+            'wins': dict(sorted(wins.items(), key=lambda item: -totals[item[0]])),
+            'total_wins': dict(sorted(totals.items(), key=lambda item: -item[1]))}
+
+
+def query(name, year, events, session_type='Race', root=SUMMARY_PATH):
+    if name == 'pace':
+        return pace(year, events, session_type, root)
+    elif name == 'minisectors':
+        return minisector_wins(year, events, session_type, root)
+    raise ValueError(f"Unknown season query: {name}")
+
+
+def print_ranking(result):
+    ranking = result.get('average_gap_percent') or result.get('total_wins') or {}
+    unit = '%' if result['query'] == 'pace' else ' minisectors'
+    print(f"{result['year']} {result['session']} {result['query']}, {len(result['events'])} events")
+    for position, (abbreviation, value) in enumerate(ranking.items(), 1):
+        print(f"{position:3}. {abbreviation:4} {value:g}{unit}")
+    if result['missing']:
+        print(f"No summary yet for: {', '.join(result['missing'])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Season analytics from per-session summaries")
+    parser.add_argument('--root', default=SUMMARY_PATH, help="where summaries are kept")
+    parser.add_argument('--data', default=os.path.join('formula', 'data'), help="directory with events.csv")
+    commands = parser.add_subparsers(dest='command', required=True)
+    update_parser = commands.add_parser('update', help="summarize cached sessions that are new or changed")
+    update_parser.add_argument('year')
+    update_parser.add_argument('--sessions', nargs='+', default=['Race'], help="session types to summarize")
+    update_parser.add_argument('--workers', type=int, default=2, help="number of worker processes")
+    update_parser.add_argument('--online', action='store_true', help="let fastf1 fetch parts missing from the cache")
+    for name in QUERIES:
+        query_parser = commands.add_parser(name, help=f"season {name} ranking from the summaries")
+        query_parser.add_argument('year')
+        query_parser.add_argument('--session', default='Race')
+        query_parser.add_argument('--json', action='store_true', help="print the raw result")
+    args = parser.parse_args(argv)
+
+    catalog = Catalog(args.data)
+    if args.year not in catalog.years():
+        print(f"{args.year} is not listed in events.csv")
+        return 1
+    events = catalog.events(args.year)
+
+    if args.command == 'update':
+        start = time.perf_counter()
+        failed = 0
+        try:
+            for grand_prix, session_type, status, message in update(args.year, events, args.sessions, args.workers,
+                                                                    not args.online, args.root):
+                failed += status == 'failed'
+                print(f"{status:10} {grand_prix} {session_type}  {message}".rstrip())
+        except KeyboardInterrupt:
+            print("Interrupted; rerun the same command to summarize the remaining sessions")
+            return 1
+        # the workers may exit before their background quota pass is done, so run one here
+        cache_manager.maintain()
+        print(f"Done in {time.perf_counter() - start:.1f}s")
+        return 1 if failed else 0
+
+    result = query(args.command, args.year, events, args.session, args.root)
+    if args.json:
+        print(json.dumps(result, indent=1))
+    else:
+        print_ranking(result)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,20 @@
+# conversion of analysis results to plain json
+# numpy-only, so the web process and live timing can use it without the analysis code
+import numpy as np
+
+
+# converts numpy arrays to lists, with NaN as None so the output is valid JSON
+def to_json(value):
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, np.ndarray):
+        if value.ndim > 1:
+            return [to_json(row) for row in value]
+        if value.dtype.kind == 'f':
+            return [None if np.isnan(item) else item for item in value.tolist()]
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
@@ -0,0 +1,114 @@
+# in-process LRU cache for loaded fastf1 sessions
+import sys
+import threading
+from collections import OrderedDict
+
+
+# rough in-memory footprint of a loaded session, in bytes
+# counts every dataframe hanging off the session (laps, telemetry, weather, ...)
+def session_nbytes(session):
+    total = 0
+    for name in ('_laps', '_car_data', '_pos_data', '_weather_data',
+                 '_race_control_messages', '_results', '_session_status',
+                 '_track_status'):
+        value = getattr(session, name, None)
+        if value is None:
+            continue
+        frames = value.values() if isinstance(value, dict) else [value]
+        for frame in frames:
+            try:
+                total += int(frame.memory_usage(index=True, deep=True).sum())
+            except (AttributeError, TypeError, ValueError):
+                total += sys.getsizeof(frame)
+    return total
+
+
+class SessionCache:
+    """
+    Memory-bounded LRU cache of loaded sessions.
+
+    Entries are keyed by (year, grand prix, session type) and remember which
+    parts of the session (laps, telemetry, ...) have been loaded so far. Once
+    the summed size of all entries goes over max_bytes, the least recently
+    used ones are dropped. The most recent entry is always kept, even if it
+    is bigger than the budget on its own.
+    """
+
+    def __init__(self, max_bytes, sizeof=session_nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return sum(entry[2] for entry in self._entries.values())
+
+    # returns the cached session for key, or None on a miss
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    # like get, but without counting a hit or miss or refreshing the entry
+    # for a second look at a key whose lookup was already counted
+    def peek(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[0] if entry is not None else None
+
+    # parts of the session loaded so far, empty if the key is not cached
+    def parts(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry is not None else frozenset()
+
+    # (re)stores a session; call again after loading more parts so that
+    # the recorded parts and size stay accurate
+    def put(self, key, session, parts=()):
+        size = self.sizeof(session)
+        with self._lock:
+            self._entries[key] = (session, frozenset(parts), size)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    # drops one key, or every entry when key is None
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': sum(entry[2] for entry in self._entries.values()),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _evict(self):
+        used = sum(entry[2] for entry in self._entries.values())
+        while used > self.max_bytes and len(self._entries) > 1:
+            _, (_, _, size) = self._entries.popitem(last=False)
+            used -= size
+            self.evictions += 1
@@ -0,0 +1,155 @@
+# coalesces identical concurrent work, such as loading the same session twice
+#
+# within a process the first caller for a key runs the work and every other
+# caller waits for its result; across processes the leaders take a file lock,
+# so a second process blocks until the first is done and then finds the result
+# already on disk (in the fastf1 cache, telemetry store or plot cache)
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import Future
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+class _Abandoned(Exception):
+    """The leader was interrupted before finishing; a waiter takes over"""
+
+
+class FileLock:
+    """Exclusive lock on a file, shared by every process using the same path"""
+
+    def __init__(self, path, timeout=None, poll=0.05):
+        self.path = path
+        self.timeout = timeout
+        self.poll = poll
+        self._fd = None
+
+    def _try_lock(self, fd):
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+
+    def acquire(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while not self._try_lock(fd):
+            if deadline is not None and time.monotonic() > deadline:
+                os.close(fd)
+                raise TimeoutError(f"Timed out waiting for lock {self.path}")
+            time.sleep(self.poll)
+        self._fd = fd
+
+    def release(self):
+        fd, self._fd = self._fd, None
+        if fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class SingleFlight:
+    """
+    Runs fn at most once at a time per key.
+
+    do(key, fn, *args) returns fn's result. Callers that arrive while the
+    same key is in flight wait for the leader and get its result, or its
+    exception re-raised. Nothing is remembered afterwards: the next call
+    for the key runs fn again, so fn should check its own cache first.
+
+    With lock_dir set the leader also holds a file lock for the key, which
+    serialises the same work across processes. Keys are hashed onto a fixed
+    number of lock files, so the directory never grows.
+
+    A waiter gives up with TimeoutError after timeout seconds, without
+    affecting the leader. If the leader is interrupted (KeyboardInterrupt,
+    SystemExit, a cancelled job) its waiters are not failed with it; one of
+    them becomes the new leader and runs fn itself.
+    """
+
+    def __init__(self, lock_dir=None, timeout=None, lock_timeout=None, stripes=64):
+        self.lock_dir = lock_dir
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout
+        self.stripes = stripes
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def lock_path(self, key):
+        digest = hashlib.sha256(repr(key).encode('utf-8')).digest()
+        stripe = int.from_bytes(digest[:4], 'big') % self.stripes
+        return os.path.join(self.lock_dir, f'{stripe:03d}.lock')
+
+    def do(self, key, fn, *args, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = Future()
+                    self.leaders += 1
+                else:
+                    self.coalesced += 1
+
+            if leader:
+                return self._lead(key, call, fn, args)
+            try:
+                return call.result(timeout=timeout)
+            except _Abandoned:
+                continue
+
+    def _lead(self, key, call, fn, args):
+        try:
+            if self.lock_dir:
+                with FileLock(self.lock_path(key), self.lock_timeout):
+                    result = fn(*args)
+            else:
+                result = fn(*args)
+        except Exception as e:
+            call.set_exception(e)
+            raise
+        except BaseException:
+            call.set_exception(_Abandoned())
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        return {'leaders': self.leaders, 'coalesced': self.coalesced, 'in_flight': self.in_flight()}
@@ -0,0 +1,231 @@
+# columnar telemetry store derived from loaded fastf1 sessions
+# every driver gets one .npy file per channel, read back through memory mapping
+# so an analysis only pages in the columns and laps it actually touches
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+import minisectors
+import progress
+from catalog import slug
+
+# channels kept for every telemetry sample, with their on-disk dtype
+COLUMNS = {
+    'SessionTime': np.float64,
+    'Lap': np.float32,
+    'Distance': np.float32,
+    'Speed': np.float32,
+    'Throttle': np.float32,
+    'Brake': np.uint8,
+    'RPM': np.float32,
+    'nGear': np.int8,
+    'X': np.float32,
+    'Y': np.float32,
+}
+
+# per-lap table; start/stop are sample indices into the column files
+LAP_DTYPE = np.dtype([
+    ('LapNumber', np.int16),
+    ('LapTime', np.float64),
+    ('LapStartTime', np.float64),
+    ('Time', np.float64),
+    ('IsPersonalBest', np.bool_),
+    ('Deleted', np.bool_),
+    ('start', np.int64),
+    ('stop', np.int64),
+])
+
+# bump when the layout or contents of the store change, so stores written by older code are rebuilt
+STORE_VERSION = 3
+
+
+# directory of a session, keyed by the same (year, grand prix, session type) the app uses
+def session_path(root, year, grand_prix, session_type):
+    return os.path.join(root, str(int(year)), slug(grand_prix), slug(session_type))
+
+
+def _seconds(series):
+    return series.dt.total_seconds().to_numpy(dtype=float)
+
+
+# column arrays and lap table for one driver, or None if they have no laps or telemetry
+def _driver_arrays(race, driver):
+    driver_laps = race.laps.pick_driver(driver)
+    if driver_laps.empty or driver not in race.car_data or driver not in race.pos_data:
+        return None
+    telemetry = driver_laps.get_car_data().merge_channels(driver_laps.get_pos_data())
+    if telemetry.empty:
+        return None
+
+    session_time = _seconds(telemetry['SessionTime'])
+    speed = telemetry['Speed'].to_numpy(dtype=float)
+    lap_numbers = minisectors.assign_laps(session_time, _seconds(driver_laps['LapStartTime']),
+                                          _seconds(driver_laps['Time']), driver_laps['LapNumber'].to_numpy())
+
+    columns = {
+        'SessionTime': session_time,
+        'Lap': lap_numbers,
+        'Distance': minisectors.lap_distance(session_time, speed, lap_numbers),
+        'Speed': speed,
+        'Throttle': telemetry['Throttle'].to_numpy(dtype=float),
+        'Brake': telemetry['Brake'].fillna(0).to_numpy().astype(np.uint8),
+        'RPM': telemetry['RPM'].to_numpy(dtype=float),
+        'nGear': telemetry['nGear'].fillna(0).to_numpy(),
+        'X': telemetry['X'].to_numpy(dtype=float),
+        'Y': telemetry['Y'].to_numpy(dtype=float),
+    }
+
+    # samples of a lap are contiguous because telemetry is sorted by time
+    laps = np.zeros(len(driver_laps), dtype=LAP_DTYPE)
+    laps['LapNumber'] = driver_laps['LapNumber'].to_numpy()
+    laps['LapTime'] = _seconds(driver_laps['LapTime'])
+    laps['LapStartTime'] = _seconds(driver_laps['LapStartTime'])
+    laps['Time'] = _seconds(driver_laps['Time'])
+    # unknown counts as not a personal best / not deleted
+    laps['IsPersonalBest'] = driver_laps['IsPersonalBest'].fillna(False).to_numpy(dtype=bool)
+    laps['Deleted'] = driver_laps['Deleted'].fillna(False).to_numpy(dtype=bool)
+    assigned = np.flatnonzero(~np.isnan(lap_numbers))
+    found, first, counts = np.unique(lap_numbers[assigned], return_index=True, return_counts=True)
+    has_samples = np.isin(laps['LapNumber'], found)
+    row = np.searchsorted(found, laps['LapNumber'][has_samples])
+    laps['start'][has_samples] = assigned[first[row]]
+    laps['stop'][has_samples] = assigned[first[row] + counts[row] - 1] + 1
+    return columns, laps
+
+
+# writes the per-driver store for a session loaded with laps, telemetry and race control messages
+# the store is built in a temporary directory and moved into place in one step;
+# fingerprint identifies the fastf1 cache files it was built from. raises ValueError
+# rather than writing a store without drivers, which would never be rebuilt
+def write_session(race, root, year, grand_prix, session_type, fingerprint=None):
+    path = session_path(root, year, grand_prix, session_type)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(path), prefix='.tmp-')
+    outdated = None
+
+    try:
+        drivers = {}
+        for index, driver in enumerate(race.drivers):
+            progress.report('store_ingest', index / len(race.drivers), detail=str(driver))
+            arrays = _driver_arrays(race, driver)
+            if arrays is None:
+                continue
+            columns, laps = arrays
+            driver_dir = os.path.join(tmp, str(driver))
+            os.makedirs(driver_dir)
+            for name, dtype in COLUMNS.items():
+                np.save(os.path.join(driver_dir, f'{name}.npy'), np.asarray(columns[name]).astype(dtype))
+            np.save(os.path.join(driver_dir, 'laps.npy'), laps)
+            drivers[str(driver)] = race.get_driver(driver)['Abbreviation']
+        if not drivers:
+            raise ValueError(f"No laps or telemetry to store for {year} {grand_prix} {session_type}")
+
+        meta = {'version': STORE_VERSION, 'year': int(race.event.year), 'event_name': race.event['EventName'],
+                'session': session_type, 'drivers': drivers, 'fingerprint': fingerprint}
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        # a store being replaced (outdated, or built from older cache files) is moved
+        # aside first, then removed once the new one is in place
+        if os.path.isdir(path):
+            outdated = tempfile.mkdtemp(dir=os.path.dirname(path), prefix='.old-')
+            os.rename(path, os.path.join(outdated, 'store'))
+
+        # another process may have finished the same session first; keep theirs
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            if _read_meta(path) is None:
+                raise
+    finally:
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp, ignore_errors=True)
+        if outdated is not None:
+            shutil.rmtree(outdated, ignore_errors=True)
+    return path
+
+
+# meta.json of a store written by the current code, None if missing or outdated
+# (stores without drivers, left by a load that failed without raising, are outdated too)
+def _read_meta(path):
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return meta if meta.get('version') == STORE_VERSION and meta.get('drivers') else None
+
+
+# opens a stored session, or returns None if it has not been ingested yet
+# (or was ingested by code writing an older layout, so it is ingested again)
+def open_session(root, year, grand_prix, session_type):
+    path = session_path(root, year, grand_prix, session_type)
+    meta = _read_meta(path)
+    if meta is None:
+        return None
+    return StoredSession(path, meta)
+
+
+class StoredSession:
+    """Read-only view of one ingested session"""
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.year = meta['year']
+        self.event_name = meta['event_name']
+        self.session = meta['session']
+        self.drivers = meta['drivers']
+        self.fingerprint = meta.get('fingerprint')
+        self._abbreviations = {abbreviation: number for number, abbreviation in self.drivers.items()}
+        self._open = {}
+
+    # accepts a driver number or abbreviation, like Laps.pick_driver
+    def driver(self, identifier):
+        identifier = str(identifier)
+        number = identifier if identifier in self.drivers else self._abbreviations.get(identifier)
+        if number is None:
+            raise KeyError(f"No stored telemetry for driver {identifier}")
+        if number not in self._open:
+            self._open[number] = StoredDriver(os.path.join(self.path, number))
+        return self._open[number]
+
+
+class StoredDriver:
+    """Memory-mapped telemetry columns and lap table of one driver"""
+
+    def __init__(self, path):
+        self.path = path
+        self.laps = np.load(os.path.join(path, 'laps.npy'))
+        self._columns = {}
+
+    def column(self, name):
+        if name not in self._columns:
+            self._columns[name] = np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r')
+        return self._columns[name]
+
+    # whole-session arrays for the requested columns
+    def columns(self, names):
+        return {name: self.column(name) for name in names}
+
+    # arrays of a single lap, empty if the lap has no telemetry
+    def lap(self, lap_number, names):
+        row = self.laps[self.laps['LapNumber'] == int(lap_number)]
+        start, stop = (row['start'][0], row['stop'][0]) if len(row) else (0, 0)
+        return {name: self.column(name)[start:stop] for name in names}
+
+    # lap time in seconds, NaN for an untimed or unknown lap
+    def lap_time(self, lap_number):
+        row = self.laps[self.laps['LapNumber'] == int(lap_number)]
+        return float(row['LapTime'][0]) if len(row) else float('nan')
+
+    # lap number of the fastest lap that counted, like Laps.pick_fastest: only personal
+    # best laps are considered, so laps deleted for track limits are never picked
+    def fastest_lap(self):
+        laps = self.laps
+        counted = (laps['IsPersonalBest'] & ~laps['Deleted'] & ~np.isnan(laps['LapTime'])
+                   & (laps['stop'] > laps['start']))
+        timed = laps[counted]
+        if not len(timed):
+            raise ValueError(f"No timed laps in {self.path}")
+        return int(timed['LapNumber'][np.argmin(timed['LapTime'])])
@@ -0,0 +1,19 @@
+# the modules live at the top of the repository, next to app.py
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# the app is imported with jobs run inline and without the background warm-up
+os.environ.setdefault('F1_STARTUP', 'lazy')
+os.environ.setdefault('F1_WORKERS', '0')
+
+
+# the app module, imported from the repository directory it keeps its data in
+@pytest.fixture
+def app_module(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    import app
+    return app
@@ -0,0 +1,112 @@
+import os
+import pickle
+import cache_manager
+
+SESSION = os.path.join('2024', '2024-05-05_Miami_Grand_Prix', '2024-05-05_Race')
+
+
+# a session directory with one fastf1-style pickle of about size bytes
+def add_session(root, relative=SESSION, size=1000, used=None, name='car_data.ff1pkl'):
+    path = os.path.join(str(root), relative)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, name), 'wb') as f:
+        pickle.dump({'version': 1, 'data': b'x' * size}, f)
+    if used is not None:
+        cache_manager.mark_used(path)
+        os.utime(os.path.join(path, cache_manager.USED_MARKER), (used, used))
+    return path
+
+
+def truncate(path):
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) // 2)
+
+
+def test_enforce_quota_evicts_least_recently_used(tmp_path):
+    root, store = tmp_path / 'cache', tmp_path / 'store'
+    old = add_session(root, used=100)
+    kept = add_session(root, os.path.join('2024', '2024-04-21_Chinese_Grand_Prix', '2024-04-21_Race'), used=50)
+    new = add_session(root, os.path.join('2024', '2024-05-26_Monaco_Grand_Prix', '2024-05-26_Race'), used=300)
+    stored = store / '2024' / 'Miami_Grand_Prix' / 'Race'
+    stored.mkdir(parents=True)
+    (stored / 'meta.json').write_text('{}')
+    (stored / 'Speed.npy').write_bytes(b'x' * 1000)
+    os.utime(stored / 'meta.json', (200, 200))
+    os.utime(stored / 'Speed.npy', (200, 200))
+
+    evicted = cache_manager.enforce_quota(str(root), 2500, keep=[kept], derived=[str(store)])
+
+    assert evicted == [old, str(stored)]
+    assert os.path.isdir(kept) and os.path.isdir(new)
+    # emptied event and year directories go too, the tree root stays
+    assert not os.path.exists(os.path.dirname(old))
+    assert not (store / '2024').exists() and store.exists()
+
+
+def test_quota_of_zero_evicts_nothing(tmp_path):
+    path = add_session(tmp_path)
+    assert cache_manager.enforce_quota(str(tmp_path), 0, derived=[]) == []
+    assert os.path.isdir(path)
+
+
+def test_merge_keeps_one_readable_copy(tmp_path):
+    source, target = tmp_path / 'legacy', tmp_path / 'cache'
+    add_session(source, name='laps.ff1pkl')
+    add_session(source, name='car_data.ff1pkl', size=10)
+    add_session(source, name='weather.ff1pkl')
+    add_session(target, name='car_data.ff1pkl', size=10)
+    add_session(target, name='weather.ff1pkl')
+    truncate(os.path.join(str(target), SESSION, 'weather.ff1pkl'))
+
+    counts = cache_manager.merge(str(source), str(target))
+
+    assert counts == {'moved': 1, 'duplicates': 1, 'replaced': 1}
+    assert not source.exists()
+    merged = os.path.join(str(target), SESSION)
+    assert sorted(os.listdir(merged)) == ['car_data.ff1pkl', 'laps.ff1pkl', 'weather.ff1pkl']
+    assert cache_manager.verify_file(os.path.join(merged, 'weather.ff1pkl'))
+
+
+def test_verify_removes_unreadable_pickles(tmp_path):
+    path = add_session(tmp_path)
+    add_session(tmp_path, name='laps.ff1pkl')
+    truncate(os.path.join(path, 'laps.ff1pkl'))
+    assert cache_manager.verify(str(tmp_path)) == [os.path.join(path, 'laps.ff1pkl')]
+    assert os.listdir(path) == ['car_data.ff1pkl']
+
+
+def test_prepare_drops_files_written_since_the_last_use(tmp_path):
+    path = add_session(tmp_path, used=None)
+    api_path = '/static/' + SESSION.replace(os.sep, '/') + '/'
+    assert cache_manager.prepare(api_path, str(tmp_path)) == []
+
+    # an older truncated file was read fine by the last load, a newer one was cut short since
+    marked = os.path.getmtime(os.path.join(path, cache_manager.USED_MARKER))
+    for name, stamp in (('laps.ff1pkl', marked - 10), ('weather.ff1pkl', marked + 10)):
+        add_session(tmp_path, name=name)
+        truncate(os.path.join(path, name))
+        os.utime(os.path.join(path, name), (stamp, stamp))
+    assert cache_manager.prepare(api_path, str(tmp_path)) == [os.path.join(path, 'weather.ff1pkl')]
+
+
+def test_compress_round_trip_keeps_the_fingerprint(tmp_path):
+    path = add_session(tmp_path, used=100)
+    fingerprint = cache_manager.fingerprint(path)
+    assert cache_manager.compress(str(tmp_path), cold_days=1) > 0
+    assert sorted(os.listdir(path)) == [cache_manager.USED_MARKER, 'car_data.ff1pkl.gz']
+    assert cache_manager.fingerprint(path) == fingerprint
+
+    assert cache_manager.decompress(path) == 1
+    assert cache_manager.verify_file(os.path.join(path, 'car_data.ff1pkl'))
+    assert cache_manager.fingerprint(path) == fingerprint
+
+
+def test_find_session_matches_full_names(tmp_path):
+    race = add_session(tmp_path)
+    sprint = add_session(tmp_path, os.path.join('2024', '2024-05-05_Miami_Grand_Prix', '2024-05-04_Sprint_Qualifying'))
+    practice = add_session(tmp_path, os.path.join('2024', '2024-05-05_Miami_Grand_Prix', '2024-05-03_Practice_1'))
+    assert cache_manager.find_session(2024, 'Miami Grand Prix', 'Race', str(tmp_path)) == race
+    assert cache_manager.find_session(2024, 'Miami Grand Prix', 'Sprint Qualifying', str(tmp_path)) == sprint
+    assert cache_manager.find_session(2024, 'Miami Grand Prix', 'Qualifying', str(tmp_path)) is None
+    assert cache_manager.find_session(2024, 'Miami Grand Prix', 'FP1', str(tmp_path)) == practice
+    assert cache_manager.find_session(2023, 'Miami Grand Prix', 'Race', str(tmp_path)) is None
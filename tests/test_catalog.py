@@ -0,0 +1,61 @@
+import os
+import pytest
+from catalog import Catalog, driver_code, slug
+
+
+def write_data(path, events=('Bahrain Grand Prix', 'Miami Grand Prix')):
+    (path / 'events.csv').write_text(',2024\n' + ''.join(f"{index},{name}\n" for index, name in enumerate(events)))
+    (path / 'drivers.csv').write_text(',2024\n0,1 Max Verstappen\n1,16 Charles Leclerc\n')
+    (path / 'laps.csv').write_text('event,laps\nBahrain Grand Prix,57\nMiami Grand Prix,57.0\n')
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    write_data(tmp_path)
+    return Catalog(str(tmp_path))
+
+
+def test_catalog_lookups(catalog):
+    assert catalog.years() == ['2024']
+    assert catalog.events(2024) == ['Bahrain Grand Prix', 'Miami Grand Prix']
+    assert catalog.drivers('2024') == ['1 Max Verstappen', '16 Charles Leclerc']
+    assert catalog.lap_count('Miami Grand Prix') == 57
+    assert catalog.lap_options('Monaco Grand Prix') == []
+    assert catalog.options('2024')['lap_counts'] == {'Bahrain Grand Prix': 57, 'Miami Grand Prix': 57}
+    assert catalog.events(1950) == []
+
+
+def test_catalog_reloads_changed_files(catalog, tmp_path):
+    etag = catalog.etag('2024')
+    write_data(tmp_path, events=('Bahrain Grand Prix', 'Miami Grand Prix', 'Monaco Grand Prix'))
+    stat = os.stat(tmp_path / 'events.csv')
+    os.utime(tmp_path / 'events.csv', ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert catalog.events('2024')[-1] == 'Monaco Grand Prix'
+    assert catalog.etag('2024') != etag
+
+
+def test_missing_files_leave_the_catalog_empty(tmp_path):
+    catalog = Catalog(str(tmp_path))
+    assert catalog.years() == []
+    assert catalog.options('2024') == {'grand_prix_options': [], 'driver_options': [], 'lap_counts': {}}
+
+
+def test_names():
+    assert driver_code('16 Charles Leclerc') == '16'
+    assert slug('São Paulo Grand Prix') == 'São_Paulo_Grand_Prix'
+    assert slug('Sprint_Qualifying ') == 'Sprint_Qualifying'
+
+
+def test_update_options_revalidates_with_etag(app_module, catalog, monkeypatch):
+    monkeypatch.setattr(app_module, 'catalog', catalog)
+    client = app_module.app.test_client()
+
+    response = client.get('/update_options?year=2024')
+    assert response.status_code == 200
+    assert response.json['grand_prix_options'] == ['Bahrain Grand Prix', 'Miami Grand Prix']
+    etag = response.headers['ETag']
+
+    revalidated = client.get('/update_options?year=2024', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers['ETag'] == etag
+    assert client.get('/update_options?year=1950').status_code == 400
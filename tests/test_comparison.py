@@ -0,0 +1,31 @@
+import numpy as np
+from comparison import distance_grid, resample, deltas
+
+
+def test_distance_grid_includes_the_length():
+    assert distance_grid(5.0, step=2.0).tolist() == [0.0, 2.0, 4.0, 5.0]
+    assert distance_grid(0).tolist() == [0.0]
+
+
+def test_resample_interpolates_each_lap_on_its_own():
+    laps = [{'Distance': [0, 10, 20], 'Speed': [100, 200, 300], 'nGear': [3, 4, 5]},
+            {'Distance': [0, 10], 'Speed': [50, 60], 'nGear': [1, 2]}]
+    result = resample(laps, [0, 5, 10, 15, 20], ['Speed', 'nGear'])
+
+    np.testing.assert_allclose(result['Speed'][0], [100, 150, 200, 250, 300])
+    # past the distance the second lap covered there is no data, not extrapolation
+    np.testing.assert_allclose(result['Speed'][1], [50, 55, 60, np.nan, np.nan])
+    # gears are states, taken from the nearest sample
+    np.testing.assert_array_equal(result['nGear'][0], [3, 4, 4, 5, 5])
+
+
+def test_resample_handles_missing_laps():
+    assert resample([], [0, 1], ['Speed'])['Speed'].shape == (0, 2)
+    empty = resample([{'Distance': [], 'Speed': []}], [0, 1], ['Speed'])
+    assert np.isnan(empty['Speed']).all()
+
+
+def test_deltas_are_relative_to_the_reference():
+    elapsed = np.array([[0.0, 1.0, 2.0], [0.0, 1.5, 2.5]])
+    np.testing.assert_allclose(deltas(elapsed), [[0, 0, 0], [0, 0.5, 0.5]])
+    np.testing.assert_allclose(deltas(elapsed, reference=1)[0], [0, -0.5, -0.5])
@@ -0,0 +1,32 @@
+import numpy as np
+from downsample import lttb, stride
+
+
+def test_lttb_keeps_ends_and_peaks():
+    x = np.arange(101)
+    y = np.zeros(101)
+    y[40] = 10
+    y[70] = -10
+    selected = lttb(x, y, 10)
+
+    assert len(selected) == 10
+    assert selected[0] == 0 and selected[-1] == 100
+    assert 40 in selected and 70 in selected
+    assert (np.diff(selected) > 0).all()
+
+
+def test_lttb_returns_everything_below_the_threshold():
+    assert lttb([0, 1, 2], [0, 1, 0], 10).tolist() == [0, 1, 2]
+
+
+def test_lttb_raises_small_thresholds():
+    for threshold in (0, 1, 2):
+        selected = lttb(np.arange(50), np.arange(50), threshold)
+        assert len(selected) == 3
+        assert selected[0] == 0 and selected[-1] == 49
+
+
+def test_stride_keeps_both_ends():
+    assert stride(10, 1).tolist() == [0, 9]
+    assert stride(3, 5).tolist() == [0, 1, 2]
+    assert stride(101, 5).tolist() == [0, 25, 50, 75, 100]
@@ -0,0 +1,55 @@
+import types
+import pytest
+
+QUERY = {'year': '2023', 'grand_prix': 'Bahrain Grand Prix', 'session': 'Race',
+         'driver1': 'VER', 'driver2': 'LEC', 'analysis': 'Lap Time'}
+
+
+@pytest.fixture
+def client(app_module, monkeypatch):
+    rendered = []
+
+    def get_image(input_data, fmt):
+        rendered.append((input_data, fmt))
+        return b'<svg/>' if fmt == 'svg' else b'image'
+
+    monkeypatch.setattr(app_module, 'engine', lambda: types.SimpleNamespace(get_image=get_image))
+    client = app_module.app.test_client()
+    client.rendered = rendered
+    return client
+
+
+def test_image_is_served_with_caching_headers(client):
+    response = client.get('/image', query_string=QUERY)
+    assert response.status_code == 200
+    assert response.data == b'image'
+    assert response.mimetype == 'image/png'
+    assert response.headers['ETag'].startswith('"v')
+    assert response.cache_control.public
+    assert response.cache_control.max_age == 24 * 3600
+    assert not response.cache_control.immutable
+
+
+def test_matching_etag_answers_304_without_rendering(client):
+    etag = client.get('/image', query_string=QUERY).headers['ETag']
+    revalidated = client.get('/image', query_string=QUERY, headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+    assert len(client.rendered) == 1
+
+
+def test_etag_changes_with_format_and_render_version(client, app_module, monkeypatch):
+    png = client.get('/image', query_string=QUERY).headers['ETag']
+    svg = client.get('/image', query_string=dict(QUERY, format='svg'))
+    assert svg.mimetype == 'image/svg+xml'
+    assert svg.headers['ETag'] != png
+
+    monkeypatch.setattr(app_module, 'RENDER_VERSION', app_module.RENDER_VERSION + 1)
+    assert client.get('/image', query_string=QUERY, headers={'If-None-Match': png}).status_code == 200
+
+
+@pytest.mark.parametrize('query', [dict(QUERY, format='gif'), dict(QUERY, analysis='junk'),
+                                   {key: value for key, value in QUERY.items() if key != 'driver2'}])
+def test_bad_requests_are_rejected(client, query):
+    assert client.get('/image', query_string=query).status_code == 400
+    assert client.rendered == []
@@ -0,0 +1,40 @@
+import pytest
+import progress
+from jobs import JobQueue, QueueFull
+
+
+def render(value):
+    progress.report('render')
+    if value < 0:
+        raise ValueError('bad value')
+    return {'key': str(value)}
+
+
+# with workers=0 jobs run inline, which exercises the bookkeeping without a pool
+def test_inline_job_reports_progress_and_result():
+    results, events = [], []
+    queue = JobQueue(render, workers=0, on_result=results.append)
+    job_id = queue.submit(3, listener=lambda kind, body: events.append((kind, body)))
+
+    status = queue.status(job_id)
+    assert status['state'] == 'done'
+    assert status['result'] == {'key': '3'}
+    assert not any(key.startswith('_') for key in status)
+    assert results == [{'key': '3'}]
+    assert [kind for kind, _ in events] == ['progress', 'finished']
+    assert events[0][1]['stage'] == 'render'
+    assert events[1][1]['state'] == 'done'
+
+
+def test_inline_job_failure():
+    queue = JobQueue(render, workers=0)
+    status = queue.status(queue.submit(-1))
+    assert status['state'] == 'failed'
+    assert status['error'] == 'bad value'
+
+
+def test_queue_limit():
+    queue = JobQueue(render, workers=0, max_queue=0)
+    with pytest.raises(QueueFull):
+        queue.submit(1)
+    assert queue.status('unknown') is None
@@ -0,0 +1,91 @@
+import json
+import logging
+import live
+
+START = 1709391600.0
+
+
+def utc(seconds):
+    return f"2024-03-02T15:00:{seconds:06.3f}Z"
+
+
+def car_data(first, count, speed=360):
+    return {'Entries': [{'Utc': utc(first + index), 'Cars': {'1': {'Channels': {
+        '0': 11000, '2': speed, '3': 7, '4': 100, '5': 0}}}} for index in range(count)]}
+
+
+def timing(laps, last=None):
+    line = {'NumberOfLaps': laps}
+    if last:
+        line['LastLapTime'] = {'Value': last}
+    return {'Lines': {'1': line}}
+
+
+# lap 1 starts at 0 s and is driven at 100 m/s for 10 s, which teaches a 1000 m lap
+def session():
+    feed = live.LiveSession(minisectors=4)
+    feed.ingest('TimingData', timing(1), START)
+    feed.ingest('CarData.z', car_data(0, 11), START)
+    feed.ingest('TimingData', timing(2, '1:30.000'), START + 10)
+    return feed
+
+
+def test_full_state_and_lap_stats():
+    feed = session()
+    delta = feed.delta()
+    assert delta['seq'] == feed.seq == 3
+    assert delta['laps'] == [{'driver': '1', 'lap': 2, 'time': 90.0}]
+    assert delta['lap_stats'] == {'1': {'laps': 1, 'best': 90.0, 'last': 90.0, 'mean': 90.0}}
+    assert len(delta['car']['1']['Speed']) == 11
+    assert feed.lap_length == 1000.0
+    json.dumps(delta)
+
+
+def test_delta_only_holds_what_changed_since():
+    feed = session()
+    seen = feed.seq
+    feed.ingest('CarData.z', car_data(11, 5), START)
+    feed.ingest('Position.z', {'Position': [{'Timestamp': utc(12), 'Entries': {'1': {'X': 1, 'Y': 2}}}]}, START)
+
+    delta = feed.delta(seen)
+    assert delta['laps'] == [] and delta['lap_stats'] == {}
+    assert delta['car']['1']['SessionTime'] == [11.0, 12.0, 13.0, 14.0, 15.0]
+    assert delta['car']['1']['Lap'] == [3.0] * 5
+    assert delta['position']['1'] == {'SessionTime': [12.0], 'X': [1.0], 'Y': [2.0]}
+    # the second lap runs 100 m a second from 10 s, so 15 s is at 500 m, the middle of the lap
+    minisectors = delta['minisectors']
+    assert minisectors['fastest'] == ['1', '1', '1', None]
+    assert minisectors['speed']['1'][:3] == [360.0, 360.0, 360.0]
+
+    assert feed.delta(feed.seq)['car'] == {}
+    assert 'car' not in feed.delta(seen, telemetry=False)
+
+
+def test_finish_wakes_waiting_clients():
+    feed = session()
+    feed.finish()
+    assert feed.wait(feed.seq - 1, timeout=0) == feed.seq
+    assert feed.delta(feed.seq)['finished']
+
+
+def test_feed_lines_are_python_literals(caplog):
+    line = """['TimingData', {'Lines': {'1': {'Sectors': {'0': {'Value': None}}, 'Note': "it's True"}}}, '%s']"""
+    topic, message, timestamp = live.parse_line(line % utc(1.5))
+    assert topic == 'TimingData'
+    assert message['Lines']['1'] == {'Sectors': {'0': {'Value': None}}, 'Note': "it's True"}
+    assert timestamp == START + 1.5
+
+    with caplog.at_level(logging.WARNING, logger='live'):
+        assert live.parse_line('{broken') is None
+        assert live.parse_line('') is None
+    assert len(caplog.records) == 1
+
+
+def test_replay_skips_unreadable_lines(tmp_path):
+    path = tmp_path / 'feed.txt'
+    path.write_text('\n'.join([repr(['TimingData', timing(1), utc(0)]), 'not a line',
+                               repr(['TimingData', timing(2, '1:31.500'), utc(1)])]) + '\n')
+    feed = live.LiveSession()
+    live.replay(feed, str(path), speed=0)
+    assert feed.finished
+    assert feed.delta()['laps'] == [{'driver': '1', 'lap': 2, 'time': 91.5}]
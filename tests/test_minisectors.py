@@ -0,0 +1,31 @@
+import numpy as np
+from minisectors import assign_laps, lap_distance, minisector_speeds, fastest_driver
+
+
+def test_assign_laps_skips_samples_between_and_untimed_laps():
+    time = [0.5, 1.5, 2.5, 4.5, 6.0]
+    laps = assign_laps(time, [0, 1, 4, np.nan], [1, 2, 5, 7], [1, 2, 3, 4])
+    np.testing.assert_array_equal(laps, [1, 2, np.nan, 3, np.nan])
+
+
+def test_lap_distance_restarts_every_lap():
+    time = [0, 1, 2, 3, 4]
+    speed = [36, 36, 36, 72, 72]
+    laps = [1, 1, 1, 2, 2]
+    np.testing.assert_allclose(lap_distance(time, speed, laps), [0, 10, 20, 0, 20])
+    assert lap_distance([], [], []).size == 0
+
+
+def test_minisector_speeds_average_laps_equally():
+    # lap 1 has three samples in minisector 0, lap 2 just one
+    speed = np.array([100.0, 100.0, 100.0, 200.0, 150.0])
+    laps = np.array([1, 1, 1, 2, np.nan])
+    minisector = np.array([0, 0, 0, 0, 1])
+    np.testing.assert_allclose(minisector_speeds(speed, laps, minisector, 2), [150, np.nan])
+    assert np.isnan(minisector_speeds(speed, np.full(5, np.nan), minisector, 2)).all()
+
+
+def test_fastest_driver_per_minisector():
+    speeds = [[200, np.nan, 150],
+              [210, np.nan, np.nan]]
+    assert fastest_driver(speeds).tolist() == [1, -1, 0]
@@ -0,0 +1,28 @@
+import os
+from render_cache import RenderCache, render_key
+
+
+def test_render_cache_evicts_oldest_files(tmp_path):
+    cache = RenderCache(str(tmp_path), max_bytes=25)
+    first = cache.put('a', b'x' * 10)
+    second = cache.put('b', b'x' * 10)
+    os.utime(first, (1, 1))
+    os.utime(second, (2, 2))
+    cache.put('c', b'x' * 10)
+
+    assert cache.get('a') is None
+    assert cache.get('b') == second
+    assert cache.stats()['evictions'] == 1
+
+
+def test_render_cache_skips_temp_files(tmp_path):
+    cache = RenderCache(str(tmp_path), max_bytes=100)
+    (tmp_path / '.tmp-half.png').write_bytes(b'x' * 50)
+    cache.put('a', b'x' * 10)
+    assert cache.stats()['entries'] == 1
+
+
+def test_render_key_depends_on_every_value():
+    values = [2024, 'Monaco Grand Prix', 'Race', 'VER', 'LEC', 'Fastest Lap', '1']
+    assert render_key(values) == render_key([str(value) for value in values])
+    assert render_key(values) != render_key(values[:-1] + ['2'])
@@ -0,0 +1,81 @@
+import os
+import season
+import cache_manager
+
+EVENTS = ['Bahrain Grand Prix', 'Miami Grand Prix']
+
+
+def summary(grand_prix, drivers, fingerprint=None):
+    return {'version': season.SUMMARY_VERSION, 'year': '2024', 'grand_prix': grand_prix, 'session': 'Race',
+            'minisectors': season.MINISECTORS, 'fingerprint': fingerprint,
+            'drivers': {number: {'abbreviation': abbreviation, 'laps': 50, 'fastest': median - 1,
+                                 'median': median, 'minisector_wins': wins}
+                        for number, (abbreviation, median, wins) in drivers.items()}}
+
+
+def write(root, grand_prix, drivers, fingerprint=None):
+    season.write_summary(season.summary_path(2024, grand_prix, 'Race', str(root)),
+                         summary(grand_prix, drivers, fingerprint))
+
+
+def add_cached_session(cache_root, folder='2024-03-02_Bahrain_Grand_Prix'):
+    path = os.path.join(str(cache_root), '2024', folder, '2024-03-02_Race')
+    os.makedirs(path)
+    with open(os.path.join(path, 'laps.ff1pkl'), 'wb') as f:
+        f.write(b'data')
+    return path
+
+
+def test_pace_ranks_by_average_gap(tmp_path):
+    write(tmp_path, 'Bahrain Grand Prix', {'1': ('VER', 90.0, 20), '16': ('LEC', 90.9, 5)})
+    write(tmp_path, 'Miami Grand Prix', {'1': ('VER', 91.0, 10), '16': ('LEC', 91.0, 15)})
+    result = season.pace(2024, EVENTS + ['Monaco Grand Prix'], root=str(tmp_path))
+
+    assert result['events'] == EVENTS
+    assert result['missing'] == ['Monaco Grand Prix']
+    assert result['gap_percent'] == {'VER': [0.0, 0.0], 'LEC': [1.0, 0.0]}
+    assert list(result['average_gap_percent']) == ['VER', 'LEC']
+
+
+def test_minisector_wins_are_totalled(tmp_path):
+    write(tmp_path, 'Bahrain Grand Prix', {'1': ('VER', 90.0, 20), '16': ('LEC', 90.9, 5)})
+    write(tmp_path, 'Miami Grand Prix', {'1': ('VER', 91.0, 10), '16': ('LEC', 91.0, 15)})
+    result = season.query('minisectors', 2024, EVENTS, root=str(tmp_path))
+    assert result['wins'] == {'VER': [20, 10], 'LEC': [5, 15]}
+    assert result['total_wins'] == {'VER': 30, 'LEC': 20}
+
+
+def test_outdated_summaries_count_as_missing(tmp_path):
+    write(tmp_path, 'Bahrain Grand Prix', {'1': ('VER', 90.0, 20)})
+    path = season.summary_path(2024, 'Miami Grand Prix', 'Race', str(tmp_path))
+    season.write_summary(path, dict(summary('Miami Grand Prix', {}), version=season.SUMMARY_VERSION - 1))
+    summaries, missing = season.season_summaries(2024, EVENTS, 'Race', str(tmp_path))
+    assert [entry['grand_prix'] for entry in summaries] == ['Bahrain Grand Prix']
+    assert missing == ['Miami Grand Prix']
+
+
+def test_summaries_are_current_while_the_cache_files_are_unchanged(tmp_path):
+    cache_root, root = tmp_path / 'cache', tmp_path / 'summaries'
+    cached = add_cached_session(cache_root)
+    write(root, 'Bahrain Grand Prix', {'1': ('VER', 90.0, 20)}, cache_manager.fingerprint(cached))
+    assert season.current_summary(2024, 'Bahrain Grand Prix', 'Race', str(root), str(cache_root)) is not None
+
+    # fastf1 rewrote a file of the session
+    os.utime(os.path.join(cached, 'laps.ff1pkl'), (10**9, 10**9))
+    assert season.current_summary(2024, 'Bahrain Grand Prix', 'Race', str(root), str(cache_root)) is None
+
+
+def test_update_skips_sessions_without_work(tmp_path):
+    cache_root, root = tmp_path / 'cache', tmp_path / 'summaries'
+    cached = add_cached_session(cache_root)
+    write(root, 'Bahrain Grand Prix', {'1': ('VER', 90.0, 20)}, cache_manager.fingerprint(cached))
+    statuses = list(season.update(2024, EVENTS, ['Race'], root=str(root), cache_root=str(cache_root)))
+    assert statuses == [('Bahrain Grand Prix', 'Race', 'current', ''),
+                        ('Miami Grand Prix', 'Race', 'not cached', '')]
+
+
+def test_read_summary_reuses_the_parsed_file(tmp_path):
+    write(tmp_path, 'Bahrain Grand Prix', {'1': ('VER', 90.0, 20)})
+    path = season.summary_path(2024, 'Bahrain Grand Prix', 'Race', str(tmp_path))
+    assert season.read_summary(path) is season.read_summary(path)
+    assert season.read_summary(str(tmp_path / 'missing.json')) is None
@@ -0,0 +1,74 @@
+import pytest
+from session_cache import SessionCache
+
+
+def test_session_cache_evicts_least_recently_used():
+    cache = SessionCache(max_bytes=25, sizeof=len)
+    cache.put('a', 'x' * 10)
+    cache.put('b', 'x' * 10)
+    cache.get('a')
+    cache.put('c', 'x' * 10)
+
+    assert 'b' not in cache
+    assert 'a' in cache and 'c' in cache
+    assert cache.stats()['evictions'] == 1
+
+
+def test_session_cache_keeps_an_oversized_newest_entry():
+    cache = SessionCache(max_bytes=5, sizeof=len)
+    cache.put('a', 'x' * 3)
+    cache.put('b', 'x' * 10)
+    assert 'a' not in cache and 'b' in cache
+
+
+def test_session_cache_counts_and_parts():
+    cache = SessionCache(max_bytes=100, sizeof=len)
+    assert cache.get('a') is None
+    cache.put('a', 'session', parts=('laps',))
+    assert cache.get('a') == 'session'
+    assert cache.parts('a') == {'laps'}
+    assert cache.parts('b') == frozenset()
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+
+
+def test_session_cache_peek_does_not_count_or_refresh():
+    cache = SessionCache(max_bytes=25, sizeof=len)
+    cache.put('a', 'x' * 10)
+    cache.put('b', 'x' * 10)
+    assert cache.peek('a') == 'x' * 10
+    assert cache.peek('missing') is None
+    cache.put('c', 'x' * 10)
+
+    assert 'a' not in cache
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (0, 0)
+
+
+class SoftFailingSession:
+    """Stands in for a fastf1 session whose first load only logs a warning"""
+
+    api_path = '/static/2024/2024-05-05_Miami_Grand_Prix/2024-05-05_Race/'
+
+    def __init__(self):
+        self.loads = 0
+
+    def load(self, **parts):
+        self.loads += 1
+        if self.loads > 1:
+            self._laps = [{'LapNumber': 1}]
+
+
+def test_parts_that_failed_to_load_are_not_cached(monkeypatch):
+    import script
+    race = SoftFailingSession()
+    monkeypatch.setattr(script, 'session_cache', SessionCache(max_bytes=2**20, sizeof=lambda session: 1))
+    monkeypatch.setattr(script.ff1, 'get_session', lambda *key: race)
+    monkeypatch.setattr(script.cache_manager, 'prepare', lambda *args: None)
+    monkeypatch.setattr(script.cache_manager, 'after_load', lambda *args: None)
+
+    with pytest.raises(script.ff1.exceptions.DataNotLoadedError):
+        script.load_session(2024, 'Miami Grand Prix', 'Race', {'laps'})
+    assert script.load_session(2024, 'Miami Grand Prix', 'Race', {'laps'}) is race
+    assert race.loads == 2
+    assert script.session_cache.parts((2024, 'Miami Grand Prix', 'Race')) == {'laps'}
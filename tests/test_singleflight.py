@@ -0,0 +1,113 @@
+import threading
+import pytest
+from singleflight import SingleFlight
+
+
+# runs do() on several threads at once and returns their results, or exceptions
+def run_together(flight, key, fn, count):
+    results = [None] * count
+
+    def call(index):
+        try:
+            results[index] = flight.do(key, fn)
+        except BaseException as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=call, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def wait_for_waiters(flight, count):
+    while flight.coalesced < count:
+        threading.Event().wait(0.01)
+
+
+def test_concurrent_calls_share_one_run():
+    flight = SingleFlight()
+    release = threading.Event()
+    runs = []
+
+    def load():
+        runs.append(1)
+        release.wait(5)
+        return 'session'
+
+    threads, results = run_together(flight, 'key', load, 4)
+    wait_for_waiters(flight, 3)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ['session'] * 4
+    assert len(runs) == 1
+    assert flight.stats() == {'leaders': 1, 'coalesced': 3, 'in_flight': 0}
+
+
+def test_error_reaches_every_waiter():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def load():
+        release.wait(5)
+        raise ValueError('no data')
+
+    threads, results = run_together(flight, 'key', load, 3)
+    wait_for_waiters(flight, 2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert all(isinstance(result, ValueError) for result in results)
+    # nothing is remembered, the next call runs again
+    assert flight.do('key', lambda: 'retried') == 'retried'
+
+
+def test_waiter_takes_over_from_an_interrupted_leader():
+    flight = SingleFlight()
+    release = threading.Event()
+    runs = []
+
+    def load():
+        runs.append(1)
+        if len(runs) == 1:
+            release.wait(5)
+            raise KeyboardInterrupt()
+        return 'session'
+
+    threads, results = run_together(flight, 'key', load, 2)
+    wait_for_waiters(flight, 1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert 'session' in results
+    assert any(isinstance(result, KeyboardInterrupt) for result in results)
+    assert len(runs) == 2
+
+
+def test_waiter_times_out_without_failing_the_leader():
+    flight = SingleFlight(timeout=0.05)
+    release = threading.Event()
+
+    def load():
+        release.wait(5)
+        return 'session'
+
+    threads, results = run_together(flight, 'key', load, 1)
+    while not flight.in_flight():
+        threading.Event().wait(0.01)
+    with pytest.raises(TimeoutError):
+        flight.do('key', load)
+    release.set()
+    threads[0].join(5)
+    assert results == ['session']
+
+
+def test_lock_files_are_striped(tmp_path):
+    flight = SingleFlight(lock_dir=str(tmp_path), stripes=4)
+    for index in range(20):
+        assert flight.do(('2024', index), lambda: index) == index
+    assert len(list(tmp_path.iterdir())) <= 4
+    assert flight.lock_path('a') == flight.lock_path('a')
@@ -0,0 +1,9 @@
+import benchmark
+
+
+# a fresh app in background warm-up mode answers /health within the budget,
+# and still finishes warming up afterwards
+def test_first_response_within_budget():
+    result = benchmark.measure_startup(repeat=1)
+    assert result['first_response']['seconds'] <= benchmark.STARTUP_BUDGET
+    assert result['ready']['seconds'] >= result['first_response']['seconds']
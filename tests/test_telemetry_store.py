@@ -0,0 +1,86 @@
+import os
+import json
+import numpy as np
+import pytest
+import telemetry_store
+
+
+class Event(dict):
+    year = 2024
+
+
+class FakeRace:
+    """Just the parts of a fastf1 session that write_session reads besides the driver arrays"""
+
+    event = Event(EventName='Miami Grand Prix')
+
+    def __init__(self, drivers):
+        self.drivers = drivers
+
+    def get_driver(self, number):
+        return {'Abbreviation': {'1': 'VER', '16': 'LEC'}[number]}
+
+
+# two laps of four samples each; lap 2 is quicker but was deleted, lap 3 has no telemetry
+def driver_arrays(race, driver):
+    columns = {name: np.arange(8, dtype=float) for name in telemetry_store.COLUMNS}
+    columns['Lap'] = np.array([1, 1, 1, 1, 2, 2, 2, 2], dtype=float)
+    laps = np.zeros(3, dtype=telemetry_store.LAP_DTYPE)
+    laps['LapNumber'] = [1, 2, 3]
+    laps['LapTime'] = [90.0, 89.0, 88.0]
+    laps['IsPersonalBest'] = [True, False, True]
+    laps['Deleted'] = [False, True, False]
+    laps['start'] = [0, 4, 0]
+    laps['stop'] = [4, 8, 0]
+    return columns, laps
+
+
+@pytest.fixture
+def stored(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry_store, '_driver_arrays', driver_arrays)
+    telemetry_store.write_session(FakeRace(['1', '16']), str(tmp_path), 2024, 'Miami Grand Prix', 'Race', 'abc')
+    return telemetry_store.open_session(str(tmp_path), 2024, 'Miami Grand Prix', 'Race')
+
+
+def test_store_round_trip(stored):
+    assert stored.drivers == {'1': 'VER', '16': 'LEC'}
+    assert stored.fingerprint == 'abc'
+    driver = stored.driver('LEC')
+    assert driver is stored.driver('16')
+    assert isinstance(driver.column('Speed'), np.memmap)
+    assert driver.lap(2, ['Speed'])['Speed'].tolist() == [4, 5, 6, 7]
+    assert driver.lap(9, ['Speed'])['Speed'].size == 0
+    assert driver.lap_time(1) == 90.0
+    assert np.isnan(driver.lap_time(9))
+    with pytest.raises(KeyError):
+        stored.driver('HAM')
+
+
+def test_fastest_lap_skips_deleted_laps_and_laps_without_telemetry(stored):
+    assert stored.driver('1').fastest_lap() == 1
+
+
+def test_rewriting_replaces_the_store(stored, tmp_path):
+    telemetry_store.write_session(FakeRace(['1']), str(tmp_path), 2024, 'Miami Grand Prix', 'Race', 'def')
+    rewritten = telemetry_store.open_session(str(tmp_path), 2024, 'Miami Grand Prix', 'Race')
+    assert rewritten.drivers == {'1': 'VER'}
+    assert rewritten.fingerprint == 'def'
+    assert sorted(os.listdir(os.path.dirname(rewritten.path))) == ['Race']
+
+
+def test_a_session_without_drivers_is_not_stored(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry_store, '_driver_arrays', lambda race, driver: None)
+    with pytest.raises(ValueError):
+        telemetry_store.write_session(FakeRace(['1']), str(tmp_path), 2024, 'Miami Grand Prix', 'Race')
+    assert telemetry_store.open_session(str(tmp_path), 2024, 'Miami Grand Prix', 'Race') is None
+    assert os.listdir(tmp_path / '2024' / 'Miami_Grand_Prix') == []
+
+
+@pytest.mark.parametrize('meta', [{'version': telemetry_store.STORE_VERSION - 1, 'drivers': {'1': 'VER'}},
+                                  {'version': telemetry_store.STORE_VERSION, 'drivers': {}}])
+def test_outdated_or_empty_stores_are_ingested_again(tmp_path, meta):
+    path = telemetry_store.session_path(str(tmp_path), 2024, 'Miami Grand Prix', 'Race')
+    os.makedirs(path)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    assert telemetry_store.open_session(str(tmp_path), 2024, 'Miami Grand Prix', 'Race') is None
@@ -0,0 +1,101 @@
+import os
+import numpy as np
+import pytest
+import track_geometry
+
+
+# one lap around a circle of radius metres; positions are in 1/10 m, like fastf1's
+def circle_lap(radius=500.0, samples=2000, shift=0.0):
+    angle = np.linspace(0, 2 * np.pi, samples, endpoint=False)
+    return {'X': radius * 10 * np.cos(angle) + shift, 'Y': radius * 10 * np.sin(angle),
+            'Distance': radius * angle}
+
+
+class FakeDriver:
+    def __init__(self, lap, lap_time):
+        self._lap = lap
+        self._lap_time = lap_time
+
+    def fastest_lap(self):
+        if self._lap is None:
+            raise ValueError("No timed laps")
+        return 7
+
+    def lap_time(self, lap_number):
+        return self._lap_time
+
+    def lap(self, lap_number, names):
+        return {name: self._lap[name] for name in names}
+
+
+class FakeStored:
+    """A stored session whose drivers each have one fastest lap"""
+
+    def __init__(self, laps, year=2024, session='Race'):
+        self.year = year
+        self.session = session
+        self.event_name = 'Test Grand Prix'
+        self._drivers = {str(number): FakeDriver(lap, lap_time) for number, (lap, lap_time) in enumerate(laps, 1)}
+        self.drivers = {number: f"D{number}" for number in self._drivers}
+
+    def driver(self, number):
+        return self._drivers[number]
+
+
+def test_outline_is_evenly_spaced_and_split_into_equal_minisectors():
+    lap = circle_lap()
+    outline = track_geometry.build_outline(lap['X'], lap['Y'], lap['Distance'])
+    assert np.allclose(np.diff(outline['distance']), track_geometry.GRID_STEP)
+
+    geometry = track_geometry.TrackGeometry(outline)
+    segments = geometry.segments(4)
+    assert segments[0] == 0 and segments[-1] == 3
+    assert np.all(np.diff(segments) >= 0)
+    assert np.ptp(np.bincount(segments)) <= 2
+    assert geometry.boundaries(4)[0] == 0
+
+
+def test_samples_are_mapped_onto_minisectors():
+    lap = circle_lap()
+    geometry = track_geometry.TrackGeometry(track_geometry.build_outline(lap['X'], lap['Y'], lap['Distance']))
+    # three eighths of the way round, the middle of the circle and no position at all
+    minisector = geometry.minisectors([-3535.5, 0.0, np.nan], [3535.5, 0.0, 0.0], 4)
+    assert minisector.tolist() == [1, -1, -1]
+    assert geometry.fit(lap['X'], lap['Y']) == 1.0
+    assert geometry.fit(lap['X'] + 1000, lap['Y']) < track_geometry.MIN_FIT
+
+
+def test_build_outline_needs_position_data():
+    with pytest.raises(ValueError):
+        track_geometry.build_outline([np.nan, np.nan], [1, 2], [0, 1])
+
+
+def test_geometry_round_trip(tmp_path):
+    lap = circle_lap()
+    geometry = track_geometry.TrackGeometry(track_geometry.build_outline(lap['X'], lap['Y'], lap['Distance']), 'lap 7')
+    track_geometry.save('Test Grand Prix', geometry, str(tmp_path), layout=1)
+    assert os.listdir(tmp_path) == ['Test_Grand_Prix_layout2.npz']
+    assert track_geometry.load('Test Grand Prix', str(tmp_path)) is None
+
+    loaded = track_geometry.load('Test Grand Prix', str(tmp_path), layout=1)
+    assert loaded.source == 'lap 7'
+    assert np.array_equal(loaded.arc, geometry.arc)
+
+
+def test_sessions_share_a_layout_until_the_track_changes(tmp_path):
+    root = str(tmp_path)
+    first = track_geometry.for_session(FakeStored([(circle_lap(), 91.0), (None, None)]), root)
+    assert 'driver 1 lap 7' in first.source
+    assert track_geometry.for_session(FakeStored([(circle_lap(), 91.0)]), root) is first
+
+    # another season on the same track reuses it, a changed track gets a layout of its own
+    same = track_geometry.for_session(FakeStored([(circle_lap(samples=1500), 90.0)], year=2025), root)
+    changed = track_geometry.for_session(FakeStored([(circle_lap(shift=2000), 90.0)], year=2026), root)
+    assert same is first
+    assert changed is not first
+    assert sorted(os.listdir(tmp_path)) == ['Test_Grand_Prix.npz', 'Test_Grand_Prix_layout2.npz']
+
+
+def test_a_session_without_timed_laps_has_no_geometry(tmp_path):
+    with pytest.raises(ValueError):
+        track_geometry.for_session(FakeStored([(None, None)], year=2030), str(tmp_path))
@@ -0,0 +1,212 @@
+# per-circuit track geometry for the track map
+#
+# the outline of a circuit is built once from a reference lap: resampled to even
+# distance steps, smoothed, and measured along its own length. minisector boundaries
+# are fixed fractions of that length, so they do not move with lap count or outliers,
+# and any lap of any session is mapped onto them through a nearest-point index.
+# geometry is kept per circuit in formula/geometry/ and shared by every session and season
+# that runs on the same layout; a session whose laps do not fit any known layout of its
+# circuit (the track was changed) gets a layout of its own
+import os
+import threading
+import numpy as np
+from scipy.spatial import cKDTree
+from catalog import slug
+
+GEOMETRY_PATH = os.path.join(os.getcwd(), 'formula', 'geometry')
+
+# bump when the way outlines are built changes, so stored geometry is rebuilt
+GEOMETRY_VERSION = 1
+
+# spacing of the resampled outline, in metres of lap distance
+GRID_STEP = 5.0
+
+# points averaged on each side when smoothing the outline
+SMOOTH_WINDOW = 3
+
+# samples further than this from the outline (pit lane, bad position data) are not
+# assigned a minisector; fastf1 positions are in 1/10 m
+MAX_OFFSET = 250
+
+# share of a reference lap's samples that must lie within MAX_OFFSET of a layout's
+# outline for the session to use that layout
+MIN_FIT = 0.95
+
+DEFAULT_MINISECTORS = 25
+MAX_MINISECTORS = 200
+
+
+# layouts after the first one a circuit was seen with get a numbered file
+def geometry_path(circuit, root=GEOMETRY_PATH, layout=0):
+    suffix = f"_layout{layout + 1}" if layout else ''
+    return os.path.join(root, f"{slug(circuit)}{suffix}.npz")
+
+
+# moving average that wraps around, as the outline is a closed loop
+def _smooth(values, window):
+    if window < 1 or len(values) < 2 * window + 1:
+        return values
+    padded = np.concatenate([values[-window:], values, values[:window]])
+    kernel = np.ones(2 * window + 1) / (2 * window + 1)
+    return np.convolve(padded, kernel, mode='valid')
+
+
+# smoothed outline of one lap, resampled every GRID_STEP metres of lap distance
+def build_outline(x, y, distance, step=GRID_STEP, window=SMOOTH_WINDOW):
+    x, y, distance = (np.asarray(values, dtype=float) for values in (x, y, distance))
+    known = ~(np.isnan(x) | np.isnan(y) | np.isnan(distance))
+    x, y, distance = x[known], y[known], distance[known]
+    if len(distance) < 2 or distance[-1] <= distance[0]:
+        raise ValueError("Not enough position data to build a track outline")
+
+    grid = np.arange(distance[0], distance[-1], step)
+    outline_x = _smooth(np.interp(grid, distance, x), window)
+    outline_y = _smooth(np.interp(grid, distance, y), window)
+
+    # length along the smoothed outline itself, which the minisectors divide evenly
+    arc = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(outline_x), np.diff(outline_y)))))
+    return {'x': outline_x, 'y': outline_y, 'distance': grid - grid[0], 'arc': arc}
+
+
+class TrackGeometry:
+    """
+    Reference outline of a circuit with a nearest-point index over it.
+
+    x, y are the outline points, distance the lap distance (m) and arc the
+    length along the outline at each point. Minisectors split the arc into
+    equal parts; locate() and minisectors() map telemetry samples onto them.
+    """
+
+    def __init__(self, outline, source=''):
+        self.x = outline['x']
+        self.y = outline['y']
+        self.distance = outline['distance']
+        self.arc = outline['arc']
+        self.source = source
+        self.tree = cKDTree(np.column_stack([self.x, self.y]))
+        self._segments = {}
+
+    # minisector (0 .. count - 1) of every outline point
+    def segments(self, count):
+        if count not in self._segments:
+            index = np.floor(self.arc / self.arc[-1] * count).astype(int)
+            self._segments[count] = np.clip(index, 0, count - 1)
+        return self._segments[count]
+
+    # outline index where each minisector starts
+    def boundaries(self, count):
+        return np.searchsorted(self.segments(count), np.arange(count))
+
+    # nearest outline point of every sample, -1 for samples too far off the track
+    def locate(self, x, y):
+        points = np.column_stack([np.asarray(x, dtype=float), np.asarray(y, dtype=float)])
+        known = ~np.isnan(points).any(axis=1)
+        index = np.full(len(points), -1)
+        if known.any():
+            _, nearest = self.tree.query(points[known], distance_upper_bound=MAX_OFFSET)
+            index[known] = np.where(nearest < len(self.x), nearest, -1)
+        return index
+
+    # minisector of every sample, -1 for samples too far off the track
+    def minisectors(self, x, y, count):
+        index = self.locate(x, y)
+        return np.where(index >= 0, self.segments(count)[index], -1)
+
+    # share of the known samples within MAX_OFFSET of the outline
+    def fit(self, x, y):
+        index = self.locate(x, y)
+        known = ~(np.isnan(np.asarray(x, dtype=float)) | np.isnan(np.asarray(y, dtype=float)))
+        return float((index[known] >= 0).mean()) if known.any() else 0.0
+
+
+# known layouts of every circuit, along with their nearest-point index, and the layout
+# each session was matched to
+_loaded = {}
+_matched = {}
+_lock = threading.Lock()
+
+
+def load(circuit, root=GEOMETRY_PATH, layout=0):
+    path = geometry_path(circuit, root, layout)
+    try:
+        with np.load(path) as stored:
+            if int(stored['version']) != GEOMETRY_VERSION:
+                return None
+            outline = {name: stored[name] for name in ('x', 'y', 'distance', 'arc')}
+            source = str(stored['source'])
+    except (FileNotFoundError, KeyError, ValueError, OSError):
+        return None
+    return TrackGeometry(outline, source)
+
+
+def save(circuit, geometry, root=GEOMETRY_PATH, layout=0):
+    os.makedirs(root, exist_ok=True)
+    path = geometry_path(circuit, root, layout)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        np.savez(f, version=GEOMETRY_VERSION, source=geometry.source, x=geometry.x, y=geometry.y,
+                 distance=geometry.distance, arc=geometry.arc)
+    os.replace(tmp, path)
+
+
+# every stored layout of a circuit, in the order they were first seen
+def _layouts(circuit, root):
+    layouts = []
+    while True:
+        geometry = load(circuit, root, len(layouts))
+        if geometry is None:
+            return layouts
+        layouts.append(geometry)
+
+
+# geometry of the circuit of a stored session, built from its fastest lap the first time
+# the circuit is seen; circuits are identified by event name, so every season shares it
+# as long as the session's fastest lap fits the outline, else a new layout is added
+def for_session(stored, root=None):
+    root = root or GEOMETRY_PATH
+    circuit = stored.event_name
+    session = (root, stored.year, circuit, stored.session)
+    with _lock:
+        if session in _matched:
+            return _matched[session]
+
+    lap = _reference_lap(stored)
+    with _lock:
+        if (root, circuit) not in _loaded:
+            _loaded[(root, circuit)] = _layouts(circuit, root)
+        layouts = _loaded[(root, circuit)]
+        geometry = _fitting(layouts, lap)
+        if geometry is None:
+            # another process may have added the layout since they were read
+            layouts[:] = _layouts(circuit, root)
+            geometry = _fitting(layouts, lap)
+        if geometry is None:
+            geometry = TrackGeometry(build_outline(lap['X'], lap['Y'], lap['Distance']), lap['source'])
+            save(circuit, geometry, root, len(layouts))
+            layouts.append(geometry)
+        return _matched.setdefault(session, geometry)
+
+
+def _fitting(layouts, lap):
+    return next((layout for layout in layouts if layout.fit(lap['X'], lap['Y']) >= MIN_FIT), None)
+
+
+# position data of the fastest lap of a session, over all drivers
+def _reference_lap(stored):
+    best = None
+    for number in stored.drivers:
+        driver = stored.driver(number)
+        try:
+            lap_number = driver.fastest_lap()
+        except ValueError:
+            continue
+        lap_time = driver.lap_time(lap_number)
+        if best is None or lap_time < best[0]:
+            best = (lap_time, number, lap_number)
+    if best is None:
+        raise ValueError(f"No timed laps to build the {stored.event_name} outline from")
+
+    _, number, lap_number = best
+    lap = stored.driver(number).lap(lap_number, ['X', 'Y', 'Distance'])
+    lap['source'] = f"{stored.year} {stored.event_name} {stored.session}, driver {number} lap {lap_number}"
+    return lap